@@ -1,31 +1,680 @@
 #!/usr/bin/env python3
 import base64
+import copy
 import ctypes
 import io
 import json
+import math
+import random
 import os
+import shlex
+import shutil
+import signal
 import subprocess
+import sys
+import tempfile
+import threading
 import time
 import traceback
 from collections import Counter
 from datetime import datetime, date
-from multiprocessing import Pool
-from pathlib import Path
+from multiprocessing import Pool, Value
 
+import numpy as np
 import pandas as pd
 from geographiclib.geodesic import Geodesic
 from matplotlib import pyplot as plt
-from natsort import natsorted
 
-from plot import plot_from_files, Case
+from build_graphs import get_n_targets
+from case_bundle import is_bundle, list_case, open_bundle, split_case
+from case_index import detect_flavour, find_cases
+from case_validation import validate_cases
+from plot import OUTPUT_FILES, plot_from_files, plot_variants, load_json, Case
+from progress import ProgressMetrics
+from report_io import report_frame, save_report, read_report
+from work_queue import DirectoryQueue, run_worker
+from solver_output import DEFAULT_PARSERS, parse_log, parse_output
+
+
+REPORT_CSS = """
+*{font-family: sans-serif;}
+h2 {margin-top: 2em;}
+.case {
+    display: flex;
+    max-height: 540pt;
+    font-family: sans-serif;
+}
+.case .pic {
+    flex: 1;
+}
+.case .stdout {
+    flex: 1;
+    border: 1px black solid;
+    padding: 0;
+    display: flex;
+    flex-direction: column;
+    background: #555;
+    overflow-y: auto;
+}
+.stdout pre {
+    max-height: 100%;
+    overflow-y: auto;
+    color: #fff;
+    margin: 0;
+    padding: 1em;
+    white-space: pre-line;
+    font-family: monospace;
+}
+.stdout pre.cmd::before {
+    content: '$ ';
+    font-weight: bold;
+}
+.stdout pre.cmd {background: #222;}
+.stdout p{
+    border-bottom: 1px black solid;
+    padding: 0.5em;
+    margin: 0;
+    font: 400 13.3333px sans-serif;
+}
+.stdout input[type=checkbox] {
+    visibility: visible;
+    height: 2em;
+    width: 100%;
+    margin: 0;
+}
+.stdout input[type=checkbox]:after, .stdout p{
+    visibility: visible;
+    display: block;
+    padding: 0.5em;
+    background: #fff;
+}
+
+.stdout input[type=checkbox] + div {
+    display: none;
+}
+.stdout input[type=checkbox]:checked + div {
+    display: block;
+}
+.stdout input[type=checkbox]::after{content: '▸ ' attr(text);}
+.stdout input[type=checkbox]:checked::after{content: '▾ ' attr(text);}
+img{
+    image-rendering: -moz-crisp-edges;         /* Firefox */
+    image-rendering:   -o-crisp-edges;         /* Opera */
+    image-rendering: -webkit-optimize-contrast;/* Webkit (non-standard naming) */
+    image-rendering: crisp-edges;
+    -ms-interpolation-mode: nearest-neighbor;
+}
+table.summary {
+    border-collapse: collapse;
+}
+
+table.summary td[code="0"]{
+    background-color: green;
+    color: white;
+}
+table.summary td[code="1"]{
+    background-color: darkorange;
+    color: white;
+}
+table.summary td[code="2"]{
+    background-color: red;
+    color: white;
+}
+"""
+
+HTML_HEADER = """<!DOCTYPE HTML>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Results from {datetime}</title>
+<style>{styles}</style>
+</head>
+<body>
+<h1>Report from {datetime} {rvo}</h1>
+"""
+
+CASE_TEMPLATE = """<div>
+    <h2 id="case_{case_i}">{casename}</h2>
+    <div class="case">
+    <div class="pic">
+    <picture>{image}</picture>
+    </div>
+    <div class="stdout">
+    <p>Return code: {return_code}</p>
+    <p>Execution time: {exec_time} seconds (min {exec_time_min}, IQR {exec_time_iqr})</p>
+    <p>CPU time: {cpu_user} s user, {cpu_sys} s system</p>
+    <p>Peak RSS: {max_rss_kb} KB, I/O blocks: {io_read_blocks} in, {io_write_blocks} out</p>
+    <input type="checkbox" text="Situation report">
+    <div><pre>{nav_report}</pre></div>
+    <input type="checkbox" text="STDOUT"{checked}><div>
+    <pre class="cmd">{command}</pre>
+    <pre>{stdout}</pre></div>
+    {variants}
+    </div></div></div>
+"""
+
+VARIANT_TEMPLATE = """<h3>{name}</h3>
+    <p>Return code: {code}, execution time: {exec_time} seconds</p>
+    <input type="checkbox" text="STDOUT"><div>
+    <pre class="cmd">{command}</pre>
+    <pre>{stdout}</pre></div>
+"""
+
+
+# Parameters of first two targets relative to our ship
+TARGET_PARAMS = ['dist1', 'dist2', 'course1', 'course2', 'peleng1', 'peleng2']
+
+# Resource usage columns, filled from rusage of solver process
+RESOURCE_COLUMNS = ['cpu_user', 'cpu_sys', 'max_rss_kb', 'io_read_blocks', 'io_write_blocks']
 
 
 def fix_returncode(code):
     return ctypes.c_int32(code).value
 
 
+def rusage_to_dict(rusage):
+    """
+    Converts rusage of finished process to report columns
+    @param rusage: resource.struct_rusage or None
+    @return: dict with RESOURCE_COLUMNS keys
+    """
+    if rusage is None:
+        return dict.fromkeys(RESOURCE_COLUMNS)
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    max_rss = rusage.ru_maxrss / 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return {'cpu_user': rusage.ru_utime,
+            'cpu_sys': rusage.ru_stime,
+            'max_rss_kb': max_rss,
+            'io_read_blocks': rusage.ru_inblock,
+            'io_write_blocks': rusage.ru_oublock}
+
+
+def run_solver(command, timeout, cwd=None, log_file=None):
+    """
+    Runs solver and collects its resource usage. On POSIX the process is reaped
+    with os.wait4, which returns rusage of this very process; elsewhere resource
+    columns are None.
+    Note: on Linux peak RSS of a child is never lower than RSS of the spawning worker.
+    Solver is started in its own session, and on timeout the whole process group
+    is killed, so its children don't outlive it.
+    @param command: command line
+    @param timeout: timeout in seconds
+    @param cwd: working directory of solver
+    @param log_file: file to stream output into, output of CompletedProcess is None then;
+    by default output is captured in memory
+    @return: CompletedProcess and dict with resource usage
+    @raise subprocess.TimeoutExpired: with resource usage of killed process in 'resources'
+    """
+    log = open(log_file, 'wb') if log_file is not None else None
+    try:
+        return _run_solver(command, timeout, cwd, log)
+    finally:
+        if log is not None:
+            log.close()
+
+
+def _run_solver(command, timeout, cwd, log):
+    stdout = log if log is not None else subprocess.PIPE
+    if not hasattr(os, 'wait4'):
+        proc = subprocess.run(command, stdout=stdout, stderr=subprocess.STDOUT,
+                              stdin=subprocess.PIPE, timeout=timeout, cwd=cwd)
+        return proc, rusage_to_dict(None)
+
+    proc = subprocess.Popen(command, stdout=stdout, stderr=subprocess.STDOUT, stdin=subprocess.PIPE,
+                            cwd=cwd, start_new_session=True)
+    proc.stdin.close()
+    output = [None]
+    status = []
+    threads = [threading.Thread(target=lambda: status.append(os.wait4(proc.pid, 0)))]
+    if log is None:
+        threads.append(threading.Thread(target=lambda: output.__setitem__(0, proc.stdout.read())))
+    for thread in threads:
+        thread.start()
+    waiter = threads[0]
+    waiter.join(timeout)
+    killed = waiter.is_alive()
+    if killed:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    for thread in threads:
+        thread.join()
+    if log is None:
+        proc.stdout.close()
+
+    _, wait_status, rusage = status[0]
+    # Process is already reaped, Popen must not wait for it
+    if os.WIFSIGNALED(wait_status):
+        proc.returncode = -os.WTERMSIG(wait_status)
+    else:
+        proc.returncode = os.WEXITSTATUS(wait_status)
+    resources = rusage_to_dict(rusage)
+    if killed:
+        ex = subprocess.TimeoutExpired(command, timeout, output=output[0])
+        ex.resources = resources
+        raise ex
+    return subprocess.CompletedProcess(command, proc.returncode, output[0]), resources
+
+
+def solver_stdout(run):
+    """
+    Returns solver output of case or variant, reading it from log file if it was streamed there
+    @param run: case or variant dict
+    @return: output text
+    """
+    if run["proc"] is None:
+        return "TIME_ERR"
+    if run["proc"].stdout is not None:
+        return run["proc"].stdout.decode("utf-8")
+    try:
+        with open(run["log_file"], encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except (OSError, TypeError):
+        return ""
+
+
+def physical_cores():
+    """
+    Returns one logical CPU for every physical core available to this process
+    @return: list of CPU numbers
+    """
+    try:
+        available = os.sched_getaffinity(0)
+    except AttributeError:
+        return list(range(os.cpu_count()))
+    cores = {}
+    try:
+        with open('/proc/cpuinfo') as f:
+            cpu, package = None, None
+            for line in f:
+                key, _, value = line.partition(':')
+                key, value = key.strip(), value.strip()
+                if key == 'processor':
+                    cpu = int(value)
+                elif key == 'physical id':
+                    package = value
+                elif key == 'core id' and cpu in available:
+                    cores.setdefault((package, value), cpu)
+    except (OSError, ValueError):
+        pass
+    if not cores:
+        return sorted(available)
+    return sorted(cores.values())
+
+
+def pin_worker(counter, cpus):
+    """
+    Pool initializer, pins every worker (and solvers it starts) to its own CPU
+    @param counter: shared counter of started workers
+    @param cpus: CPUs to pin to
+    """
+    with counter.get_lock():
+        n = counter.value
+        counter.value += 1
+    os.sched_setaffinity(0, {cpus[n % len(cpus)]})
+
+
+# Abort flag of pool worker, see init_worker
+_abort = None
+
+
+def init_worker(abort, counter=None, cpus=None):
+    """
+    Pool initializer, keeps abort flag and pins worker, if CPUs are given
+    @param abort: shared flag, set when run is aborted; may be None
+    """
+    global _abort
+    _abort = abort
+    if cpus is not None:
+        pin_worker(counter, cpus)
+
+
+class FailFast:
+    """
+    Tracks failure rate of finished cases for aborting run
+    """
+
+    def __init__(self, rate, min_cases=20, ok_codes=(0,)):
+        """
+        @param rate: failure rate, above which run is aborted
+        @param min_cases: number of finished cases, before which run is never aborted
+        @param ok_codes: return codes, which are not failures
+        """
+        self.rate = rate
+        self.min_cases = min_cases
+        self.ok_codes = set(ok_codes)
+        self.done = 0
+        self.failed = 0
+
+    def update(self, case):
+        """
+        Accounts finished case
+        @param case: case dict, None for skipped case
+        @return: True, if run must be aborted
+        """
+        if case is None:
+            return False
+        self.done += 1
+        self.failed += case["code"] not in self.ok_codes
+        return self.done >= self.min_cases and self.failed / self.done > self.rate
+
+
+def case_stratum(datadir, dist_step=1.):
+    """
+    Stratum of generated case by its folder name sc_<dist1>_<dist2>_...:
+    number of targets and distance to nearest target, rounded to dist_step
+    @param datadir: case directory
+    @param dist_step: width of distance bin, nm
+    @return: (number of targets, distance bin) or None for other names
+    """
+    name = os.path.split(datadir)[1]
+    try:
+        n_targets = get_n_targets(name)
+        dist1, dist2 = (float(x) for x in name.split('_')[1:3])
+    except (IndexError, ValueError):
+        return None
+    dist = max(dist1, dist2) if n_targets == 1 else min(dist1, dist2)
+    return n_targets, math.floor(dist / dist_step)
+
+
+def stratified_sample(directories_list, size, seed=0, dist_step=1.):
+    """
+    Random sample of cases, stratified by number of targets and distance.
+    Strata are sampled proportionally to their size, every stratum gets at least one case
+    while size allows.
+    @param directories_list: list of case directories
+    @param size: number of cases or, if less than 1, fraction of cases
+    @param seed: random seed
+    @param dist_step: width of distance bin, nm
+    @return: sampled directories in original order
+    """
+    if size < 1:
+        size = round(size * len(directories_list))
+    size = int(min(size, len(directories_list)))
+    strata = {}
+    for i, datadir in enumerate(directories_list):
+        strata.setdefault(case_stratum(datadir, dist_step), []).append(i)
+    keys = sorted(strata, key=str)
+    quotas = {key: len(strata[key]) * size / len(directories_list) for key in keys}
+    least = 1 if size >= len(keys) else 0
+    counts = {key: max(least, math.floor(quotas[key])) for key in keys}
+    while sum(counts.values()) > size:
+        counts[max(keys, key=lambda key: counts[key])] -= 1
+    while sum(counts.values()) < size:
+        key = max([key for key in keys if counts[key] < len(strata[key])], key=lambda key: quotas[key] - counts[key])
+        counts[key] += 1
+    rng = random.Random(seed)
+    chosen = sorted(i for key in keys for i in rng.sample(strata[key], counts[key]))
+    return [directories_list[i] for i in chosen]
+
+
+def timing_stats(exec_times):
+    """
+    Statistics of repeated solver runs
+    @param exec_times: list of execution times
+    @return: dict with median, min and interquartile range
+    """
+    q1, median, q3 = np.percentile(exec_times, [25, 50, 75])
+    return {"exec_time": float(median),
+            "exec_time_min": min(exec_times),
+            "exec_time_iqr": float(q3 - q1),
+            "exec_times": list(exec_times)}
+
+
+def mann_whitney_p(a, b):
+    """
+    Two-sided p-value of Mann-Whitney U test, normal approximation with tie correction
+    @param a: first sample
+    @param b: second sample
+    @return: p-value
+    """
+    n1, n2 = len(a), len(b)
+    if n1 == 0 or n2 == 0:
+        return float('nan')
+    ranks = pd.Series(list(a) + list(b)).rank().values
+    u = ranks[:n1].sum() - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    ties = Counter(ranks).values()
+    sigma_sq = n1 * n2 / 12 * ((n + 1) - sum(t ** 3 - t for t in ties) / (n * (n - 1)))
+    if sigma_sq <= 0:
+        return 1.
+    z = (abs(u - n1 * n2 / 2) - .5) / math.sqrt(sigma_sq)
+    return min(1., math.erfc(max(z, 0) / math.sqrt(2)))
+
+
+def compare_reports(report_a, report_b, alpha=0.05):
+    """
+    Compares execution times of two runs of the same cases
+    @param report_a: Report of executable A
+    @param report_b: Report of executable B
+    @param alpha: significance level
+    @return: DataFrame with one row per case
+    """
+    cases_b = {case["datadir"]: case for case in report_b.cases if case is not None}
+    rows = []
+    for case_a in report_a.cases:
+        if case_a is None or case_a["datadir"] not in cases_b:
+            continue
+        case_b = cases_b[case_a["datadir"]]
+        times_a = case_a.get("exec_times", [case_a["exec_time"]])
+        times_b = case_b.get("exec_times", [case_b["exec_time"]])
+        p = mann_whitney_p(times_a, times_b)
+        rows.append({"datadir": case_a["datadir"],
+                     "code_a": case_a["code"],
+                     "code_b": case_b["code"],
+                     "median_a": case_a["exec_time"],
+                     "median_b": case_b["exec_time"],
+                     "ratio": case_b["exec_time"] / case_a["exec_time"] if case_a["exec_time"] else float('nan'),
+                     "p_value": p,
+                     "significant": p < alpha})
+    return pd.DataFrame(rows, columns=["datadir", "code_a", "code_b", "median_a", "median_b",
+                                       "ratio", "p_value", "significant"])
+
+
+def geometric_mean_ratio(ab):
+    """
+    Geometric mean of time ratios B/A over cases, where both times are finite and positive
+    @param ab: DataFrame from compare_reports
+    @return: (ratio or NaN if there are no such cases, number of used cases)
+    """
+    a = ab['median_a'].astype(float).to_numpy()
+    b = ab['median_b'].astype(float).to_numpy()
+    valid = np.isfinite(a) & np.isfinite(b) & (a > 0) & (b > 0)
+    if not valid.any():
+        return float('nan'), 0
+    return float(np.exp(np.log(b[valid] / a[valid]).mean())), int(valid.sum())
+
+
+def remove_files(directory, names):
+    for name in names:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+
+
+def copy_files(src, dst, names):
+    for name in names:
+        path = os.path.join(src, name)
+        if os.path.isfile(path):
+            shutil.copyfile(path, os.path.join(dst, name))
+
+
+def stage_case(datadir, scratch, exclude=()):
+    """
+    Copies case input files to new directory in scratch (e.g. tmpfs /dev/shm),
+    case in bundle is extracted there
+    @param datadir: case directory or case in bundle
+    @param scratch: scratch root directory, default temporary directory if None
+    @param exclude: names of files not to copy, like old results
+    @return: path of staged case
+    """
+    run_dir = tempfile.mkdtemp(prefix=os.path.split(datadir)[1] + '_', dir=scratch)
+    in_bundle = split_case(datadir)
+    if in_bundle is not None:
+        bundle, case = in_bundle
+        open_bundle(bundle).extract(case, run_dir, exclude)
+    else:
+        copy_files(datadir, run_dir, [name for name in os.listdir(datadir) if name not in exclude])
+    return run_dir
+
+
+def render_image(plot_function, *args):
+    """
+    Plots case and returns it as HTML image tag
+    @param plot_function: function, which returns figure, e.g. plot_from_files
+    @param args: arguments of plot_function
+    @return: img tag with embedded PNG, or message if plot failed
+    """
+    try:
+        fig = plot_function(*args)
+
+        f = io.BytesIO()
+        fig.savefig(f, format="png", dpi=300)
+        image_data = '<img width="100%" src="data:image/png;base64,{}">'.format(
+            base64.b64encode(f.getvalue()).decode())
+        plt.close(fig)
+    except Exception as ex:
+        template = "<pre>Plot failed: An exception of type {} occurred.\n{}</pre>"
+        image_data = template.format(type(ex).__name__, traceback.format_exc())
+    return image_data
+
+
+def render_case_dir(datadir, results_dir=None):
+    case_filenames = getattr(Case, detect_flavour(list_case(datadir)) or 'CASE_FILENAMES_KT')
+    return render_image(plot_from_files, os.path.join(datadir, case_filenames['nav_data']), results_dir)
+
+
+def render_case_paths(paths):
+    """
+    render_case_dir for pool, paths are (case directory, results directory or None)
+    """
+    return render_case_dir(*paths)
+
+
+def parse_variant(spec, executable):
+    """
+    Parses solver variant given as NAME=[EXECUTABLE] [FLAGS...]
+    @param spec: variant string, e.g. 'rvo=--rvo-enable' or 'new=./usv-new --rvo-enable'
+    @param executable: default executable, used if variant has only flags
+    @return: (name, executable, flags)
+    """
+    name, _, rest = spec.partition('=')
+    tokens = shlex.split(rest)
+    if tokens and not tokens[0].startswith('-'):
+        return name, os.path.abspath(tokens[0]), tokens[1:]
+    return name, executable, tokens
+
+
+def picture_mode(args):
+    """
+    Decides, when pictures of cases are rendered. Only HTML and Excel reports keep pictures,
+    without them none are rendered.
+    With baseline, pictures are rendered after the run only for changed cases. Paged HTML renders them
+    page by page, so they don't pile up in memory. Pictures of variants are drawn from maneuvers
+    of the run itself, which may be gone after it, and Excel report needs pictures of every case,
+    so then they are rendered during the run.
+    @param args: parsed command line arguments
+    @return: (nopic, lazy): don't render pictures during the run, render them for HTML after it
+    """
+    if args.html_file is None and args.excel_file is None:
+        return True, False
+    lazy = (args.excel_file is None and not args.variant
+            and (args.baseline is not None or args.page_size is not None))
+    return args.nopic or lazy, lazy and not args.nopic
+
+
+def _differs(a, b):
+    a = a.astype(object).where(a.notna(), None)
+    b = b.astype(object).where(b.notna(), None)
+    return ~((a == b) | (a.isna() & b.isna()))
+
+
+def diff_reports(baseline, current, threshold=0.5, min_delta=0.1):
+    """
+    Finds cases, which changed between two runs
+    @param baseline: report DataFrame of baseline run
+    @param current: report DataFrame of current run
+    @param threshold: relative exec time growth, which is a regression
+    @param min_delta: minimal exec time growth in seconds, which is a regression
+    @return: DataFrame with changed cases and comma separated list of changes
+    """
+    columns = ['code', 'type1', 'type2', 'right', 'exec_time']
+    baseline = baseline[['datadir'] + [c for c in columns if c in baseline.columns]].copy()
+    current = current[['datadir'] + [c for c in columns if c in current.columns]].copy()
+    baseline['datadir'] = baseline['datadir'].map(lambda name: os.path.split(str(name))[1])
+    df = current.merge(baseline, on='datadir', how='outer', suffixes=('', '_base'), indicator=True)
+
+    changes = [pd.Series('', index=df.index)]
+    changes.append(df['_merge'].map({'left_only': 'new,', 'right_only': 'removed,', 'both': ''}).astype(str))
+    both = df['_merge'] == 'both'
+    for column, label in (('code', 'code'), ('type1', 'scenario_type'), ('type2', 'scenario_type'),
+                          ('right', 'turn')):
+        if column in current.columns and column in baseline.columns:
+            changed = both & _differs(df[column], df[column + '_base'])
+            changes.append(changed.map({True: label + ',', False: ''}))
+    if 'exec_time' in current.columns and 'exec_time' in baseline.columns:
+        delta = df['exec_time'] - df['exec_time_base']
+        slower = both & (delta > min_delta) & (df['exec_time'] > df['exec_time_base'] * (1 + threshold))
+        changes.append(slower.map({True: 'exec_time,', False: ''}))
+
+    df['changes'] = sum(changes[1:], changes[0]).str.rstrip(',')
+    # Same scenario_type label may be added twice
+    df['changes'] = df['changes'].map(lambda c: ','.join(dict.fromkeys(c.split(','))) if c else c)
+    return df[df['changes'] != ''].drop(columns='_merge').reset_index(drop=True)
+
+
+def load_history(filename):
+    """
+    Loads execution times of previous run from report or metainfo.csv
+    @param filename: report file (any format of read_report) or metainfo.csv
+    @return: dict, case name -> execution time
+    """
+    df = read_report(filename)
+    if 'exec_time' not in df.columns:
+        return {}
+    names = df['datadir'] if 'datadir' in df.columns else df['datadirs']
+    return {os.path.split(str(name))[1]: t for name, t in zip(names, df['exec_time']) if pd.notna(t)}
+
+
+def schedule(directories_list, history):
+    """
+    Orders cases longest expected first (LPT), so slow cases don't end up
+    in the tail of the run. Cases without history are expected to take
+    median time of known ones.
+    @param directories_list: list of case directories
+    @param history: dict, case name -> execution time
+    @return: list of indices in directories_list
+    """
+    if not history:
+        return list(range(len(directories_list)))
+    default = float(np.median(list(history.values())))
+    expected = [history.get(os.path.split(d)[1], default) for d in directories_list]
+    return sorted(range(len(directories_list)), key=lambda i: -expected[i])
+
+
+def adaptive_timeouts(directories_list, history, min_timeout, max_timeout, factor, percentile=95):
+    """
+    Per-case solver timeouts: execution time from previous run times factor.
+    Cases without history get percentile of known times times factor.
+    @param directories_list: list of case directories
+    @param history: dict, case name -> execution time
+    @param min_timeout: lower bound of timeout, seconds
+    @param max_timeout: upper bound of timeout, seconds
+    @param factor: multiplier for historical time
+    @param percentile: percentile of historical times for unknown cases
+    @return: list of timeouts
+    """
+    if not history or factor is None:
+        return [min_timeout] * len(directories_list)
+    default = float(np.percentile(list(history.values()), percentile))
+    return [min(max(factor * history.get(os.path.split(d)[1], default), min_timeout), max_timeout)
+            for d in directories_list]
+
+
 class ReportGenerator:
-    def __init__(self, executable):
+    def __init__(self, executable, repeat=1, pin=False):
         self.exe = executable
         self.cases = []
         self.work_dir = os.path.abspath(os.getcwd())
@@ -33,206 +682,500 @@ class ReportGenerator:
         self.rvo = None
         self.nopic = None
         self.fast = False
+        # Benchmark mode: every case is run repeat times, workers may be pinned to cores
+        self.repeat = repeat
+        self.pin = pin
+        # Solver timeout, seconds. With timeout_factor set, timeouts are derived from history
+        self.timeout = 6
+        self.max_timeout = 60
+        self.timeout_factor = None
+        # Timed out cases are rerun in smaller pool with timeout multiplied by retry_factor
+        self.retry_factor = None
+        self.retry_processes = max(1, os.cpu_count() // 4)
+        # Cases may be staged to scratch directory (e.g. tmpfs), results are kept in results_dir
+        # or copied back to case directory
+        self.scratch = None
+        self.results_dir = None
+        # List of (name, executable, flags) solver variants to run on every case
+        self.variants = None
+        # Smoke run: stratified sample size (number or fraction of cases) and its seed
+        self.sample = None
+        self.sample_seed = 0
+        # Fail fast: abort, when more than abort_rate of at least abort_min_cases cases fail
+        self.abort_rate = None
+        self.abort_min_cases = 20
+        self.ok_codes = (0,)
+        self.aborted = False
+        # File with live progress metrics, JSON or Prometheus text for .prom
+        self.progress_file = None
+        # Shared queue directory, cases are run by workers instead of local pool if set
+        self.queue_dir = None
+        self.lease_timeout = 120
+        # Check cases before running solver, invalid ones are skipped and kept here with reasons
+        self.validate = True
+        self.invalid = {}
+        # Directory for solver logs, output is kept in memory if None
+        self.log_dir = None
+        # Results and logs of the run are kept under run_id, cases by their path relative to root
+        self.run_id = '{:%Y%m%d-%H%M%S}-{}'.format(datetime.now(), os.getpid())
+        self.root = None
+        # Functions, which extract metrics columns from lines of solver output
+        self.stdout_parsers = DEFAULT_PARSERS
 
-    def generate(self, data_directory, glob='*', rvo=None, nopic=False):
+    def pool(self, processes=None, abort=None):
+        """
+        Creates worker pool. In benchmark mode concurrency is capped to physical cores.
+        @param processes: number of workers, default is number of cores
+        @param abort: shared flag, workers skip their tasks once it is set
+        """
+        if self.repeat == 1 and not self.pin:
+            return Pool(processes, initializer=init_worker, initargs=(abort,))
+        if self.pin and not hasattr(os, 'sched_setaffinity'):
+            print("Warning: pinning to cores is not supported on this platform, workers are not pinned")
+            self.pin = False
+        cpus = physical_cores()
+        processes = min(processes or len(cpus), len(cpus))
+        if self.pin:
+            return Pool(processes, initializer=init_worker, initargs=(abort, Value('i', 0), cpus))
+        return Pool(processes, initializer=init_worker, initargs=(abort,))
+
+    def generate(self, data_directory, glob='*', rvo=None, nopic=False, history=None):
         self.rvo = rvo
         self.nopic = nopic
-        directories_list = []
-        try:
-            df = pd.read_csv(data_directory + '/metainfo.csv', index_col=False)
-            directories_list = df['datadirs'].values
-        except FileNotFoundError:
-            if not self.fast:
-                for path in Path(data_directory).glob(glob):
-                    for root, dirs, files in os.walk(path):
-                        if "nav-data.json" in files or 'navigation.json' in files:
-                            directories_list.append(os.path.join(data_directory, root))
-                directories_list = natsorted(directories_list)
-                df = pd.DataFrame()
-                df['datadirs'] = directories_list
-                df.to_csv(data_directory + '/metainfo.csv')
-            else:
-                dirs = os.listdir(data_directory)
-                directories_list = [os.path.abspath(p) for p in dirs]
-
-        with Pool() as p:
-            cases = p.map(self.run_case, directories_list)
+        self.root = os.path.abspath(data_directory)
+        if not self.fast:
+            directories_list = find_cases(data_directory, glob)
+        else:
+            dirs = os.listdir(data_directory)
+            directories_list = [os.path.abspath(p) for p in dirs]
 
+        cases = self.run_cases(directories_list, history)
         return Report(cases, self.exe, self.work_dir, self.rvo)
 
-    def generate_for_list(self, list, nopic=False):
+    def generate_for_list(self, list, nopic=False, history=None):
         self.nopic = nopic
-        with Pool() as p:
-            cases = p.map(self.run_case, list)
+        cases = self.run_cases(list, history)
         return Report(cases, self.exe, self.work_dir, self.rvo)
 
-    def run_case(self, datadir):
-        working_dir = os.path.abspath(os.getcwd())
-        os.chdir(datadir)
+    def run_cases(self, directories_list, history=None):
+        """
+        Runs cases in pool, expected longest first, one case per task.
+        Invalid cases are skipped, if validation is enabled. If sample is set, only
+        stratified sample of cases is run. Run is aborted, when failure rate exceeds abort_rate.
+        @param directories_list: list of case directories
+        @param history: dict, case name -> execution time from previous run
+        @return: list of finished cases in order of directories_list
+        """
+        if self.validate:
+            directories_list, invalid = validate_cases(directories_list)
+            self.invalid.update(invalid)
+            for datadir, reasons in invalid.items():
+                print("{} is invalid, skipped: {}".format(datadir, "; ".join(reasons)))
+        if self.sample is not None:
+            directories_list = stratified_sample(directories_list, self.sample, self.sample_seed)
+            print(f"Running stratified sample of {len(directories_list)} cases")
+        order = schedule(directories_list, history)
+        timeouts = adaptive_timeouts(directories_list, history, self.timeout, self.max_timeout, self.timeout_factor)
+        cases = [None] * len(directories_list)
+        fail_fast = None
+        if self.abort_rate is not None:
+            fail_fast = FailFast(self.abort_rate, self.abort_min_cases, self.ok_codes)
+        progress = self.progress(len(order), 'run')
+        try:
+            for k, case in self.map_tasks([(directories_list[i], timeouts[i]) for i in order], fail_fast=fail_fast):
+                cases[order[k]] = case
+                if progress is not None:
+                    progress.update(case)
+        finally:
+            if progress is not None:
+                progress.close()
+        if self.aborted:
+            return [case for case in cases if case is not None]
+
+        if self.retry_factor is not None:
+            retry = [i for i, case in enumerate(cases) if case is not None and case["code"] == 6]
+            if len(retry) != 0:
+                print(f"Retrying {len(retry)} timed out cases in {self.retry_processes} processes")
+                progress = self.progress(len(retry), 'retry', self.retry_processes)
+                try:
+                    for k, case in self.map_tasks([(directories_list[i], timeouts[i] * self.retry_factor)
+                                                   for i in retry], self.retry_processes):
+                        if case is not None:
+                            case["retried"] = True
+                        cases[retry[k]] = case
+                        if progress is not None:
+                            progress.update(case)
+                finally:
+                    if progress is not None:
+                        progress.close()
+        return [case for case in cases if case is not None]
 
-        if os.path.exists('nav-data.json'):
-            case_filenames = Case.CASE_FILENAMES_VSE
-        elif os.path.exists(Case.CASE_FILENAMES['nav_data']):
-            case_filenames = Case.CASE_FILENAMES
+    def progress(self, total, phase, processes=None):
+        """
+        Starts writing progress metrics, if progress_file is set
+        @param total: number of cases
+        @param phase: name of run phase
+        @param processes: number of local processes, default is number of pool processes
+        @return: ProgressMetrics or None
+        """
+        if self.progress_file is None:
+            return None
+        if self.queue_dir is not None:
+            # Number of remote workers is unknown
+            workers = None
+        elif self.repeat == 1 and not self.pin:
+            workers = processes or os.cpu_count()
         else:
-            case_filenames = Case.CASE_FILENAMES_KT
-        # Get a list of old results
-        cur_path = Path('.')
-        file_list = list(cur_path.glob(case_filenames['maneuvers'])) + \
-                    list(cur_path.glob(case_filenames['analyse']))
+            workers = min(processes or len(physical_cores()), len(physical_cores()))
+        return ProgressMetrics(self.progress_file, total, workers, phase)
 
-        for filePath in file_list:
-            try:
-                os.remove(filePath)
-            except OSError:
-                pass
+    def map_tasks(self, tasks, processes=None, fail_fast=None):
+        """
+        Runs tasks in local pool or, if queue_dir is set, on workers of the shared queue
+        @param tasks: list of (case directory, timeout)
+        @param processes: number of local processes
+        @param fail_fast: FailFast, remaining tasks are skipped when it says so
+        @return: generator of (index of task, case) in order of completion, skipped cases are None
+        """
+        if self.queue_dir is None:
+            abort = Value('b', 0)
+            with self.pool(processes, abort) as p:
+                for k, case in enumerate(p.imap(self.run_task, tasks, chunksize=1)):
+                    yield k, case
+                    if self.check_abort(fail_fast, case):
+                        abort.value = 1
+            return
+        queue = DirectoryQueue(self.queue_dir)
+        ids = queue.publish(tasks, self, self.lease_timeout)
+        print(f"Published {len(ids)} cases to '{self.queue_dir}', waiting for workers")
+        index = {task_id: k for k, task_id in enumerate(ids)}
+        for task_id, case in queue.results(ids, self.lease_timeout):
+            yield index[task_id], case
+            if self.check_abort(fail_fast, case):
+                queue.cancel(ids)
 
-        # Print the exit code.
-        exec_time = time.time()
-        command = [self.exe, "--target-settings", case_filenames['target_settings'],
-                   "--targets", case_filenames['targets_data'],
-                   "--settings", case_filenames['settings'],
-                   "--nav-data", case_filenames['nav_data'],
-                   "--hydrometeo", case_filenames['hydrometeo'],
-                   "--constraints", case_filenames['constraints'],
-                   "--route", case_filenames['route'],
-                   "--maneuver", case_filenames['maneuvers'],
-                   "--analyse", case_filenames['analyse'],
-                   "--predict", case_filenames['targets_maneuvers'],
-                   ("--rvo-enable" if self.rvo is True else "")]
+    def check_abort(self, fail_fast, case):
+        """
+        Accounts finished case and decides, whether run must be aborted
+        @return: True, if run is aborted just now
+        """
+        if fail_fast is None or self.aborted or not fail_fast.update(case):
+            return False
+        self.aborted = True
+        print(f"Aborting: {fail_fast.failed} of {fail_fast.done} finished cases failed, "
+              f"more than {fail_fast.rate:.0%}")
+        return True
 
-        # Added to prevent freezing
+    def render_cases(self, cases):
+        """
+        Renders images of already finished cases
+        @param cases: list of case dicts
+        """
+        progress = None
+        if self.progress_file is not None:
+            progress = ProgressMetrics(self.progress_file, len(cases), phase='render')
+            progress.set_render_queue(len(cases))
+        with self.pool() as p:
+            # Results store holds only outputs of solver, inputs are read from source case
+            images = p.imap(render_case_paths, [(case["source_path"], case["path"]) if "source_path" in case
+                                                else (case["path"], None) for case in cases], chunksize=1)
+            for i, (case, image) in enumerate(zip(cases, images)):
+                if case["proc"] is not None:
+                    case["image_data"] = image
+                if progress is not None:
+                    progress.update(case)
+                    progress.set_render_queue(len(cases) - i - 1)
+        if progress is not None:
+            progress.close()
+
+    def run_task(self, task):
+        if _abort is not None and _abort.value:
+            return None
+        return self.run_case(*task)
+
+    def run_case(self, datadir, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if self.variants is not None:
+            return self.run_variants(datadir, timeout)
+        case_filenames = getattr(Case, detect_flavour(list_case(datadir)) or 'CASE_FILENAMES_KT')
+        results = [case_filenames['maneuvers'], case_filenames['analyse']]
+        # Solver needs real files, cases in bundle are always staged
+        staged = self.scratch is not None or split_case(datadir) is not None
+        if staged:
+            run_dir = stage_case(datadir, self.scratch, exclude=results)
+        else:
+            run_dir = datadir
+            # Get a list of old results
+            remove_files(datadir, results)
         try:
-            completedProc = subprocess.run(command,
-                                           stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                           stdin=subprocess.PIPE, timeout=6)
-            exec_time = time.time() - exec_time
-            print("{} .Return code: {}. Exec time: {} sec"
-                  .format(datadir, fix_returncode(completedProc.returncode), exec_time))
-            image_data = ""
-            nav_report = ""
-            target_data = None
-            if not self.nopic:
-                try:
-                    fig = plot_from_files(os.path.join(datadir, case_filenames['nav_data']))
-
-                    f = io.BytesIO()
-                    fig.savefig(f, format="png", dpi=300)
-                    image_data = '<img width="100%" src="data:image/png;base64,{}">'.format(
-                        base64.b64encode(f.getvalue()).decode())
-                    plt.close(fig)
-                except Exception as ex:
-                    template = "<pre>Plot failed: An exception of type {} occurred.\n{}</pre>"
-                    message = template.format(type(ex).__name__, traceback.format_exc())
-                    image_data = message
-            try:
-                with open(case_filenames['analyse'], "r") as f:
-                    nav_report = json.dumps(json.loads(f.read()), indent=4, sort_keys=True)
-            except FileNotFoundError:
-                pass
-            try:
-                with open(case_filenames['targets_data'], "r") as f:
-                    target_data = json.dumps(json.loads(f.read()), indent=4, sort_keys=True)
-            except FileNotFoundError:
-                pass
-            os.chdir(working_dir)
+            case = self.solve_case(datadir, run_dir, case_filenames, timeout)
+            if staged and case is not None:
+                case["path"] = self.keep_results(datadir, run_dir, case_filenames)
+                if case["path"] != datadir:
+                    case["source_path"] = datadir
+            return case
+        finally:
+            if staged:
+                shutil.rmtree(run_dir, ignore_errors=True)
 
+    def run_variants(self, datadir, timeout):
+        """
+        Runs every solver variant on the case. Case inputs are read and target
+        parameters are computed once, and maneuvers of all variants are plotted
+        on one picture. Every variant runs in its own staged copy of the case.
+        The first variant is the reference, its results are also top-level fields of the case.
+        @param datadir: case directory or case in bundle
+        @param timeout: solver timeout
+        @return: case dict with results of every variant in 'variants'
+        """
+        case_filenames = getattr(Case, detect_flavour(list_case(datadir)) or 'CASE_FILENAMES_KT')
+        params = self.case_params(datadir, case_filenames)
+        if params is None:
+            return
+        results = [case_filenames['maneuvers'], case_filenames['analyse']]
+        variants = {}
+        maneuvers = {}
+        for name, exe, flags in self.variants:
+            run_dir = stage_case(datadir, self.scratch, exclude=results)
             try:
-                target_data = json.loads(target_data)
-            except:
-                return
-            datadir_i = os.path.split(datadir)[1]
-            dist1, dist2 = 0, 0
-            course1, course2 = 0, 0
-            peleng1, peleng2 = 0, 0
-            lat, lon = 0, 0
-            try:
-                with open(datadir + "/" + case_filenames['nav_data'], "r") as f:
-                    nav_d = json.loads(f.read())
-                    lat, lon = nav_d['lat'], nav_d['lon']
-            except FileNotFoundError:
-                pass
-            try:
-                dist1, course1, peleng1 = self.get_target_params(lat, lon, target_data[0])
-            except IndexError or TypeError:
-                dist1, course1, peleng1 = 0, 0, 0
-            try:
-                dist2, course2, peleng2 = self.get_target_params(lat, lon, target_data[1])
-            except IndexError or TypeError:
-                dist2, course2, peleng2 = 0, 0, 0
+                run = self.execute(datadir, self.build_command(case_filenames, exe, flags), run_dir, timeout,
+                                   variant=name)
+                if run["proc"] is not None:
+                    run.update(self.solver_results(run_dir, case_filenames))
+                    maneuvers[name] = load_json(os.path.join(run_dir, case_filenames['maneuvers']))
+                else:
+                    run.update({"nav_report": None, "right": None, "type1": None, "type2": None})
+                    maneuvers[name] = None
+                if self.results_dir is not None or split_case(datadir) is not None:
+                    run["path"] = self.keep_results(datadir, run_dir, case_filenames, variant=name)
+            finally:
+                shutil.rmtree(run_dir, ignore_errors=True)
+            variants[name] = run
 
-            types, right = self.load_maneuver(datadir, case_filenames)
-            if len(types) == 1:
-                types.append(None)
+        image_data = ""
+        if not self.nopic:
+            image_data = render_image(plot_variants, datadir, maneuvers)
+        return {**variants[self.variants[0][0]],
+                "datadir": os.path.split(datadir)[1],
+                "path": datadir,
+                "image_data": image_data,
+                **params,
+                "variants": variants}
 
-            return {"datadir": datadir_i,
-                    "proc": completedProc,
-                    "image_data": image_data,
-                    "exec_time": exec_time,
-                    "nav_report": nav_report,
-                    "command": command,
-                    "code": fix_returncode(completedProc.returncode),
-                    "dist1": dist1,
-                    "dist2": dist2,
-                    "course1": course1,
-                    "course2": course2,
-                    "peleng1": peleng1,
-                    "peleng2": peleng2,
-                    "right": right,
-                    "type1": types[0],
-                    "type2": types[1]
-                    }
-
-        except subprocess.TimeoutExpired:
+    def case_key(self, datadir):
+        """
+        Unique relative path of case in results store and logs: path relative to cases root,
+        name of case in bundle, or absolute path for cases outside of root
+        """
+        in_bundle = split_case(datadir)
+        if in_bundle is not None:
+            return in_bundle[1]
+        if self.root is not None:
+            rel = os.path.relpath(os.path.abspath(datadir), self.root)
+            if rel == os.curdir:
+                return os.path.split(self.root)[1]
+            if rel.split(os.sep)[0] != os.pardir:
+                return rel
+        return os.path.splitdrive(os.path.abspath(datadir))[1].lstrip(os.sep)
+
+    def keep_results(self, datadir, run_dir, case_filenames, variant=None):
+        """
+        Copies results of staged run to results store, or back to case directory.
+        Bundle is not written, results of its cases are kept in <bundle name>_results by default.
+        In results store results are kept in <run id>/<case key>, so runs and cases with the same name don't mix.
+        Only solver outputs are copied, case inputs stay in source case.
+        @param variant: name of solver variant, results of variants are stored in subdirectories
+        @return: directory with results
+        """
+        outputs = [case_filenames[name] for name in OUTPUT_FILES]
+        results_dir = self.results_dir
+        in_bundle = split_case(datadir)
+        if results_dir is None and in_bundle is not None:
+            results_dir = os.path.splitext(in_bundle[0])[0] + '_results'
+        if results_dir is None:
+            remove_files(datadir, outputs)
+            copy_files(run_dir, datadir, outputs)
+            return datadir
+        # Results store holds only outputs, inputs are read from source case or bundle
+        result_dir = os.path.join(results_dir, self.run_id, self.case_key(datadir))
+        if variant is not None:
+            result_dir = os.path.join(result_dir, variant)
+        os.makedirs(result_dir, exist_ok=True)
+        remove_files(result_dir, outputs)
+        copy_files(run_dir, result_dir, outputs)
+        return result_dir
+
+    def build_command(self, case_filenames, exe=None, flags=None):
+        """
+        Builds solver command line
+        @param case_filenames: dict with filenames
+        @param exe: solver executable, default is self.exe
+        @param flags: additional solver flags, default depends on self.rvo
+        """
+        if exe is None:
+            exe = self.exe
+        if flags is None:
+            flags = [("--rvo-enable" if self.rvo is True else "")]
+        return [exe, "--target-settings", case_filenames['target_settings'],
+                "--targets", case_filenames['targets_data'],
+                "--settings", case_filenames['settings'],
+                "--nav-data", case_filenames['nav_data'],
+                "--hydrometeo", case_filenames['hydrometeo'],
+                "--constraints", case_filenames['constraints'],
+                "--route", case_filenames['route'],
+                "--maneuver", case_filenames['maneuvers'],
+                "--analyse", case_filenames['analyse'],
+                "--predict", case_filenames['targets_maneuvers']] + list(flags)
+
+    def execute(self, datadir, command, run_dir, timeout, variant=None):
+        """
+        Runs solver self.repeat times and parses output of the last run into metrics
+        @param datadir: case directory, for messages and log file name
+        @param command: solver command line
+        @param run_dir: working directory of solver
+        @param timeout: solver timeout
+        @param variant: name of solver variant, for log file name
+        @return: dict with process, return code, timing, resource usage, output metrics and log file;
+        process is None on timeout
+        """
+        log_file = None
+        if self.log_dir is not None:
+            log_name = self.case_key(datadir) + ('.' + variant if variant is not None else '') + '.log'
+            log_file = os.path.join(self.log_dir, self.run_id, log_name)
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+        exec_times = []
+        # Added to prevent freezing
+        try:
+            for _ in range(self.repeat):
+                t_start = time.perf_counter()
+                completedProc, resources = run_solver(command, timeout=timeout, cwd=run_dir, log_file=log_file)
+                exec_times.append(time.perf_counter() - t_start)
+        except subprocess.TimeoutExpired as ex:
             print("TEST TIMEOUT ERR")
-            exec_time = time.time() - exec_time
-            os.chdir(working_dir)
-            target_data = None
-            try:
-                with open(case_filenames['targets_data'], "r") as f:
-                    target_data = json.dumps(json.loads(f.read()), indent=4, sort_keys=True)
-            except FileNotFoundError:
-                pass
+            exec_times.append(time.perf_counter() - t_start)
+            return {"proc": None,
+                    **timing_stats(exec_times),
+                    "command": command,
+                    "timeout": timeout,
+                    "code": 6,
+                    **getattr(ex, 'resources', rusage_to_dict(None)),
+                    "log_file": log_file,
+                    **self.parse_output(log_file, ex.output)}
 
-            datadir_i = os.path.split(datadir)[1]
-            dist1, dist2 = 0, 0
-            course1, course2 = 0, 0
-            peleng1, peleng2 = 0, 0
-            lat, lon = 0, 0
-            try:
-                with open(datadir + "/" + case_filenames['nav_data'], "r") as f:
-                    nav_d = json.loads(f.read())
-                    lat, lon = nav_d['lat'], nav_d['lon']
-            except FileNotFoundError:
-                pass
-            try:
-                dist1, course1, peleng1 = self.get_target_params(lat, lon, target_data[0])
-            except:
-                dist1, course1, peleng1 = 0, 0, 0
-            try:
-                dist2, course2, peleng2 = self.get_target_params(lat, lon, target_data[1])
-            except:
-                dist2, course2, peleng2 = 0, 0, 0
+        timing = timing_stats(exec_times)
+        # Print the exit code.
+        print("{} .Return code: {}. Exec time: {} sec"
+              .format(datadir, fix_returncode(completedProc.returncode), timing["exec_time"]))
+        return {"proc": completedProc,
+                **timing,
+                "command": command,
+                "timeout": timeout,
+                "code": fix_returncode(completedProc.returncode),
+                **resources,
+                "log_file": log_file,
+                **self.parse_output(log_file, completedProc.stdout)}
 
-            # TODO: Rewrite pelengs and dists to arrays
+    def parse_output(self, log_file, output):
+        """
+        Runs stdout parsers over log file or captured output
+        @return: dict with metrics columns
+        """
+        if log_file is not None:
+            return parse_log(log_file, self.stdout_parsers)
+        return parse_output(output, self.stdout_parsers)
 
+    def solve_case(self, datadir, run_dir, case_filenames, timeout):
+        """
+        Runs solver in run_dir and collects results
+        @param datadir: case directory
+        @param run_dir: directory with case files to run solver in
+        @param case_filenames: dict with filenames
+        @param timeout: solver timeout
+        @return: case dict
+        """
+        run = self.execute(datadir, self.build_command(case_filenames), run_dir, timeout)
+        params = self.case_params(run_dir, case_filenames)
+        datadir_i = os.path.split(datadir)[1]
+        if run["proc"] is None:
+            # TODO: Rewrite pelengs and dists to arrays
+            if params is None:
+                params = dict.fromkeys(TARGET_PARAMS, 0)
             return {"datadir": datadir_i,
-                    "proc": None,
+                    "path": datadir,
                     "image_data": "",
-                    "exec_time": exec_time,
                     "nav_report": None,
-                    "command": command,
-                    "code": 6,
-                    "dist1": dist1,
-                    "dist2": dist2,
-                    "course1": course1,
-                    "course2": course2,
-                    "peleng1": peleng1,
-                    "peleng2": peleng2,
+                    **run,
+                    **params,
                     "right": None,
                     "type1": None,
-                    "type2": None
-                    }
+                    "type2": None}
+        if params is None:
+            return
+
+        image_data = ""
+        if not self.nopic:
+            image_data = render_image(plot_from_files, os.path.join(run_dir, case_filenames['nav_data']))
+        return {"datadir": datadir_i,
+                "path": datadir,
+                "image_data": image_data,
+                **run,
+                **params,
+                **self.solver_results(run_dir, case_filenames)}
+
+    def case_params(self, datadir, case_filenames):
+        """
+        Distances, courses and bearings of first two targets
+        @param datadir: case directory or case in bundle
+        @param case_filenames: dict with filenames
+        @return: dict with TARGET_PARAMS keys, None if target data can't be read
+        """
+        try:
+            target_data = load_json(os.path.join(datadir, case_filenames['targets_data']))
+        except (OSError, ValueError):
+            return None
+        if target_data is None:
+            return None
+        lat, lon = 0, 0
+        try:
+            nav_d = load_json(os.path.join(datadir, case_filenames['nav_data']))
+            if nav_d is not None:
+                lat, lon = nav_d['lat'], nav_d['lon']
+        except OSError:
+            pass
+        params = [(0, 0, 0), (0, 0, 0)]
+        for i in range(2):
+            try:
+                params[i] = self.get_target_params(lat, lon, target_data[i])
+            except (IndexError, KeyError, TypeError):
+                pass
+        (dist1, course1, peleng1), (dist2, course2, peleng2) = params
+        return {"dist1": dist1,
+                "dist2": dist2,
+                "course1": course1,
+                "course2": course2,
+                "peleng1": peleng1,
+                "peleng2": peleng2}
+
+    def solver_results(self, run_dir, case_filenames):
+        """
+        Reads situation report, scenario types and turn direction from solver output
+        @param run_dir: directory, where solver was run
+        @param case_filenames: dict with filenames
+        @return: dict with nav_report, right, type1 and type2
+        """
+        nav_report = ""
+        try:
+            with open(os.path.join(run_dir, case_filenames['analyse']), "r") as f:
+                nav_report = json.dumps(json.loads(f.read()), indent=4, sort_keys=True)
+        except FileNotFoundError:
+            pass
+        types, right = self.load_maneuver(run_dir, case_filenames)
+        types = types + [None] * (2 - len(types))
+        return {"nav_report": nav_report,
+                "right": right,
+                "type1": types[0],
+                "type2": types[1]}
 
     def load_maneuver(self, datadir, case_filenames):
         """
@@ -256,11 +1199,14 @@ class ReportGenerator:
         except FileNotFoundError:
             pass
         types = []
-        with open(datadir + "/" + case_filenames['analyse'], "r") as f:
-            report = json.loads(f.read())
-            targets = report['target_statuses']
-            for target in targets:
-                types.append(target['scenario_type'])
+        try:
+            with open(datadir + "/" + case_filenames['analyse'], "r") as f:
+                report = json.loads(f.read())
+                targets = report['target_statuses']
+                for target in targets:
+                    types.append(target['scenario_type'])
+        except FileNotFoundError:
+            pass
         try:
             return types, c_dif > 0
         except TypeError:
@@ -283,181 +1229,175 @@ class Report:
         self.work_dir = work_dir
         self.rvo = rvo
 
-    def save_html(self, filename):
-        css = """
-        *{font-family: sans-serif;}
-        h2 {margin-top: 2em;}
-        .case {
-            display: flex;
-            max-height: 540pt;
-            font-family: sans-serif;
-        }
-        .case .pic {
-            flex: 1;
-        }
-        .case .stdout {
-            flex: 1;
-            border: 1px black solid;
-            padding: 0;
-            display: flex;
-            flex-direction: column;
-            background: #555;
-            overflow-y: auto;
-        }
-        .stdout pre {
-            max-height: 100%;
-            overflow-y: auto;
-            color: #fff;
-            margin: 0;
-            padding: 1em;
-            white-space: pre-line;
-            font-family: monospace;
-        }
-        .stdout pre.cmd::before {
-            content: '$ ';
-            font-weight: bold;
-        }
-        .stdout pre.cmd {background: #222;}
-        .stdout p{
-            border-bottom: 1px black solid;
-            padding: 0.5em;
-            margin: 0;
-            font: 400 13.3333px sans-serif;
-        }
-        .stdout input[type=checkbox] {
-            visibility: visible;
-            height: 2em;
-            width: 100%;
-            margin: 0;
-        }
-        .stdout input[type=checkbox]:after, .stdout p{
-            visibility: visible;
-            display: block;
-            padding: 0.5em;
-            background: #fff;
-        }
-
-        .stdout input[type=checkbox] + div {
-            display: none;
-        }
-        .stdout input[type=checkbox]:checked + div {
-            display: block;
-        }
-        .stdout input[type=checkbox]::after{content: '▸ ' attr(text);}
-        .stdout input[type=checkbox]:checked::after{content: '▾ ' attr(text);}
-        img{
-            image-rendering: -moz-crisp-edges;         /* Firefox */
-            image-rendering:   -o-crisp-edges;         /* Opera */
-            image-rendering: -webkit-optimize-contrast;/* Webkit (non-standard naming) */
-            image-rendering: crisp-edges;
-            -ms-interpolation-mode: nearest-neighbor;
-        }
-        table.summary {
-            border-collapse: collapse;
-        }
-        
-        table.summary td[code="0"]{
-            background-color: green;
-            color: white;
-        }
-        table.summary td[code="1"]{
-            background-color: darkorange;
-            color: white;
-        }
-        table.summary td[code="2"]{
-            background-color: red;
-            color: white;
-        }
+    def save_html(self, filename, page_size=None, render=None):
+        """
+        Writes report in HTML format. Summary table and case sections are streamed
+        straight to the file, so memory does not depend on number of cases.
+        @param filename: output file name
+        @param page_size: if set, cases are split into pages of page_size cases,
+        and filename becomes an index page with links to them. Images of cases are dropped,
+        once their page is written, so only images of one page are kept in memory
+        @param render: function, which fills image_data of list of cases, like ReportGenerator.render_cases;
+        if set, images are rendered just before their page is written
         """
+        if page_size is not None and page_size < 1:
+            raise ValueError("page_size must be at least 1, got {}".format(page_size))
         print("Creating report file in HTML format")
-        tbody = ''.join([
-            f'<tr><td><a href="#case_{i}">{os.path.relpath(case["datadir"], self.work_dir)}</a></td><td code="{case["code"]}">{case["code"]}</td></tr>'
-            for i, case in
-            enumerate(self.cases)])
-        codes = dict(Counter([case["code"] for case in self.cases]))
-        table = """
-        <table class="summary" border="1">
-        <thead><tr><td></td><td>{code_summary}</td></tr><br>
-        <tr><td>Case</td><td>Code</td></tr></thead>
-        <tbody>{tbody}</tbody>
-        </table>
-        """.format(tbody=tbody, code_summary='<br>'.join(['{}: {}'.format(k, codes[k]) for k in sorted(codes)]))
-
-        html = """<!DOCTYPE HTML>
-<html>
-<head>
-<meta charset="utf-8">
-<title>Results from {datetime}</title>
-<style>{styles}</style>
-</head>
-<body>
-<h1>Report from {datetime} {rvo}</h1>""".format(datetime=datetime.now(), styles=css,
-                                                rvo='<b>rvo enabled</b>' if self.rvo else '')
-        html += table
+        if page_size is None:
+            if render is not None:
+                render(self.cases)
+            with io.open(filename, "w", encoding="utf-8") as f:
+                self._write_page(f, self.cases, 0, self._code_counts(self.cases),
+                                 resources=self.resource_summary())
+            return
+
+        base, ext = os.path.splitext(filename)
+        n_pages = max(1, -(-len(self.cases) // page_size))
+        pages = []
+        for page in range(n_pages):
+            page_cases = self.cases[page * page_size:(page + 1) * page_size]
+            page_name = "{}_{}{}".format(base, page + 1, ext)
+            codes = self._code_counts(page_cases)
+            if render is not None:
+                render(page_cases)
+            with io.open(page_name, "w", encoding="utf-8") as f:
+                self._write_page(f, page_cases, page * page_size, codes,
+                                 index_link=os.path.basename(filename))
+            for case in page_cases:
+                case["image_data"] = ""
+            pages.append((os.path.basename(page_name), len(page_cases), codes))
 
-        for i, case in enumerate(self.cases):
-            img_tag = case["image_data"]
-            try:
-                html += """<div>
-    <h2 id="case_{case_i}">{casename}</h2>
-    <div class="case">
-    <div class="pic">
-    <picture>{image}</picture>
-    </div>
-    <div class="stdout">
-    <p>Return code: {return_code}</p>
-    <p>Execution time: {exec_time} seconds</p>
-    <input type="checkbox" text="Situation report">
-    <div><pre>{nav_report}</pre></div>
-    <input type="checkbox" text="STDOUT"{checked}><div>
-    <pre class="cmd">{command}</pre>
-    <pre>{stdout}</pre></div>
-    </div></div></div>""".format(casename=case["datadir"],
-                                 return_code=fix_returncode(case["proc"].returncode),
-                                 exec_time=case["exec_time"],
-                                 command=str(' '.join(case["command"])),
-                                 stdout=str(case["proc"].stdout.decode("utf-8")),
-                                 nav_report=case["nav_report"],
-                                 image=img_tag,
-                                 checked=" checked",
-                                 case_i=i)
-            except AttributeError:
-                html += """<div>
-                    <h2 id="case_{case_i}">{casename}</h2>
-                    <div class="case">
-                    <div class="pic">
-                    <picture>{image}</picture>
-                    </div>
-                    <div class="stdout">
-                    <p>Return code: {return_code}</p>
-                    <p>Execution time: {exec_time} seconds</p>
-                    <input type="checkbox" text="Situation report">
-                    <div><pre>{nav_report}</pre></div>
-                    <input type="checkbox" text="STDOUT"{checked}><div>
-                    <pre class="cmd">{command}</pre>
-                    <pre>{stdout}</pre></div>
-                    </div></div></div>""".format(casename=case["datadir"],
-                                                 return_code=10,
-                                                 exec_time=case["exec_time"],
-                                                 command=str(' '.join(case["command"])),
-                                                 stdout="TIME_ERR",
-                                                 nav_report=case["nav_report"],
-                                                 image="",
-                                                 checked=" checked",
-                                                 case_i=i)
-
-        html += "</body></html>"
         with io.open(filename, "w", encoding="utf-8") as f:
-            f.write(html)
+            self._write_header(f)
+            f.write('<table class="summary" border="1">\n'
+                    '<thead><tr><td>Total</td><td>{}</td><td>{}</td></tr>\n'
+                    '<tr><td>Page</td><td>Cases</td><td>Codes</td></tr></thead>\n<tbody>\n'
+                    .format(len(self.cases), self._format_codes(self._code_counts(self.cases))))
+            for page_name, n_cases, codes in pages:
+                f.write('<tr><td><a href="{name}">{name}</a></td><td>{n}</td><td>{codes}</td></tr>\n'
+                        .format(name=page_name, n=n_cases, codes=self._format_codes(codes)))
+            f.write("</tbody></table>\n")
+            f.write(self.resource_summary().to_html(classes="summary", float_format='{:.3f}'.format))
+            f.write("</body></html>")
+
+    @staticmethod
+    def _code_counts(cases):
+        return Counter(case["code"] for case in cases)
+
+    @staticmethod
+    def _format_codes(codes):
+        return '<br>'.join(['{}: {}'.format(k, codes[k]) for k in sorted(codes)])
+
+    def _write_header(self, f):
+        f.write(HTML_HEADER.format(datetime=datetime.now(), styles=REPORT_CSS,
+                                   rvo='<b>rvo enabled</b>' if self.rvo else ''))
+
+    def _write_page(self, f, cases, first_i, codes, index_link=None, resources=None):
+        """
+        Streams one report page: summary table, then case sections.
+        @param f: opened file
+        @param cases: cases of the page
+        @param first_i: number of the first case, used for anchors
+        @param codes: Counter with return codes of the page
+        @param index_link: link to index page, if report is paginated
+        @param resources: resource usage percentiles table, if needed on the page
+        """
+        self._write_header(f)
+        if index_link is not None:
+            f.write('<p><a href="{0}">{0}</a></p>\n'.format(index_link))
+        if resources is not None:
+            f.write(resources.to_html(classes="summary", float_format='{:.3f}'.format))
+        f.write('<table class="summary" border="1">\n'
+                '<thead><tr><td></td><td>{}</td></tr>\n'
+                '<tr><td>Case</td><td>Code</td><td>Time, s</td><td>CPU user, s</td><td>CPU sys, s</td>'
+                '<td>Peak RSS, KB</td></tr></thead>\n<tbody>\n'.format(self._format_codes(codes)))
+        for i, case in enumerate(cases, first_i):
+            f.write('<tr><td><a href="#case_{}">{}</a></td><td code="{code}">{codes}</td>'
+                    '<td>{exec_time:.3f}</td><td>{cpu_user}</td><td>{cpu_sys}</td><td>{max_rss_kb}</td></tr>\n'
+                    .format(i, os.path.relpath(case["datadir"], self.work_dir), code=case["code"],
+                            codes=', '.join('{}: {}'.format(name, variant["code"])
+                                            for name, variant in case["variants"].items())
+                            if case.get("variants") else case["code"],
+                            exec_time=case["exec_time"], cpu_user=case.get("cpu_user"),
+                            cpu_sys=case.get("cpu_sys"), max_rss_kb=case.get("max_rss_kb")))
+        f.write("</tbody></table>\n")
+        for i, case in enumerate(cases, first_i):
+            self._write_case(f, i, case)
+        f.write("</body></html>")
+
+    @staticmethod
+    def _write_case(f, i, case):
+        if case["proc"] is not None:
+            return_code = fix_returncode(case["proc"].returncode)
+            stdout = solver_stdout(case)
+            image = case["image_data"]
+        else:
+            return_code = 10
+            stdout = "TIME_ERR"
+            image = ""
+        f.write(CASE_TEMPLATE.format(casename=case["datadir"],
+                                     return_code=return_code,
+                                     exec_time=case["exec_time"],
+                                     exec_time_min=case.get("exec_time_min"),
+                                     exec_time_iqr=case.get("exec_time_iqr"),
+                                     command=str(' '.join(case["command"])),
+                                     stdout=stdout,
+                                     nav_report=case["nav_report"],
+                                     image=image,
+                                     checked=" checked",
+                                     case_i=i,
+                                     variants=''.join(VARIANT_TEMPLATE.format(
+                                         name=name,
+                                         code=variant["code"],
+                                         exec_time=variant["exec_time"],
+                                         command=str(' '.join(variant["command"])),
+                                         stdout=solver_stdout(variant))
+                                         for name, variant in (case.get("variants") or {}).items()),
+                                     **{key: case.get(key) for key in RESOURCE_COLUMNS}))
+
+    def resource_summary(self, percentiles=(.5, .9, .95, .99)):
+        """
+        Percentiles of execution time and resource usage over all cases
+        @param percentiles: percentiles to compute
+        @return: DataFrame, rows are percentiles and max, columns are resources
+        """
+        columns = ['exec_time'] + RESOURCE_COLUMNS
+        df = pd.DataFrame([[case.get(key) for key in columns] for case in self.cases],
+                          columns=columns, dtype=float)
+        summary = df.quantile(list(percentiles))
+        summary.index = ['p{:g}'.format(p * 100) for p in percentiles]
+        summary.loc['max'] = df.max()
+        return summary
+
+    def save(self, filename):
+        """
+        Saves typed report table, Parquet or Feather by extension
+        @param filename: file name
+        @return: report DataFrame
+        """
+        df = report_frame(self.cases)
+        save_report(df, filename)
+        return df
 
     def save_excel(self, filename='report.xlsx'):
         df = pd.json_normalize(self.cases)
         try:
-            df.to_excel(filename)
+            with pd.ExcelWriter(filename) as writer:
+                df.to_excel(writer)
+                self.resource_summary().to_excel(writer, sheet_name='resources')
         except ValueError:
             df.to_csv(filename)
         return df
 
+    def subset(self, names):
+        """
+        Returns report only with specified cases
+        @param names: case names
+        """
+        names = set(names)
+        return Report([case for case in self.cases if case is not None and case["datadir"] in names],
+                      self.exe, self.work_dir, self.rvo)
+
     def get_danger_params(self, statuses):
         return [rec['datadir'] for rec in self.cases if rec['code'] in statuses]
 
@@ -465,15 +1405,98 @@ class Report:
 if __name__ == "__main__":
     import argparse
 
+    def positive_int(value):
+        number = int(value)
+        if number < 1:
+            raise argparse.ArgumentTypeError("must be at least 1, got {}".format(value))
+        return number
+
     parser = argparse.ArgumentParser(description="BKS report generator")
-    parser.add_argument("executable", type=str, help="Path to USV executable")
+    parser.add_argument("executable", type=str, nargs='?', help="Path to USV executable")
     parser.add_argument("--glob", type=str, default='*', help="Pattern for scanned directories")
 
     parser.add_argument("--rvo", action="store_true", help="Run USV with --rvo")
     parser.add_argument("--nopic", action="store_true", help="")
-    parser.add_argument("--working_dir", type=str, help="Path to USV executable")
-    parser.add_argument("--report_file", type=str, help="Report file")
+    parser.add_argument("--working_dir", type=str, help="Path to cases root or case bundle")
+    parser.add_argument("--report_file", type=str, help="Report file: .parquet, .feather, .xlsx or .csv")
+    parser.add_argument("--excel_file", type=str, help="Export full report to Excel")
+    parser.add_argument("--html_file", type=str, help="HTML report file")
+    parser.add_argument("--page_size", type=positive_int,
+                        help="Number of cases per HTML page, images are rendered page by page")
+    parser.add_argument("--repeat", type=int, default=1, help="Benchmark mode: run every case N times")
+    parser.add_argument("--pin", action="store_true", help="Benchmark mode: pin every worker to its own core")
+    parser.add_argument("--compare", type=str, help="Benchmark mode: second executable for A/B comparison")
+    parser.add_argument("--timeout", type=float, default=6, help="Solver timeout (minimal one with --timeout_factor)")
+    parser.add_argument("--max_timeout", type=float, default=60, help="Maximal solver timeout")
+    parser.add_argument("--timeout_factor", type=float,
+                        help="Derive per-case timeouts from history: previous exec time times this factor")
+    parser.add_argument("--retry_factor", type=float,
+                        help="Rerun timed out cases in smaller pool with timeout multiplied by this factor")
+    parser.add_argument("--retry_processes", type=int, help="Number of processes for rerun of timed out cases")
+    parser.add_argument("--baseline", type=str,
+                        help="Report of baseline run: only changed cases are rendered into HTML")
+    parser.add_argument("--regression_threshold", type=float, default=0.5,
+                        help="Relative exec time growth, reported as regression")
+    parser.add_argument("--scratch", type=str,
+                        help="Run solver on copies of cases in this directory, e.g. /dev/shm")
+    parser.add_argument("--results_dir", type=str,
+                        help="With --scratch, keep results here instead of case directories")
+    parser.add_argument("--history", type=str,
+                        help="Previous report or metainfo.csv with exec times, used to run longest cases first")
+    parser.add_argument("--log_dir", type=str,
+                        help="Directory for solver logs, default is ./reports/logs_<date>, "
+                             "logs of a run are in its <run id> subdirectory")
+    parser.add_argument("--keep_output", action="store_true",
+                        help="Keep solver output in memory instead of streaming it to per-case log files")
+    parser.add_argument("--no_validation", action="store_true",
+                        help="Don't check cases before running solver")
+    parser.add_argument("--queue_dir", type=str,
+                        help="Coordinator mode: run cases on workers, which share this directory")
+    parser.add_argument("--lease_timeout", type=float, default=120,
+                        help="Coordinator mode: seconds after which case of silent worker is run again")
+    parser.add_argument("--worker", type=str,
+                        help="Worker mode: run cases published by coordinator to this queue directory")
+    parser.add_argument("--processes", type=int, help="Worker mode: number of solver processes")
+    parser.add_argument("--idle_timeout", type=float, default=600,
+                        help="Worker mode: exit after this many seconds without cases")
+    parser.add_argument("--progress_file", type=str,
+                        help="Live progress metrics file, JSON or Prometheus text format for .prom")
+    parser.add_argument("--sample", type=float,
+                        help="Smoke run: stratified by target count and distance sample, number or fraction of cases")
+    parser.add_argument("--sample_seed", type=int, default=0, help="Random seed of --sample")
+    parser.add_argument("--abort_rate", type=float,
+                        help="Fail fast: abort run, when this fraction of finished cases failed")
+    parser.add_argument("--abort_min_cases", type=int, default=20,
+                        help="Fail fast: don't abort before this many cases finished")
+    parser.add_argument("--ok_codes", type=str, default="0",
+                        help="Fail fast: comma separated return codes, which are not failures")
+    parser.add_argument("--variant", type=str, action="append",
+                        help="Solver variant NAME=[EXECUTABLE] [FLAGS], may be repeated. "
+                             "Variants run on every case, their maneuvers are plotted together")
     args = parser.parse_args()
+    if args.keep_output and args.log_dir:
+        parser.error("--keep_output and --log_dir can't be used together")
+
+    if args.worker is not None:
+        def prepare(runner):
+            # Node local settings of worker take precedence over coordinator ones
+            if args.scratch:
+                runner.scratch = args.scratch
+            if args.results_dir:
+                runner.results_dir = os.path.abspath(args.results_dir)
+            if args.log_dir:
+                runner.log_dir = os.path.abspath(args.log_dir)
+            if args.executable:
+                runner.exe = os.path.abspath(args.executable)
+            if runner.log_dir is not None:
+                os.makedirs(runner.log_dir, exist_ok=True)
+            return runner
+
+        print(f"Worker of '{args.worker}' started")
+        run_worker(DirectoryQueue(args.worker), args.processes, args.idle_timeout, prepare)
+        sys.exit(0)
+    if args.executable is None:
+        parser.error("executable is required")
 
     use_rvo = None
     if args.rvo:
@@ -483,26 +1506,95 @@ if __name__ == "__main__":
         cur_dir = os.path.abspath(args.working_dir)
     else:
         cur_dir = os.path.abspath(os.getcwd())
+    # Executable and metainfo of bundle are next to it
+    base_dir = os.path.dirname(cur_dir) if is_bundle(cur_dir) else cur_dir
     t0 = time.time()
-    usv_executable = os.path.join(cur_dir, args.executable)
-    report = ReportGenerator(usv_executable)
-    print("Starting converstion...")
-    report_out = report.generate(cur_dir, glob=args.glob, rvo=use_rvo, nopic=args.nopic)
+    usv_executable = os.path.join(base_dir, args.executable)
+    history_file = args.history or os.path.join(base_dir, 'metainfo.csv')
+    history = load_history(history_file) if os.path.isfile(history_file) else None
+    report = ReportGenerator(usv_executable, repeat=args.repeat, pin=args.pin)
+    report.timeout, report.max_timeout = args.timeout, args.max_timeout
+    report.timeout_factor, report.retry_factor = args.timeout_factor, args.retry_factor
+    if args.retry_processes:
+        report.retry_processes = args.retry_processes
+    report.scratch = args.scratch
+    if args.results_dir:
+        report.results_dir = os.path.abspath(args.results_dir)
+    report.validate = not args.no_validation
+    report.sample, report.sample_seed = args.sample, args.sample_seed
+    report.abort_rate, report.abort_min_cases = args.abort_rate, args.abort_min_cases
+    report.ok_codes = tuple(int(code) for code in args.ok_codes.split(","))
+    if args.progress_file:
+        report.progress_file = os.path.abspath(args.progress_file)
+    if not args.keep_output:
+        report.log_dir = os.path.abspath(args.log_dir or "./reports/logs_" + str(date.today()))
+        os.makedirs(report.log_dir, exist_ok=True)
+    if args.queue_dir:
+        report.queue_dir = os.path.abspath(args.queue_dir)
+        report.lease_timeout = args.lease_timeout
+        DirectoryQueue(report.queue_dir).reset()
+    if args.variant:
+        report.variants = [parse_variant(spec, usv_executable) for spec in args.variant]
+    print(f"Starting converstion, run {report.run_id}...")
+    nopic, lazy_pic = picture_mode(args)
+    render = report.render_cases if lazy_pic else None
+    report_out = report.generate(cur_dir, glob=args.glob, rvo=use_rvo, nopic=nopic, history=history)
     print(f'Finished in {time.time() - t0} sec')
-    # print("Starting saving to HTML")
-    # report_out.save_html("report.html")
+    if args.compare:
+        report_b = copy.copy(report)
+        report_b.exe = os.path.join(base_dir, args.compare)
+        report_b.run_id = report.run_id + '-compare'
+        if report.log_dir is not None:
+            report_b.log_dir = os.path.join(report.log_dir, "compare")
+            os.makedirs(report_b.log_dir, exist_ok=True)
+        print(f"Starting run of '{args.compare}' for comparison...")
+        report_b_out = report_b.generate(cur_dir, glob=args.glob, rvo=use_rvo, nopic=True, history=history)
+        ab = compare_reports(report_out, report_b_out)
+        os.makedirs("./reports", exist_ok=True)
+        ab.to_csv("./reports/ab_" + str(date.today()) + ".csv")
+        significant = ab[ab['significant']]
+        ratio, n_ratio = geometric_mean_ratio(ab)
+        print(f"Geometric mean time ratio B/A: {ratio:.3f} over {n_ratio} cases with positive times")
+        print(f"Significantly faster in B: {(significant['ratio'] < 1).sum()}, "
+              f"slower in B: {(significant['ratio'] > 1).sum()} of {len(ab)} cases")
+    if report.queue_dir is not None:
+        DirectoryQueue(report.queue_dir).stop()
+    if args.html_file and args.baseline is None:
+        print(f"Starting saving HTML report to '{args.html_file}'")
+        report_out.save_html(args.html_file, page_size=args.page_size, render=render)
 
     t_save = time.time()
     if args.report_file:
         name = args.report_file
     else:
-        name = "./reports/report1_" + str(date.today()) + ".xlsx"
+        name = "./reports/report1_" + str(date.today()) + ".parquet"
+        os.makedirs("./reports", exist_ok=True)
 
     print(f"Starting saving report to '{name}'")
-    meta_ = report_out.save_excel(name)
-    meta = meta_[['code', 'type1']]
-    meta['datadirs'] = meta_['datadir']
-    meta.to_csv(cur_dir + '/metainfo.csv')
+    meta_ = report_out.save(name)
+    if args.excel_file:
+        report_out.save_excel(args.excel_file)
+    print(report_out.resource_summary().to_string())
+    if report.invalid:
+        invalid_name = os.path.splitext(name)[0] + "_invalid.csv"
+        pd.DataFrame([(datadir, reason) for datadir, reasons in report.invalid.items() for reason in reasons],
+                     columns=['datadir', 'reason']).to_csv(invalid_name)
+        print(f"{len(report.invalid)} invalid cases skipped, reasons saved to '{invalid_name}'")
+    if args.baseline is not None:
+        diff = diff_reports(read_report(args.baseline), meta_, threshold=args.regression_threshold)
+        diff_name = os.path.splitext(name)[0] + "_diff.csv"
+        diff.to_csv(diff_name)
+        print(f"{len(diff)} cases changed against '{args.baseline}', saved to '{diff_name}'")
+        print(diff['changes'].str.split(',').explode().value_counts().to_string())
+        if args.html_file:
+            changed = report_out.subset(diff['datadir'])
+            print(f"Starting saving HTML report of changed cases to '{args.html_file}'")
+            changed.save_html(args.html_file, page_size=args.page_size, render=render)
+    # Partial runs would spoil history of exec times
+    if report.sample is None and not report.aborted:
+        meta = meta_[['code', 'type1', 'exec_time']]
+        meta['datadirs'] = meta_['datadir']
+        meta.to_csv(base_dir + '/metainfo.csv')
     # build_percent_diag(name, 12, 4, 0.5)
     # print("Creating report for danger scenarios")
     # report_d_out = report.generate_for_list(report_out00.get_danger_params([2, 4]))
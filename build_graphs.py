@@ -5,6 +5,8 @@ from math import cos, sin, radians
 import matplotlib.pyplot as plt
 import pandas as pd
 
+from report_io import read_report
+
 vel_param = [4, 6.5, 8.5, 9.8, 12.2, 16, 19, 20]
 vel_param_x = [4, 4.333, 4.666, 5, 6, 7, 8, 8.333]
 
@@ -37,7 +39,7 @@ def build_percent_diag(filename, dist_max, dist_min, step, show_graph=True):
     @param step:
     @return:
     """
-    df = pd.read_excel(filename, engine='openpyxl')
+    df = read_report(filename, columns=['datadir', 'code'])
     names = df['datadir']
     codes = df['code']
     N = int((dist_max - dist_min) / step)
@@ -141,7 +143,7 @@ def build_percent_diag(filename, dist_max, dist_min, step, show_graph=True):
 
 
 def build_turn_diagram(filename, dist_max, dist_min, step):
-    df = pd.read_excel(filename)
+    df = read_report(filename, columns=['datadir', 'right'])
     names = df['datadir']
     turns = df['right']
     N = int((dist_max - dist_min) / step)
@@ -198,7 +200,7 @@ if __name__ == "__main__":
     build_turn_diagram('./reports/report1_2021-07-20.xlsx', 12, 4, 0.5)
     build_percent_diag('./reports/report2_2021-07-20.xlsx', 12, 4, 0.5)
     build_turn_diagram('./reports/report2_2021-07-20.xlsx', 12, 4, 0.5)
-    df = pd.read_excel('./reports/report_2_4.xlsx')
+    df = read_report('./reports/report_2_4.xlsx', columns=['datadir'])
     names = df['datadir']
     x1, y1, c1 = [], [], []
     x2, y2, c2 = [], [], []
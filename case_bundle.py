@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import fnmatch
+import os
+import sqlite3
+import zlib
+
+from natsort import natsorted
+
+BUNDLE_EXT = '.bundle'
+
+# Open bundles of this process: path -> (pid, CaseBundle). Connections are not shared with forked workers
+_bundles = {}
+
+
+class CaseBundle:
+    """
+    Single-file container of cases, stored in SQLite: every case is a set of named
+    documents, compressed with zlib. Case in bundle is addressed as <bundle>/<case name>,
+    like a case directory, so its name is the last path component as usual.
+    Documents are read directly; solver needs real files, so cases are extracted
+    to scratch only for solver runs. Natural order of cases is stored on close of writer,
+    so listing doesn't sort names.
+    """
+
+    def __init__(self, filename, mode='r'):
+        """
+        @param filename: bundle file
+        @param mode: 'r' to read, 'a' to read and write, 'w' to create new bundle
+        """
+        self.filename = os.path.abspath(filename)
+        self.mode = mode
+        if mode == 'w' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        if mode == 'r':
+            self.db = sqlite3.connect('file:{}?mode=ro'.format(self.filename), uri=True)
+        else:
+            self.db = sqlite3.connect(self.filename, timeout=60)
+            self.db.execute('CREATE TABLE IF NOT EXISTS cases (name TEXT PRIMARY KEY, position INTEGER)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files '
+                            '(case_name TEXT, name TEXT, data BLOB, PRIMARY KEY (case_name, name)) WITHOUT ROWID')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.mode != 'r' and self._unordered():
+            self.db.executemany('UPDATE cases SET position = ? WHERE name = ?',
+                                enumerate(natsorted(name for name, in self.db.execute('SELECT name FROM cases'))))
+        self.db.commit()
+        self.db.close()
+
+    def _unordered(self):
+        return self.db.execute('SELECT 1 FROM cases WHERE position IS NULL LIMIT 1').fetchone() is not None
+
+    def cases(self, pattern=None):
+        """
+        @param pattern: glob pattern for case names
+        @return: natsorted list of case names
+        """
+        names = [name for name, in self.db.execute('SELECT name FROM cases ORDER BY position')]
+        if pattern is not None:
+            names = fnmatch.filter(names, pattern)
+        return natsorted(names) if self._unordered() else names
+
+    def names(self, case):
+        """
+        @return: names of documents of case
+        """
+        return [name for name, in self.db.execute('SELECT name FROM files WHERE case_name = ?', (case,))]
+
+    def read(self, case, name):
+        """
+        @return: document as bytes, None if case has no such document
+        """
+        row = self.db.execute('SELECT data FROM files WHERE case_name = ? AND name = ?', (case, name)).fetchone()
+        return zlib.decompress(row[0]) if row is not None else None
+
+    def add_case(self, case, files):
+        """
+        Adds or replaces documents of case, changes are committed on close
+        @param case: case name
+        @param files: dict, document name -> str or bytes
+        """
+        self.db.execute('INSERT OR IGNORE INTO cases VALUES (?, NULL)', (case,))
+        self.db.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?)',
+                            [(case, name, zlib.compress(data.encode() if isinstance(data, str) else data))
+                             for name, data in files.items()])
+
+    def add_directory(self, datadir, case=None):
+        """
+        Adds case directory with its files
+        @param datadir: case directory
+        @param case: case name, directory name by default
+        """
+        files = {}
+        for name in os.listdir(datadir):
+            path = os.path.join(datadir, name)
+            if os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    files[name] = f.read()
+        self.add_case(case or os.path.split(os.path.normpath(datadir))[1], files)
+
+    def extract(self, case, dst, exclude=()):
+        """
+        Writes documents of case to directory
+        @param case: case name
+        @param dst: existing directory
+        @param exclude: names of documents not to write
+        """
+        for name, data in self.db.execute('SELECT name, data FROM files WHERE case_name = ?', (case,)):
+            if name not in exclude:
+                with open(os.path.join(dst, name), 'wb') as f:
+                    f.write(zlib.decompress(data))
+
+
+def is_bundle(path):
+    return path.endswith(BUNDLE_EXT) and os.path.isfile(path)
+
+
+def open_bundle(filename):
+    """
+    Returns bundle, opened for reading in this process
+    """
+    filename = os.path.abspath(filename)
+    pid, bundle = _bundles.get(filename, (None, None))
+    if pid != os.getpid():
+        bundle = CaseBundle(filename)
+        _bundles[filename] = os.getpid(), bundle
+    return bundle
+
+
+def split_case(path):
+    """
+    @param path: case directory or <bundle>/<case name>
+    @return: (bundle file, case name) or None for case directory
+    """
+    bundle, case = os.path.split(os.path.normpath(path))
+    if is_bundle(bundle):
+        return bundle, case
+    return None
+
+
+def list_case(datadir):
+    """
+    Lists files of case directory or documents of case in bundle
+    """
+    in_bundle = split_case(datadir)
+    if in_bundle is None:
+        return os.listdir(datadir)
+    bundle, case = in_bundle
+    return open_bundle(bundle).names(case)
+
+
+def exists(path):
+    """
+    Checks, if file of case directory or document of case in bundle exists
+    """
+    if os.path.exists(path):
+        return True
+    datadir, name = os.path.split(path)
+    in_bundle = split_case(datadir)
+    return in_bundle is not None and name in list_case(datadir)
+
+
+def read_file(path):
+    """
+    Reads file of case directory or document of case in bundle, addressed as <bundle>/<case name>/<name>
+    @return: bytes, None if file does not exist
+    """
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    datadir, name = os.path.split(path)
+    in_bundle = split_case(datadir)
+    if in_bundle is None:
+        return None
+    bundle, case = in_bundle
+    return open_bundle(bundle).read(case, name)
+
+
+def bundle_cases(filename, pattern=None):
+    """
+    @return: natsorted list of cases in bundle as <bundle>/<case name> paths
+    """
+    filename = os.path.abspath(filename)
+    return [os.path.join(filename, case) for case in open_bundle(filename).cases(pattern)]
+
+
+def pack(root, filename, pattern=None):
+    """
+    Packs case directories under root to new bundle
+    @param root: root directory of cases
+    @param filename: bundle file
+    @param pattern: glob pattern for top level directories
+    @return: number of packed cases
+    """
+    from case_index import find_cases
+
+    cases = find_cases(root, pattern)
+    with CaseBundle(filename, 'w') as bundle:
+        for datadir in cases:
+            bundle.add_directory(datadir)
+    return len(cases)
+
+
+def unpack(filename, root, pattern=None):
+    """
+    Extracts cases of bundle to directories under root
+    @return: number of extracted cases
+    """
+    with CaseBundle(filename) as bundle:
+        cases = bundle.cases(pattern)
+        for case in cases:
+            os.makedirs(os.path.join(root, case), exist_ok=True)
+            bundle.extract(case, os.path.join(root, case))
+    return len(cases)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Packs case directories to single-file bundle and back")
+    parser.add_argument("command", choices=['pack', 'unpack'])
+    parser.add_argument("root_dir", type=str, help="Path cases root")
+    parser.add_argument("bundle", type=str, help="Bundle file, *" + BUNDLE_EXT)
+    parser.add_argument("--glob", type=str, default=None, help="Pattern for cases")
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        print('{} cases packed to {}'.format(pack(args.root_dir, args.bundle, args.glob), args.bundle))
+    else:
+        print('{} cases extracted to {}'.format(unpack(args.bundle, args.root_dir, args.glob), args.root_dir))
@@ -0,0 +1,171 @@
+import os
+import re
+import sqlite3
+from fnmatch import fnmatch
+
+from case_bundle import bundle_cases, is_bundle
+
+INDEX_FILENAME = '.case-index.sqlite'
+_DIGITS = re.compile(r'(\d+)')
+
+
+def detect_flavour(names):
+    """
+    Detects naming flavour of case files
+    @param names: names of files in directory
+    @return: name of Case attribute with filenames: 'CASE_FILENAMES', 'CASE_FILENAMES_KT'
+    or 'CASE_FILENAMES_VSE'; None if directory is not a case
+    """
+    if 'nav-data.json' in names:
+        return 'CASE_FILENAMES' if 'target-data.json' in names else 'CASE_FILENAMES_VSE'
+    if 'navigation.json' in names:
+        return 'CASE_FILENAMES_KT'
+    return None
+
+
+class CaseIndex:
+    """
+    Persistent index of case directories under root, stored in SQLite.
+    Every directory is stored with its mtime, subdirectories and naming flavour.
+    On update every directory is stat'ed, and only directories with changed mtime
+    are listed again. Adding or removing a file or subdirectory changes mtime of its
+    directory, so removed case files and new nested cases are noticed,
+    and incremental rescan costs one stat per directory.
+    """
+
+    def __init__(self, root, index_file=None):
+        self.root = os.path.abspath(root)
+        if index_file is None:
+            index_file = os.path.join(self.root, INDEX_FILENAME)
+        try:
+            self.db = sqlite3.connect(index_file)
+            self._create_tables()
+        except sqlite3.OperationalError:
+            # Read-only tree, index lives only during this run
+            self.db = sqlite3.connect(':memory:')
+            self._create_tables()
+
+    def _create_tables(self):
+        self.db.execute('CREATE TABLE IF NOT EXISTS dirs '
+                        '(path TEXT PRIMARY KEY, mtime INTEGER, flavour TEXT, subdirs TEXT)')
+
+    def close(self):
+        self.db.close()
+
+    def update(self):
+        """
+        Rescans directory tree
+        @return: number of directories listed
+        """
+        known = {path: (mtime, subdirs) for path, mtime, subdirs in
+                 self.db.execute('SELECT path, mtime, subdirs FROM dirs')}
+        seen = set()
+        listed = 0
+        # Paths are concatenated, os.path.join costs more than stat here
+        prefix = os.path.join(self.root, '')
+        stack = ['']
+        while stack:
+            rel = stack.pop()
+            path = prefix + rel
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            seen.add(rel)
+            entry = known.get(rel)
+            parent = rel + os.sep if rel else ''
+            if entry is not None and entry[0] == mtime:
+                stack.extend(parent + d for d in _split(entry[1]))
+                continue
+
+            listed += 1
+            subdirs, files = [], []
+            try:
+                with os.scandir(path) as it:
+                    for item in it:
+                        if item.is_dir(follow_symlinks=False):
+                            subdirs.append(item.name)
+                        elif item.is_file():
+                            files.append(item.name)
+            except OSError:
+                continue
+            self.db.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?)',
+                            (rel, mtime, detect_flavour(files), '\n'.join(subdirs)))
+            stack.extend(parent + d for d in subdirs)
+
+        self.db.executemany('DELETE FROM dirs WHERE path = ?', [(path,) for path in known if path not in seen])
+        self.db.commit()
+        return listed
+
+    def cases(self, pattern=None):
+        """
+        Returns indexed cases
+        @param pattern: glob pattern like in Path.glob, cases are searched in every directory
+        it matches and below, as the old os.walk over Path.glob did; None for every case including root.
+        Pattern is matched with indexed paths, file system is not read
+        @return: natsorted list of absolute paths of case directories
+        """
+        paths = [path for path, in self.db.execute('SELECT path FROM dirs WHERE flavour IS NOT NULL')]
+        if pattern is not None:
+            parts = [part for part in pattern.replace(os.sep, '/').split('/') if part not in ('', '.')]
+            if parts == ['*']:
+                # Every directory below root matches
+                paths = [path for path in paths if path]
+            else:
+                paths = [path for path in paths if _match_prefix(_split_path(path), parts)]
+        return [os.path.join(self.root, path) for path in sorted(paths, key=_natural_key)]
+
+
+def _split(subdirs):
+    return subdirs.split('\n') if subdirs else []
+
+
+def _natural_key(path):
+    """
+    Sort key of the same order as natsorted, numbers are compared by value
+    """
+    parts = _DIGITS.split(path)
+    parts[1::2] = map(int, parts[1::2])
+    return parts
+
+
+def _split_path(rel):
+    return rel.split(os.sep) if rel else []
+
+
+def _match(parts, pattern):
+    """
+    Matches relative path with glob pattern like Path.glob: components are matched by fnmatch,
+    '**' matches any number of directories
+    @param parts: components of path
+    @param pattern: components of pattern
+    """
+    if not pattern:
+        return not parts
+    if pattern[0] == '**':
+        return any(_match(parts[k:], pattern[1:]) for k in range(len(parts) + 1))
+    return bool(parts) and fnmatch(parts[0], pattern[0]) and _match(parts[1:], pattern[1:])
+
+
+def _match_prefix(parts, pattern):
+    """
+    @return: True, if the directory or one of its parents up to root matches pattern
+    """
+    return any(_match(parts[:k], pattern) for k in range(len(parts) + 1))
+
+
+def find_cases(root, pattern=None):
+    """
+    Finds case directories under root, updating persistent index
+    @param root: root directory or case bundle
+    @param pattern: glob pattern for top level directories
+    @return: natsorted list of absolute paths of case directories, <bundle>/<case name> for bundle
+    """
+    if is_bundle(root):
+        return bundle_cases(root, pattern)
+    index = CaseIndex(root)
+    try:
+        index.update()
+        return index.cases(pattern)
+    finally:
+        index.close()
@@ -0,0 +1,143 @@
+import json
+import os
+from multiprocessing import Pool
+
+from case_bundle import list_case, read_file
+from case_index import detect_flavour
+from plot import Case
+from poly_convert import is_too_far
+
+# Files, without which solver can't run the case
+REQUIRED_FILES = ['nav_data', 'targets_data', 'route', 'constraints', 'settings']
+
+
+def _load(datadir, case_filenames, dataname, reasons):
+    data = read_file(os.path.join(datadir, case_filenames[dataname]))
+    if data is None:
+        reasons.append('{} is missing'.format(case_filenames[dataname]))
+        return None
+    try:
+        return json.loads(data)
+    except (ValueError, UnicodeDecodeError) as ex:
+        reasons.append('{} is malformed: {}'.format(case_filenames[dataname], ex))
+    return None
+
+
+def _check_position(item, fields, name, origin, reasons):
+    """
+    Checks, that item has numeric fields and its coordinates are valid and close to origin
+    @return: True if item is valid
+    """
+    if not isinstance(item, dict):
+        reasons.append('{} is not an object'.format(name))
+        return False
+    missing = [field for field in fields if not isinstance(item.get(field), (int, float))]
+    if missing:
+        reasons.append('{} has no numeric {}'.format(name, ', '.join(missing)))
+        return False
+    if not (-90 <= item['lat'] <= 90 and -180 <= item['lon'] <= 180):
+        reasons.append('{} has invalid coordinates {}, {}'.format(name, item['lat'], item['lon']))
+        return False
+    if origin is not None and is_too_far(item['lat'], item['lon'], *origin):
+        reasons.append('{} is too far from nav origin'.format(name))
+        return False
+    return True
+
+
+def _check_route(route, origin, reasons):
+    if not isinstance(route, dict) or not isinstance(route.get('items'), list) or len(route['items']) == 0:
+        reasons.append('route has no items')
+        return
+    if not isinstance(route.get('start_time'), (int, float)):
+        reasons.append('route has no start_time')
+    for i, item in enumerate(route['items']):
+        if not _check_position(item, ['lat', 'lon', 'duration', 'length'], 'route item {}'.format(i),
+                               origin if i == 0 else None, reasons):
+            return
+        if item['duration'] <= 0 or item['length'] < 0:
+            reasons.append('route item {} has non-positive duration or negative length'.format(i))
+            return
+
+
+def _first_point(geometry):
+    coordinates = geometry['coordinates']
+    if geometry['type'] == 'Point':
+        return coordinates
+    if geometry['type'] == 'LineString':
+        return coordinates[0]
+    return coordinates[0][0]
+
+
+def _check_constraints(constraints, origin, reasons):
+    if not isinstance(constraints, dict) or not isinstance(constraints.get('features'), list):
+        reasons.append('constraints have no features')
+        return
+    for i, feature in enumerate(constraints['features']):
+        try:
+            lon, lat = _first_point(feature['geometry'])[:2]
+            valid = -90 <= lat <= 90 and -180 <= lon <= 180
+        except (KeyError, IndexError, TypeError, ValueError):
+            reasons.append('constraint {} has malformed geometry'.format(i))
+            continue
+        if not valid or (origin is not None and is_too_far(lat, lon, *origin)):
+            reasons.append('constraint {} is too far from nav origin, lon/lat swapped? '
+                           'Fix with poly_convert.py'.format(i))
+
+
+def validate_case(datadir):
+    """
+    Checks case before running solver: required files, their schema and
+    coordinates sanity against nav origin.
+    @param datadir: case directory or case in bundle
+    @return: list of reasons, why case is invalid; empty if case is valid
+    """
+    try:
+        names = list_case(datadir)
+    except OSError as ex:
+        return [str(ex)]
+    flavour = detect_flavour(names)
+    if flavour is None:
+        return ['no navigation data file']
+    if flavour == 'CASE_FILENAMES_VSE' and Case.CASE_FILENAMES['route'] in names:
+        # Default case with missing target data looks like VSE one
+        flavour = 'CASE_FILENAMES'
+    case_filenames = getattr(Case, flavour)
+
+    reasons = []
+    data = {name: _load(datadir, case_filenames, name, reasons) for name in REQUIRED_FILES}
+
+    origin = None
+    if data['nav_data'] is not None:
+        if _check_position(data['nav_data'], ['lat', 'lon', 'COG', 'SOG', 'timestamp'], 'nav data', None, reasons):
+            origin = data['nav_data']['lat'], data['nav_data']['lon']
+    if data['targets_data'] is not None:
+        if not isinstance(data['targets_data'], list):
+            reasons.append('targets data is not a list')
+        else:
+            for i, target in enumerate(data['targets_data']):
+                _check_position(target, ['lat', 'lon', 'COG', 'SOG'], 'target {}'.format(i), origin, reasons)
+    if data['route'] is not None:
+        _check_route(data['route'], origin, reasons)
+    if data['constraints'] is not None:
+        _check_constraints(data['constraints'], origin, reasons)
+    if data['settings'] is not None and not isinstance(data['settings'], dict):
+        reasons.append('settings is not an object')
+    return reasons
+
+
+def validate_cases(directories_list, processes=None):
+    """
+    Validates cases in parallel
+    @param directories_list: list of case directories
+    @param processes: number of worker processes, default is number of cores
+    @return: list of valid directories, in original order, and dict of invalid ones: directory -> reasons
+    """
+    with Pool(processes) as p:
+        results = p.imap(validate_case, directories_list, chunksize=16)
+        valid, invalid = [], {}
+        for datadir, reasons in zip(directories_list, results):
+            if reasons:
+                invalid[datadir] = reasons
+            else:
+                valid.append(datadir)
+    return valid, invalid
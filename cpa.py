@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def cpa_tcpa_xy(rx, ry, vx, vy, v0x, v0y):
+    """
+    CPA and TCPA of target, for numbers or numpy arrays.
+    With zero relative speed distance doesn't change: CPA is current distance and TCPA is zero.
+    :param rx: target position relative to our ship, x
+    :param ry: target position relative to our ship, y
+    :param vx: target velocity, x
+    :param vy: target velocity, y
+    :param v0x: our velocity, x
+    :param v0y: our velocity, y
+    :return: CPA and TCPA, in units of position and position / velocity
+    """
+    wx = vx - v0x
+    wy = vy - v0y
+    # Numpy division also for plain numbers
+    w2 = np.asarray(wx * wx + wy * wy, dtype=float)
+    moving = w2 > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cpa = np.where(moving, np.abs(rx * wy - ry * wx) / np.sqrt(w2), np.sqrt(rx * rx + ry * ry))
+        tcpa = np.where(moving, -(rx * wx + ry * wy) / w2, 0.)
+    return cpa, tcpa
+
+
+def cpa_tcpa(v1, v2, course, diff, dist):
+    """
+    CPA and TCPA of targets, our ship moves along x axis
+    :param v1: our speed
+    :param v2: target speed
+    :param course: target bearing, rad
+    :param diff: course difference, rad
+    :param dist: distance to target
+    :return: CPA and TCPA
+    """
+    return cpa_tcpa_xy(dist * np.cos(course), dist * np.sin(course),
+                       v2 * np.cos(diff), v2 * np.sin(diff), v1, 0.)
+
+
+def min_dist_points(rx, ry, vx, vy, v0x, v0y):
+    """
+    Positions of our ship and target at TCPA, relative to current position of our ship
+    :return: (x, y) of our ship and (x, y) of target
+    """
+    _, tcpa = cpa_tcpa_xy(rx, ry, vx, vy, v0x, v0y)
+    return (v0x * tcpa, v0y * tcpa), (rx + vx * tcpa, ry + vy * tcpa)
+
+
+def cpa_params(v, v0, R):
+    """
+    Scalar CPA and TCPA for vectors with x and y attributes, like paintall.Vector2
+    :param v: target speed, vector
+    :param v0: our speed, vector
+    :param R: relative position, vector
+    :return: CPA and TCPA, floats
+    """
+    cpa, tcpa = cpa_tcpa_xy(R.x, R.y, v.x, v.y, v0.x, v0.y)
+    return float(cpa), float(tcpa)
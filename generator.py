@@ -1,49 +1,54 @@
-import itertools
+import heapq
 import json
 import os
+import re
 import time
-from math import pi, sin, cos, sqrt, degrees
+from math import pi, degrees, isfinite
 from multiprocessing import Pool
-from pathlib import Path
-from random import random, vonmisesvariate
 
 import numpy as np
 import pandas as pd
-from natsort import natsorted
 
+from case_bundle import BUNDLE_EXT, CaseBundle
+from case_index import find_cases
+from cpa import cpa_tcpa
 from konverter import Frame
-from paintall import Vector2
 
 
 # TODO: cythonize it!
 
 
-def det(a, b):
+def _quadratic_roots(a, b, c):
     """
-    Pseudoscalar multiply of vectors
-    :param a: 2D vector
-    :param b: 2D vector
-    :return: pseudoscalar multiply
+    Real roots of a * x^2 + b * x + c, NaN where there are none
     """
-    return a.x * b.y - b.x * a.y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        disc = np.sqrt(b * b - 4 * a * c)
+        linear = np.abs(a) < 1e-12
+        x1 = np.where(linear, -c / b, (-b - disc) / (2 * a))
+        x2 = np.where(linear, np.nan, (-b + disc) / (2 * a))
+    return x1, x2
 
 
-def calc_cpa_params(v, v0, R):
+def _choice(weights, rng):
     """
-    Calculating of CPA and tCPA criterions
-    :param v: target speed, vector
-    :param v0: our speed, vector
-    :param R: relative position, vector
-    :return:
+    Chooses column index in every row with probability proportional to weights
     """
-    w = v - v0
-    cpa = abs(det(R, w) / abs(w))
-    tcpa = - (R * w) / (w * w)
-    return cpa, tcpa
+    cumulative = np.cumsum(weights, axis=1)
+    u = rng.random(len(weights)) * cumulative[:, -1]
+    return np.minimum((cumulative <= u[:, None]).sum(axis=1), weights.shape[1] - 1)
+
+
+# Columns of danger points table, shards of generation are merged from these tables
+POINT_COLUMNS = ['unit', 'course', 'dist', 'c_diff', 'v_our', 'v_target', 'CPA', 'TCPA']
+# Ranges of test parameters: distance, course difference, bearing and speed.
+# Tolerance of near duplicates is a share of them
+NEAR_SCALES = {'dist': 12., 'course': 360., 'peleng': 360., 'speed': 18.}
 
 
 class Generator(object):
-    def __init__(self, max_dist, min_dist, N_rand, n_tests, safe_div_dist, n_targets=2, lat=56.6857, lon=19.632):
+    def __init__(self, max_dist, min_dist, N_rand, n_tests, safe_div_dist, n_targets=2, lat=56.6857, lon=19.632,
+                 seed=None):
         self.dist = max_dist
         self.min_dist = min_dist
         self.n_rand = N_rand
@@ -56,67 +61,176 @@ class Generator(object):
         self.t2_folder = None
         self.abs_t2_folder = None
         self.n_tests = n_tests
+        # Number of geometries, checked at once
+        self.batch_size = 4096
+        # Number of velocity draws per geometry, made at once
+        self.block_size = 32
+        # Sample velocities inside danger region instead of blind rejection
+        self.closed_form = True
+        # Number of cells of our velocity grid, used to sample our velocity in danger region
+        self.v_grid = 32
+        # Number of candidates of the second target, checked at once for every point
+        self.pair_block = 16
+        # Number of danger points in unit of work, every unit has its own random stream
+        self.unit_size = 10000
+        # Root entropy of random streams, the same seed gives the same tests
+        self.seed = np.random.SeedSequence(seed).entropy
+        # Stratified generation: bins of danger points, dict field -> bin edges, like {'course': [-180, 0, 180]},
+        # every bin gets quota points per distance instead of n_tests random points
+        self.bins = None
+        self.quota = None
+        # Number of draws in bin without new points, after which it is left not full
+        self.max_misses = 20000
 
-    def create_tests(self):
+    def units(self):
+        """
+        Splits generation into units of work: every distance is split into blocks of unit_size points.
+        In stratified generation every distance is one unit.
+        Unit is computed from its own random stream, so any subset of units may be computed anywhere.
+        @return: list of (distance index, distance, block index, number of points)
+        """
         step = 0.5
         dists = np.arange(self.min_dist, self.dist + step * .5, step)
         # Is used to provide algorithm to work more correctly
         # for i in range(N):
         #     if dists[i] == 12:
         #         dists[i] = 11.9
-        print("Start generating danger points...")
-        exec_time = time.time()
+        if self.bins is not None:
+            return [(i, dist, 0, None) for i, dist in enumerate(dists)]
+        return [(i, dist, block, min(self.unit_size, self.n_tests - start))
+                for i, dist in enumerate(dists)
+                for block, start in enumerate(range(0, self.n_tests, self.unit_size))]
+
+    def rng(self, *key):
+        """
+        Random stream of unit of work
+        @param key: tuple of ints, which identifies the unit
+        @return: numpy random Generator
+        """
+        return np.random.default_rng(np.random.SeedSequence(self.seed, spawn_key=key))
+
+    def create_unit(self, unit):
+        """
+        Creates danger points of unit of work
+        @param unit: (distance index, distance, block index, number of points)
+        @return: list of danger points
+        """
+        i, dist, block, n_points = unit
+        if self.bins is not None:
+            return self.create_stratified_points(dist, self.rng(0, i, block))
+        return self.create_danger_points(dist, n_points, self.rng(0, i, block))
+
+    def iter_points(self, shard=0, n_shards=1):
+        """
+        Creates danger points of every n_shards-th unit of work, starting from shard
+        @param shard: index of shard
+        @param n_shards: number of shards
+        @return: generator of DataFrames with POINT_COLUMNS, one per unit, in unit order;
+        unit is the global index of unit of work
+        """
+        units = self.units()
+        ids = range(shard, len(units), n_shards)
+        print(f"Start generating danger points, shard {shard + 1} of {n_shards}, seed {self.seed}...")
+        coverage = None
         with Pool() as p:
-            res = p.map(self.create_danger_points, dists)
-
-        self.danger_points = list(itertools.chain.from_iterable(res))
-        print(f'Danger Point generated.\nTotal time: {time.time() - exec_time}')
-        print(f'Total points: {len(self.danger_points)}')
-        exec_time1 = time.time()
-        print("Start generating tests...")
-        # ns = [i for i in range(0, len(self.danger_points))]
-        # with Pool() as p:
-        # p.map(self.create_targets, ns)
-        table_rows = [self.create_case(i) for i in range(len(self.danger_points))]
-        df = pd.DataFrame(table_rows, columns=['datadir', 'dist1', 'course1', 'peleng1', 'speed1',
-                                               'dist2', 'course2', 'peleng2', 'speed2',
-                                               'safe_diverg', 'speed'])
-
-        print(f'Tests generated.\nTime: {time.time() - exec_time1},\n Total time: {time.time() - exec_time}')
-        print(f'{len(df)} tests were generated for {self.n_targets} target(s)')
-        return df
-
-    def create_case(self, i):
-        self.our_vel = self.danger_points[i]['v_our']
+            for k, points in zip(ids, p.imap(self.create_unit, [units[k] for k in ids])):
+                points = pd.DataFrame(points, columns=POINT_COLUMNS[1:]).assign(unit=k)[POINT_COLUMNS]
+                if self.bins is not None:
+                    coverage = self.coverage(points) + (coverage if coverage is not None else 0)
+                yield points
+        if coverage is not None:
+            self.print_coverage(coverage, [units[k][1] for k in ids])
+
+    def coverage(self, points):
+        """
+        Counts danger points in bins
+        @param points: DataFrame of danger points
+        @return: Series, bins -> number of points
+        """
+        bins = [pd.cut(points[field], edges, right=False) for field, edges in self.bins.items()]
+        return points.groupby(bins, observed=False).size()
+
+    def coverage_table(self, coverage, dists):
+        """
+        Makes coverage table: points, quota and filled share of every bin.
+        Quota counts distances, at which the bin is reachable.
+        @param coverage: Series from coverage
+        @param dists: distances of units
+        @return: DataFrame
+        """
+        quota = self.quota * sum(self.reachable_bins(dist).astype(int) for dist in dists)
+        table = pd.DataFrame({'points': coverage, 'quota': np.ravel(quota)})
+        table['filled'] = (table['points'] / table['quota']).round(3)
+        return table
+
+    def print_coverage(self, coverage, dists):
+        """
+        Prints coverage table
+        @param coverage: Series from coverage
+        @param dists: distances of units
+        """
+        table = self.coverage_table(coverage, dists)
+        print(f'Coverage: {(table["points"] >= table["quota"]).sum()} of {len(table)} bins are full, '
+              f'{table["points"].sum()} points')
+        print(table.to_string())
+
+    def create_tests(self):
+        return pd.concat(self.iter_tests(self.iter_points()), ignore_index=True)
+
+    def iter_tests(self, chunks):
+        """
+        Creates tests from chunks of danger points of all units in unit order, e.g. merged from shards.
+        With one target only the current chunk is kept in memory. The second target is searched
+        among all points, so with two targets points are collected first, as arrays.
+        @param chunks: iterable of DataFrames with POINT_COLUMNS
+        @return: generator of DataFrames of tests
+        """
+        columns = ['datadir', 'dist1', 'course1', 'peleng1', 'speed1',
+                   'dist2', 'course2', 'peleng2', 'speed2',
+                   'safe_diverg', 'speed']
+        if self.n_targets == 2:
+            points = pd.concat(chunks, ignore_index=True)
+            print("Start pairing targets...")
+            exec_time = time.time()
+            partners, paired = self.pair_targets(points, self.rng(1))
+            print(f'Targets paired.\nTime: {time.time() - exec_time}')
+            chunks = (points.iloc[start:start + self.unit_size]
+                      for start in range(0, len(points), self.unit_size))
+        start = 0
+        for chunk in chunks:
+            if self.n_targets == 2:
+                stop = start + len(chunk)
+                chunk_partners = [partner if is_paired else None for partner, is_paired in
+                                  zip(partners.iloc[start:stop].to_dict('records'), paired[start:stop])]
+                start = stop
+            else:
+                chunk_partners = [None] * len(chunk)
+            table_rows = [self.create_case(point, partner)
+                          for point, partner in zip(chunk.to_dict('records'), chunk_partners)]
+            yield pd.DataFrame([row for row in table_rows if row is not None], columns=columns)
+
+    def create_case(self, point, partner=None):
+        """
+        Creates table row of case
+        @param point: danger point of the first target
+        @param partner: record of the second target from pair_targets, for two targets
+        @return: table row or None
+        """
+        self.our_vel = point['v_our']
         targets = []
-        targets.append(self.danger_points[i])
+        targets.append(point)
         if self.n_targets == 2:
-            for j in range(i, len(self.danger_points)):
-                [dang, v1, v2, CPA, TCPA] = self.dangerous(self.danger_points[j]['dist'],
-                                                           self.danger_points[j]['course'],
-                                                           self.danger_points[j]['c_diff'],
-                                                           self.our_vel)
-                if not dang:
-                    continue
-                else:
-                    record = {"course": self.danger_points[j]['course'],
-                              "dist": self.danger_points[j]['dist'],
-                              "c_diff": self.danger_points[j]['c_diff'],
-                              "v_our": v1,
-                              "v_target": v2,
-                              "CPA": CPA,
-                              "TCPA": TCPA}
-                    targets.append(record)
-                    f_name = ("sc_" + str(targets[0]['dist']) + "_" + str(targets[1]['dist']) + "_" +
-                              str(round(targets[0]['v_target'], 1)) + "_" +
-                              str(round(targets[1]['v_target'], 1)) + "_" +
-                              str(round(self.our_vel, 1)) + "_" + str(round(targets[0]['c_diff'], 1)) + "_" +
-                              str(round(targets[1]['c_diff'], 1)) + "_" + str(round(targets[0]['CPA'], 1)) +
-                              "_" + str(round(targets[1]['CPA'], 1)) + "_" + str(round(targets[0]['TCPA'], 1)) +
-                              "_" + str(round(targets[1]['TCPA'], 1)))
-                    # self.construct_files(f_name, targets)
-                    return self.construct_table_row(f_name, targets)
-                    del targets[1]
+            if partner is not None:
+                targets.append(partner)
+                f_name = ("sc_" + str(targets[0]['dist']) + "_" + str(targets[1]['dist']) + "_" +
+                          str(round(targets[0]['v_target'], 1)) + "_" +
+                          str(round(targets[1]['v_target'], 1)) + "_" +
+                          str(round(self.our_vel, 1)) + "_" + str(round(targets[0]['c_diff'], 1)) + "_" +
+                          str(round(targets[1]['c_diff'], 1)) + "_" + str(round(targets[0]['CPA'], 1)) +
+                          "_" + str(round(targets[1]['CPA'], 1)) + "_" + str(round(targets[0]['TCPA'], 1)) +
+                          "_" + str(round(targets[1]['TCPA'], 1)))
+                # self.construct_files(f_name, targets)
+                return self.construct_table_row(f_name, targets)
         elif self.n_targets == 1:
             f_name = ("sc_" + str(targets[0]['dist']) + "_0_" +
                       str(round(targets[0]['v_target'], 1)) + "_0_" +
@@ -126,6 +240,74 @@ class Generator(object):
             # self.construct_files(f_name, targets)
             return self.construct_table_row(f_name, targets)
 
+    def pair_targets(self, points, rng=None):
+        """
+        Finds the second target for every danger point: the first point j > i, which
+        is dangerous with our velocity of point i. All points are paired at once, in rounds of
+        pair_block candidates per point. Candidates are taken from index of points by our velocity
+        cells, so points, which can't be dangerous with our velocity, are not checked.
+        @param points: DataFrame of danger points
+        @param rng: numpy random Generator
+        @return: DataFrame of records of the second target and mask of points, which have a pair
+        """
+        v_min = 2
+        v_max = 20
+        rng = rng if rng is not None else np.random.default_rng()
+        n = len(points)
+        if n == 0:
+            return pd.DataFrame(columns=POINT_COLUMNS[1:]), np.zeros(0, dtype=bool)
+        dist = points['dist'].to_numpy(dtype=float)
+        peleng = np.radians(points['course'].to_numpy(dtype=float))
+        c_diff = np.radians(points['c_diff'].to_numpy(dtype=float))
+        v_our = points['v_our'].to_numpy(dtype=float)
+
+        # Index: points, which are dangerous in every cell of our velocity, in ascending order
+        grid = v_min + (v_max - v_min) * (np.arange(self.v_grid) + .5) / self.v_grid
+        cells = [[] for _ in range(self.v_grid)]
+        for start in range(0, n, self.batch_size):
+            stop = min(start + self.batch_size, n)
+            v_grid = np.broadcast_to(grid, (stop - start, self.v_grid))
+            _, mask = self.danger_segments(dist[start:stop, None], peleng[start:stop, None],
+                                           c_diff[start:stop, None], v_grid)
+            feasible = mask.any(axis=-1)
+            # Neighbour cells too, danger region may not reach the middle of the cell
+            feasible[:, 1:] |= feasible[:, :-1].copy()
+            feasible[:, :-1] |= feasible[:, 1:].copy()
+            for cell in range(self.v_grid):
+                cells[cell].append(start + np.flatnonzero(feasible[:, cell]).astype(np.int32))
+        cells = [np.concatenate(members) for members in cells]
+        offsets = np.cumsum([0] + [len(members) for members in cells])
+        index = np.concatenate(cells)
+
+        # Position of the first point after every point in the index list of its cell
+        cell_of = np.clip(((v_our - v_min) / (v_max - v_min) * self.v_grid).astype(int), 0, self.v_grid - 1)
+        position = np.empty(n, dtype=np.int64)
+        for cell in range(self.v_grid):
+            members = np.flatnonzero(cell_of == cell)
+            position[members] = offsets[cell] + np.searchsorted(cells[cell], members, side='right')
+        end = offsets[cell_of + 1]
+
+        partner = np.full(n, -1)
+        v_target, partner_CPA, partner_TCPA = np.zeros(n), np.zeros(n), np.zeros(n)
+        left = np.arange(n)
+        while len(left) != 0:
+            candidates = position[left, None] + np.arange(self.pair_block)
+            valid = candidates < end[left, None]
+            j = index[np.minimum(candidates, len(index) - 1)]
+            is_dang, _, v2, CPA, TCPA = self.danger_region_batch(dist[j].ravel(), peleng[j].ravel(), c_diff[j].ravel(),
+                                                                 np.repeat(v_our[left], self.pair_block), rng=rng)
+            found = is_dang.reshape(j.shape) & valid
+            rows = np.flatnonzero(found.any(axis=1))
+            first = found[rows].argmax(axis=1)
+            k = rows * self.pair_block + first
+            partner[left[rows]] = j[rows, first]
+            v_target[left[rows]], partner_CPA[left[rows]], partner_TCPA[left[rows]] = v2[k], CPA[k], TCPA[k]
+            position[left] += self.pair_block
+            left = left[~found.any(axis=1) & (position[left] < end[left])]
+        partners = points.iloc[np.maximum(partner, 0)][['course', 'dist', 'c_diff']].reset_index(drop=True)
+        partners = partners.assign(v_our=v_our, v_target=v_target, CPA=partner_CPA, TCPA=partner_TCPA)
+        return partners, partner >= 0
+
     def construct_table_row(self, f_name, targets):
         """
         Constructs all xlsx or csv files
@@ -172,34 +354,264 @@ class Generator(object):
         else:
             return None
 
-    def create_danger_points(self, dist):
+    def create_danger_points(self, dist, n_points=None, rng=None):
         """
         Creates danger points to specified distance
         @param dist: distance
+        @param n_points: number of points, n_tests by default
+        @param rng: numpy random Generator
         @return:
         """
+        n_points = n_points if n_points is not None else self.n_tests
+        rng = rng if rng is not None else np.random.default_rng()
         danger_points = []
-        while len(danger_points) < self.n_tests:
-            tar_c = -pi + vonmisesvariate(0, 0)
-            t_c_diff = -pi + vonmisesvariate(0, 0)
-            [is_dang, v0, vt, CPA, TCPA] = self.dangerous(dist, tar_c, t_c_diff)
+        while len(danger_points) < n_points:
+            tar_c = -pi + rng.uniform(0, 2 * pi, self.batch_size)
+            t_c_diff = -pi + rng.uniform(0, 2 * pi, self.batch_size)
+            sampler = self.danger_region_batch if self.closed_form else self.danger_batch
+            is_dang, v0, vt, CPA, TCPA = sampler(dist, tar_c, t_c_diff, rng=rng)
             # Normalized true course difference
-            n_tcd = 0
-            if t_c_diff >= 0:
-                n_tcd = degrees(t_c_diff)
-            else:
-                n_tcd = degrees(t_c_diff + 2 * pi)
-            if is_dang:
-                record = {"course": degrees(tar_c),
+            n_tcd = np.degrees(np.where(t_c_diff >= 0, t_c_diff, t_c_diff + 2 * pi))
+            for k in np.flatnonzero(is_dang)[:n_points - len(danger_points)]:
+                record = {"course": degrees(tar_c[k]),
                           "dist": dist,
-                          "c_diff": n_tcd,
-                          "v_our": v0,
-                          "v_target": vt,
-                          "CPA": CPA,
-                          "TCPA": TCPA}
+                          "c_diff": n_tcd[k],
+                          "v_our": v0[k],
+                          "v_target": vt[k],
+                          "CPA": CPA[k],
+                          "TCPA": TCPA[k]}
                 danger_points.append(record)
         return danger_points
 
+    def sample_domains(self, dist):
+        """
+        Ranges of parameters, which are sampled for danger points, angles in degrees
+        @param dist: distance
+        @return: dict field -> (min, max)
+        """
+        return {'course': (-180., 180.), 'c_diff': (0., 360.), 'v_our': (2., 20.), 'v_target': (2., 20.),
+                'dist': (dist, np.nextafter(dist, np.inf))}
+
+    def reachable_bins(self, dist):
+        """
+        Finds bins, which may contain danger points at distance: their ranges intersect sample domains
+        @param dist: distance
+        @return: bool array of bins
+        """
+        edges = [np.asarray(field_edges, dtype=float) for field_edges in self.bins.values()]
+        shape = [len(field_edges) - 1 for field_edges in edges]
+        reachable = np.ones(shape, dtype=bool)
+        domains = self.sample_domains(dist)
+        for i, field in enumerate(self.bins):
+            if field in domains:
+                low, high = domains[field]
+                index = np.indices(shape)[i]
+                reachable &= (edges[i][index] < high) & (edges[i][index + 1] > low)
+        return reachable
+
+    def create_stratified_points(self, dist, rng=None):
+        """
+        Creates danger points to specified distance, until every bin has quota points.
+        Every point is drawn for a random bin, which is not full: bearing, course difference and
+        velocities are sampled inside ranges of the bin, so inside of it points are distributed
+        as by generator with parameter ranges of the bin. CPA and TCPA bins are filled by accepting
+        points, which fall into them. Bins, which can't contain points at this distance, are skipped,
+        bins, which got no points for max_misses draws, are left not full: they may be unreachable.
+        @param dist: distance
+        @param rng: numpy random Generator
+        @return: list of danger points
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        fields = list(self.bins)
+        edges = [np.asarray(self.bins[field], dtype=float) for field in fields]
+        counts = np.zeros([len(field_edges) - 1 for field_edges in edges], dtype=int)
+        domains = self.sample_domains(dist)
+        reachable = self.reachable_bins(dist)
+        sampler = self.danger_region_batch if self.closed_form else self.danger_batch
+        misses = np.zeros(counts.shape, dtype=int)
+        danger_points = []
+        while ((counts < self.quota) & reachable & (misses < self.max_misses)).any():
+            cells = np.argwhere((counts < self.quota) & reachable & (misses < self.max_misses))
+            cells = cells[rng.integers(len(cells), size=self.batch_size)]
+            np.add.at(misses, tuple(cells.T), 1)
+            ranges = {}
+            for name, (low, high) in domains.items():
+                if name in fields:
+                    i = fields.index(name)
+                    low = np.maximum(edges[i][cells[:, i]], low)
+                    high = np.minimum(edges[i][cells[:, i] + 1], high)
+                ranges[name] = (low, high)
+            angles = {name: low + (high - low) * rng.random(self.batch_size)
+                      for name, (low, high) in ranges.items() if name in ('course', 'c_diff')}
+            tar_c, t_c_diff = np.radians(angles['course']), np.radians(angles['c_diff'])
+            is_dang, v0, vt, CPA, TCPA = sampler(dist, tar_c, t_c_diff, rng=rng, v_our_range=ranges['v_our'],
+                                                 v_target_range=ranges['v_target'])
+            values = {'course': angles['course'], 'dist': np.full(self.batch_size, dist),
+                      'c_diff': angles['c_diff'], 'v_our': v0, 'v_target': vt, 'CPA': CPA, 'TCPA': TCPA}
+            index = np.stack([np.searchsorted(field_edges, values[field], side='right') - 1
+                              for field, field_edges in zip(fields, edges)], axis=1)
+            inside = is_dang & ((index >= 0) & (index < counts.shape)).all(axis=1)
+            for k in np.flatnonzero(inside):
+                cell = tuple(index[k])
+                if counts[cell] < self.quota:
+                    counts[cell] += 1
+                    misses[cell] = 0
+                    danger_points.append({"course": angles['course'][k],
+                                          "dist": dist,
+                                          "c_diff": angles['c_diff'][k],
+                                          "v_our": v0[k],
+                                          "v_target": vt[k],
+                                          "CPA": CPA[k],
+                                          "TCPA": TCPA[k]})
+        return danger_points
+
+    def is_dangerous(self, CPA, TCPA):
+        # TODO: fix it to non-eq operators
+        return (CPA <= self.sdd) & (0 <= TCPA) & (TCPA < 0.333333)
+
+    def danger_batch(self, dist, peleng, course_diff, v1=None, rng=None, v_our_range=(2, 20), v_target_range=(2, 20)):
+        """
+        Checks, if points are dangerous, for arrays of points.
+        For every point up to n_rand random velocities are tried, the first dangerous one is taken.
+        Velocities are drawn in blocks of block_size for points, which are not resolved yet.
+        @param dist: distance to target
+        @param peleng: target pelengs, array
+        @param course_diff: course differences, array
+        @param v1: our velocity, random if None
+        @param rng: numpy random Generator
+        @param v_our_range: (min, max) of random our velocity, numbers or arrays like pelengs
+        @param v_target_range: (min, max) of target velocity, numbers or arrays like pelengs
+        @return: arrays is_dangerous, our_vel, tar_vel, CPA, TCPA
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        n = len(peleng)
+        v_min, v_max = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in v_target_range)
+        v1_min, v1_max = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in v_our_range)
+        is_dang = np.zeros(n, dtype=bool)
+        v_our = np.full(n, 0. if v1 is None else v1)
+        v_tar = np.zeros(n)
+        CPA = np.full(n, -1.)
+        TCPA = np.full(n, -1.)
+        left = np.arange(n)
+        tried = 0
+        while len(left) != 0 and tried < self.n_rand:
+            m = min(self.block_size, self.n_rand - tried)
+            tried += m
+            v2 = v_min[left, None] + (v_max - v_min)[left, None] * rng.random((len(left), m))
+            if v1 is None:
+                v1_block = v1_min[left, None] + (v1_max - v1_min)[left, None] * rng.random((len(left), m))
+            else:
+                v1_block = np.full_like(v2, v1)
+            cpa, tcpa = cpa_tcpa(v1_block, v2, peleng[left, None], course_diff[left, None], dist)
+            ok = self.is_dangerous(cpa, tcpa)
+            found = ok.any(axis=1)
+            first = ok.argmax(axis=1)
+            rows, cols = left[found], first[found]
+            is_dang[rows] = True
+            v_our[rows] = v1_block[found, cols]
+            v_tar[rows] = v2[found, cols]
+            CPA[rows] = cpa[found, cols]
+            TCPA[rows] = tcpa[found, cols]
+            # Last tried velocities are reported for not dangerous points, as in sequential check
+            v_our[left[~found]] = v1_block[~found, -1]
+            v_tar[left[~found]] = v2[~found, -1]
+            left = left[~found]
+        return is_dang, v_our, v_tar, CPA, TCPA
+
+    def danger_segments(self, dist, peleng, course_diff, v1, v_range=(2, 20)):
+        """
+        Finds target velocities, which make points dangerous for given our velocities.
+        Every condition is a sign of polynomial of target velocity v2, w = v2 * u - v1 * e_x:
+        CPA <= sdd is (R x w)^2 - sdd^2 |w|^2 <= 0, TCPA >= 0 is R.w <= 0,
+        TCPA < T is T |w|^2 + R.w > 0. Velocity range is split at their roots,
+        every segment is dangerous or not as a whole.
+        @param dist: distance to target
+        @param peleng: target pelengs, array, broadcastable to v1
+        @param course_diff: course differences, array, broadcastable to v1
+        @param v1: our velocities, array
+        @param v_range: (min, max) of target velocity, numbers or arrays broadcastable to v1
+        @return: segment edges (..., 7) and mask of dangerous segments (..., 6)
+        """
+        v_min, v_max = (np.broadcast_to(np.asarray(v, dtype=float), v1.shape) for v in v_range)
+        T = 0.333333
+        a, b = peleng, course_diff
+        sin_a, cos_a, cos_b = np.sin(a), np.cos(a), np.cos(b)
+        sin_ba, cos_ab = np.sin(b - a), np.cos(a - b)
+        sdd2 = self.sdd ** 2
+        # R.w / d = v2 * cos(a - b) - v1 * cos(a)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            linear = v1 * cos_a / cos_ab
+        # (R x w)^2 - sdd^2 |w|^2, R x w = d * (v2 * sin(b - a) + v1 * sin(a))
+        c2 = dist ** 2 * sin_ba ** 2 - sdd2
+        c1 = v1 * (2 * dist ** 2 * sin_ba * sin_a + 2 * sdd2 * cos_b)
+        c0 = v1 ** 2 * (dist ** 2 * sin_a ** 2 - sdd2)
+        # T |w|^2 + R.w
+        t1 = dist * cos_ab - 2 * T * v1 * cos_b
+        t0 = T * v1 ** 2 - dist * v1 * cos_a
+        c2, t2 = np.broadcast_to(c2, v1.shape), np.full(v1.shape, T)
+        edges = np.stack([v_min, v_max, np.broadcast_to(linear, v1.shape),
+                          *_quadratic_roots(c2, c1, c0), *_quadratic_roots(t2, t1, t0)], axis=-1)
+        v_min, v_max = v_min[..., None], v_max[..., None]
+        edges = np.sort(np.clip(np.where(np.isnan(edges), v_min, edges), v_min, v_max), axis=-1)
+        m = (edges[..., 1:] + edges[..., :-1]) / 2
+        v1, cos_a, cos_ab = v1[..., None], np.asarray(cos_a)[..., None], np.asarray(cos_ab)[..., None]
+        mask = (((c2[..., None] * m + c1[..., None]) * m + c0[..., None] <= 0) &
+                (m * cos_ab - v1 * cos_a <= 0) &
+                ((T * m + t1[..., None]) * m + t0[..., None] > 0))
+        return edges, mask & (edges[..., 1:] > edges[..., :-1])
+
+    def danger_region_batch(self, dist, peleng, course_diff, v1=None, rng=None, v_our_range=(2, 20),
+                            v_target_range=(2, 20)):
+        """
+        Same as danger_batch, but velocities are sampled inside danger region.
+        Sequential check takes the first dangerous of n_rand uniform draws, so it finds
+        a point with probability 1 - (1 - p)^n_rand, where p is a share of dangerous
+        velocities, and its velocities are uniform in danger region. Here p is found
+        from danger_segments, point is accepted with that probability and velocities
+        are drawn uniformly from the region. With random our velocity, its density is
+        resolved on v_grid cells, target velocity is exact.
+        Distance and our velocity may also be arrays of the same length as pelengs,
+        velocity ranges may be arrays too.
+        @return: arrays is_dangerous, our_vel, tar_vel, CPA, TCPA
+        """
+        rng = rng if rng is not None else np.random.default_rng()
+        n = len(peleng)
+        v_min, v_max = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in v_target_range)
+        v_range = (v_min[:, None], v_max[:, None])
+        if v1 is None:
+            v1_min, v1_max = (np.broadcast_to(np.asarray(v, dtype=float), (n,)) for v in v_our_range)
+            grid = (np.arange(self.v_grid) + .5) / self.v_grid
+            v_grid = v1_min[:, None] + (v1_max - v1_min)[:, None] * grid
+            edges, mask = self.danger_segments(dist, peleng[:, None], course_diff[:, None], v_grid, v_range)
+            lengths = ((edges[..., 1:] - edges[..., :-1]) * mask).sum(axis=-1)
+            p = lengths.mean(axis=1) / (v_max - v_min)
+        else:
+            v_our = np.broadcast_to(np.asarray(v1, dtype=float), (n,)).copy()
+            edges, mask = self.danger_segments(dist, peleng, course_diff, v_our, (v_min, v_max))
+            p = ((edges[:, 1:] - edges[:, :-1]) * mask).sum(axis=1) / (v_max - v_min)
+        is_dang = rng.random(n) < 1 - (1 - np.minimum(p, 1)) ** self.n_rand
+
+        if v1 is None:
+            v_our = np.zeros(n)
+            left = np.flatnonzero(is_dang)
+            while len(left) != 0:
+                cell = _choice(lengths[left], rng)
+                v_our[left] = v1_min[left] + (v1_max - v1_min)[left] * (cell + rng.random(len(left))) / self.v_grid
+                _, left_mask = self.danger_segments(dist, peleng[left], course_diff[left], v_our[left],
+                                                    (v_min[left], v_max[left]))
+                # Cell may contain velocities without danger, they are drawn again
+                left = left[~left_mask.any(axis=1)]
+            edges, mask = self.danger_segments(dist, peleng, course_diff, v_our, (v_min, v_max))
+
+        segment_lengths = (edges[:, 1:] - edges[:, :-1]) * mask
+        v_tar = np.zeros(n)
+        rows = np.flatnonzero(is_dang)
+        segment = _choice(segment_lengths[rows], rng)
+        v_tar[rows] = edges[rows, segment] + segment_lengths[rows, segment] * rng.random(len(rows))
+        CPA, TCPA = cpa_tcpa(v_our, v_tar, peleng, course_diff, dist)
+        CPA[~is_dang], TCPA[~is_dang] = -1, -1
+        return is_dang, v_our, v_tar, CPA, TCPA
+
     def dangerous(self, dist, peleng, course_diff, v1=None):
         """
         Checks, if point is dangerous.
@@ -207,42 +619,19 @@ class Generator(object):
         @param dist: distance to target
         @param peleng: target peleng
         @param course_diff: course difference
-        @return: [is_dangerous, our_vel, tar_vel]
+        @return: [is_dangerous, our_vel, tar_vel, CPA, TCPA]
         """
-        v_min = 2
-        v_max = 20
-        alpha = peleng
-        beta = course_diff
-        fix_sp = False
-        v2 = 0
-        if v1 is not None:
-            fix_sp = True
-        else:
-            v1 = 0
-        for i in range(self.n_rand):
-            try:
-                if not fix_sp:
-                    v1 = v_min + (v_max - v_min) * random()
-                v2 = v_min + (v_max - v_min) * random()
-                CPA, TCPA = self.get_CPA_TCPA(v1, v2, alpha, beta, dist)
-                # TODO: fix it to non-eq operators
-                if CPA <= self.sdd and 0 <= TCPA < 0.333333:
-                    return [True, v1, v2, CPA, TCPA]
-            except ZeroDivisionError or ValueError:
-                continue
-        return [False, v1, v2, -1, -1]
+        sampler = self.danger_region_batch if self.closed_form else self.danger_batch
+        is_dang, v_our, v_tar, CPA, TCPA = sampler(dist, np.array([peleng]), np.array([course_diff]), v1)
+        return [bool(is_dang[0]), float(v_our[0]), float(v_tar[0]), float(CPA[0]), float(TCPA[0])]
 
     def get_CPA_TCPA(self, v1, v2, course, diff, dist, method='KT'):
-        if method == 'default':
-            v_rel = sqrt(v1 ** 2 - 2 * v1 * v2 * cos(diff) + v2 ** 2)
-            TCPA = -dist * (v2 * cos(course - diff) - v1 * cos(course)) / v_rel ** 2
-            CPA = dist * abs(v2 * sin(course - diff) - v1 * sin(course)) / v_rel
-            return CPA, TCPA
-        elif method == 'KT':
-            v_our = Vector2(v1, 0)
-            v_target = Vector2(v2 * cos(diff), v2 * sin(diff))
-            R = Vector2(dist * cos(course), dist * sin(course))
-            return calc_cpa_params(v_target, v_our, R)
+        """
+        CPA and TCPA of target, our ship moves along x axis.
+        Both methods ('default' and 'KT') are computed by cpa module and give the same result.
+        """
+        CPA, TCPA = cpa_tcpa(v1, v2, course, diff, dist)
+        return float(CPA), float(TCPA)
 
     # Files
 
@@ -458,19 +847,11 @@ class FilderGenerator:
         return payload
 
     def get_dir_list(self, typo=1):
-        directories_list = []
+        os.chdir(self.cwd)
         if typo == 1:
-            os.chdir(self.cwd)
-            os.chdir(self.foldername)
+            self.dirlist = find_cases(self.foldername, '*')
         else:
-            os.chdir(self.cwd)
-            os.chdir(self.t2_folder)
-        for path in Path(os.getcwd()).glob('*'):
-            for root, dirs, files in os.walk(path):
-                if "nav-data.json" in files or 'navigation.json' in files:
-                    directories_list.append(os.path.join(self.foldername, root))
-        self.dirlist = natsorted(directories_list)
-        os.chdir(self.cwd)
+            self.dirlist = find_cases(self.t2_folder, '*')
 
     @staticmethod
     def get_target_data(dirname):
@@ -491,12 +872,422 @@ class FilderGenerator:
         return strs[:-1]
 
 
+def _template(payload):
+    """
+    Serializes payload once, with "@@name@@" strings as placeholders of varying values
+    @return: list of alternating literal parts and names of values
+    """
+    return re.split(r'"@@(\w+)@@"', json.dumps(payload))
+
+
+def _json_value(value):
+    # json serializes finite floats with float.__repr__
+    if isinstance(value, float) and isfinite(value):
+        return float.__repr__(value)
+    return json.dumps(value)
+
+
+def _render(template, values):
+    """
+    Substitutes values to template, gives the same text as json.dump of payload with these values
+    """
+    parts = template[:]
+    parts[1::2] = [_json_value(values[name]) for name in template[1::2]]
+    return ''.join(parts)
+
+
+class ScenarioWriter:
+    """
+    Writes scenario directories of tests table in bulk, files are the same as from
+    FilderGenerator.construct_files. Constraints and hmi data, settings and target settings
+    are the same across the corpus and are serialized once; navigation, route and target data
+    are rendered from templates, only their varying fields are serialized per scenario.
+    If foldername ends with .bundle, scenarios are written to case bundle instead of directories.
+    """
+
+    def __init__(self, foldername, lat=56.6857, lon=19.632):
+        self.foldername = foldername
+        self.payloads = FilderGenerator(0, 0, 0, 0, 0, 0, lat=lat, lon=lon)
+        self.frame = self.payloads.frame
+        self.invariant = {}
+
+        self.payloads.our_vel = '@@speed@@'
+        self.nav_template = _template(self.payloads.construct_nav_data())
+        self.payloads.our_vel = 1.
+        route = self.payloads.construct_route_data()
+        route['items'][0]['duration'] = '@@duration@@'
+        self.route_template = _template(route)
+        target = self.payloads.construct_target_data([{'course': 0., 'dist': 0., 'v_target': 0., 'c_diff': 0.}])[0]
+        target.update({key: '@@{}@@'.format(key) for key in ['id', 'lat', 'lon', 'SOG', 'COG', 'heading', 'peleng']})
+        self.target_template = _template(target)
+
+    def invariant_files(self, sdd):
+        """
+        Serialized files, which depend on safe divergence distance only
+        @param sdd: safe divergence distance
+        @return: dict, file name -> text
+        """
+        if sdd not in self.invariant:
+            self.payloads.sdd = sdd
+            self.invariant[sdd] = {'constraints.json': json.dumps(self.payloads.construct_constrains()),
+                                   'hmi-data.json': json.dumps(self.payloads.construct_hmi_data()),
+                                   'settings.json': json.dumps(self.payloads.construct_settings()),
+                                   'target-settings.json': json.dumps(self.payloads.construct_target_settings())}
+        return self.invariant[sdd]
+
+    def scenario_files(self, row):
+        """
+        Serializes files of scenario
+        @param row: row of tests table, dict
+        @return: dict, file name -> text
+        """
+        files = dict(self.invariant_files(row['safe_diverg']))
+        speed = row['speed']
+        files['nav-data.json'] = _render(self.nav_template, {'speed': speed})
+        files['route-data.json'] = _render(self.route_template, {'duration': 120.0 / speed * 3600})
+        targets = []
+        for i in (1, 2):
+            # Second target of one target tests is zero
+            if i == 2 and row['dist2'] == 0:
+                break
+            lat, lon = self.frame.to_wgs_azi(row['peleng{}'.format(i)], row['dist{}'.format(i)])
+            targets.append(_render(self.target_template, {'id': 'target' + str(i - 1),
+                                                          'lat': lat,
+                                                          'lon': lon,
+                                                          'SOG': row['speed{}'.format(i)],
+                                                          'COG': row['course{}'.format(i)],
+                                                          'heading': row['course{}'.format(i)],
+                                                          'peleng': row['peleng{}'.format(i)]}))
+        files['target-data.json'] = '[' + ', '.join(targets) + ']'
+        return files
+
+    def serialize_rows(self, rows):
+        """
+        Serializes scenarios
+        @param rows: list of rows of tests table, dicts
+        @return: list of (scenario name, files)
+        """
+        return [(row['datadir'], self.scenario_files(row)) for row in rows]
+
+    def write_rows(self, rows):
+        """
+        Writes scenario directories
+        @param rows: list of rows of tests table, dicts
+        @return: number of written scenarios
+        """
+        for row in rows:
+            dirname = os.path.join(self.foldername, row['datadir'])
+            os.makedirs(dirname, exist_ok=True)
+            for filename, text in self.scenario_files(row).items():
+                with open(os.path.join(dirname, filename), 'w') as fp:
+                    fp.write(text)
+        return len(rows)
+
+    def write(self, chunks, processes=None, batch=256):
+        """
+        Writes scenario directories of tests in process pool
+        @param chunks: iterable of DataFrames of tests, e.g. from read_chunks
+        @param processes: number of processes, default is number of cores
+        @param batch: number of scenarios per task
+        @return: number of written scenarios
+        """
+        exec_time = time.time()
+        to_bundle = self.foldername.endswith(BUNDLE_EXT)
+        if not to_bundle:
+            os.makedirs(self.foldername, exist_ok=True)
+
+        def batches():
+            for chunk in chunks:
+                rows = chunk.to_dict('records')
+                for start in range(0, len(rows), batch):
+                    yield rows[start:start + batch]
+
+        written = 0
+        bundle = CaseBundle(self.foldername, 'a') if to_bundle else None
+        try:
+            with Pool(processes) as p:
+                # Workers serialize scenarios, the only writer of bundle is this process
+                for result in p.imap_unordered(self.serialize_rows if to_bundle else self.write_rows, batches()):
+                    if to_bundle:
+                        for name, files in result:
+                            bundle.add_case(name, files)
+                    n = len(result) if to_bundle else result
+                    written += n
+                    if written // 10000 != (written - n) // 10000:
+                        print(f'{written} scenarios written, {written / (time.time() - exec_time):.0f} scenarios/s')
+        finally:
+            if bundle is not None:
+                bundle.close()
+        print(f'{written} scenarios were written to {os.path.abspath(self.foldername)}.\n'
+              f'Time: {time.time() - exec_time}')
+        return written
+
+
+def read_chunks(filename, chunksize=10000, index_col=0):
+    """
+    Reads table, saved by save_chunks, chunk by chunk
+    @param filename: .parquet or csv file
+    @param chunksize: number of rows in chunk
+    @param index_col: index column of csv, None for csv saved without index
+    @return: generator of DataFrames
+    """
+    if os.path.splitext(filename)[1].lower() == '.parquet':
+        import pyarrow.parquet as pq
+
+        for batch in pq.ParquetFile(filename).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        # Exact floats, so files are the same as from generated tests
+        for chunk in pd.read_csv(filename, index_col=index_col, chunksize=chunksize, float_precision='round_trip'):
+            yield chunk
+
+
+def _near_vectors(chunk):
+    """
+    Normalized parameters of tests for drop_near_duplicates
+    @param chunk: DataFrame of tests
+    @return: array (n, 10): first and second target by NEAR_SCALES, speed, safe divergence distance;
+    angles are shares of 360 degrees
+    """
+    def normalized(kind, column):
+        values = chunk[column].to_numpy(dtype=float)
+        if kind in ('course', 'peleng'):
+            values = values % 360
+        return values / NEAR_SCALES[kind]
+
+    columns = [normalized(kind, kind + str(i)) for i in (1, 2) for kind in NEAR_SCALES]
+    return np.stack(columns + [normalized('speed', 'speed'), chunk['safe_diverg'].to_numpy(dtype=float)], axis=1)
+
+
+def _near_pairs(queries, table, tolerance):
+    """
+    Finds near pairs of tests: the same safe divergence distance, every parameter differs by less
+    than tolerance, targets are unordered. Table is hashed to grid by course, bearing and speed
+    of the first target and speed. Cells are not less than twice tolerance, so a near test is in
+    the same cell or in the neighbour one on the side of the nearer cell edge: 16 cells are probed
+    for each order of targets of queries. Candidates are checked parameter by parameter.
+    @param queries: array of vectors from _near_vectors
+    @param table: array of vectors from _near_vectors
+    @param tolerance: share of parameter ranges
+    @return: arrays of indices of queries and table tests, which are near
+    """
+    # Angle cells divide the circle evenly, so they wrap around 360 degrees
+    n_angle = max(1, int(1 / (2 * tolerance)))
+    scales = np.array([n_angle, n_angle, 1 / (2 * tolerance), 1 / (2 * tolerance)])
+    offsets = np.stack(np.meshgrid(*[[0, 1]] * 4, indexing='ij'), axis=-1).reshape(-1, 4)
+    angles = (1, 2, 5, 6)
+
+    def keys(cells, sdd):
+        # Integer hash wraps around, collisions only add candidates, which are checked exactly
+        cells[:, :2] %= n_angle
+        key = sdd.astype(np.int64)
+        for k in range(cells.shape[1]):
+            key = key * 1000003 + cells[:, k]
+        return key
+
+    def cells(vectors):
+        scaled = vectors[:, [1, 2, 3, 8]] * scales
+        index = np.floor(scaled)
+        return index.astype(np.int64), np.where(scaled - index < .5, -1, 1)
+
+    table_keys = keys(cells(table)[0], table[:, 9])
+    order = np.argsort(table_keys, kind='stable')
+    sorted_keys = table_keys[order]
+    found_queries, found_table = [], []
+    for swapped in (False, True):
+        oriented = np.concatenate([queries[:, 4:8], queries[:, :4], queries[:, 8:]], axis=1) if swapped else queries
+        index, side = cells(oriented)
+        probes = (index[:, None, :] + offsets[None, :, :] * side[:, None, :]).reshape(-1, 4)
+        probe_keys = keys(probes, np.repeat(oriented[:, 9], len(offsets)))
+        low = np.searchsorted(sorted_keys, probe_keys, side='left')
+        counts = np.searchsorted(sorted_keys, probe_keys, side='right') - low
+        query_index = np.repeat(np.arange(len(probe_keys)) // len(offsets), counts)
+        table_index = order[np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())]
+        # Parameters of the second target are not hashed, they drop most candidates first
+        for column in (5, 6, 7, 4, 0, 9, 1, 2, 3, 8):
+            delta = np.abs(oriented[query_index, column] - table[table_index, column])
+            if column in angles:
+                delta = np.minimum(delta, 1 - delta)
+            near = delta == 0 if column == 9 else delta < tolerance
+            query_index, table_index = query_index[near], table_index[near]
+        found_queries.append(query_index)
+        found_table.append(table_index)
+    return np.concatenate(found_queries), np.concatenate(found_table)
+
+
+def drop_near_duplicates(chunks, tolerance):
+    """
+    Drops tests, which are near duplicates of already kept ones: tests with the same safe divergence
+    distance, which differ by less than tolerance share of range in every parameter. Parameters are
+    normalized by NEAR_SCALES, angles are compared modulo 360 degrees, targets are unordered.
+    So every dropped test is near a kept one, and kept tests differ from each other by at least
+    tolerance in some parameter. Tests are compared only with tests in neighbour cells of grid,
+    see _near_pairs.
+    @param chunks: iterable of DataFrames of tests
+    @param tolerance: share of parameter ranges
+    @return: generator of DataFrames of kept tests
+    """
+    if not tolerance > 0:
+        raise ValueError('tolerance must be positive, got {}'.format(tolerance))
+    kept = np.zeros((0, 10))
+    n_tests = n_dropped = 0
+    for chunk in chunks:
+        tests = _near_vectors(chunk)
+        mask = np.ones(len(chunk), dtype=bool)
+        mask[_near_pairs(tests, kept, tolerance)[0]] = False
+        # The first of near tests of chunk is kept
+        query, earlier = _near_pairs(tests, tests, tolerance)
+        later = earlier < query
+        query, earlier = query[later], earlier[later]
+        order = np.argsort(query, kind='stable')
+        query, earlier = query[order], earlier[order]
+        starts = np.flatnonzero(np.r_[True, query[1:] != query[:-1]]) if len(query) else []
+        for k, group in zip(query[starts], np.split(earlier, starts[1:])):
+            if mask[k] and mask[group].any():
+                mask[k] = False
+        kept = np.concatenate([kept, tests[mask]])
+        n_tests += len(chunk)
+        n_dropped += len(chunk) - mask.sum()
+        yield chunk[mask]
+    print(f'{n_dropped} of {n_tests} tests were dropped as near duplicates')
+
+
+def parse_bins(spec):
+    """
+    Parses bins of stratified generation given as FIELD=EDGES, where EDGES are
+    comma separated edges or START:STOP:STEP, STOP included
+    @return: (field, array of edges)
+    """
+    field, edges = spec.split('=', 1)
+    if field not in POINT_COLUMNS[1:]:
+        raise ValueError('Unknown field {}, expected one of {}'.format(field, ', '.join(POINT_COLUMNS[1:])))
+    if ':' in edges:
+        start, stop, step = (float(x) for x in edges.split(':'))
+        return field, np.arange(start, stop + step * .5, step)
+    return field, np.array([float(x) for x in edges.split(',')])
+
+
 def save_table(df, filename):
     print(f'Tests were saved to {os.path.abspath(filename)}.')
     df.to_csv(filename)
 
 
+def save_chunks(chunks, filename, index=True):
+    """
+    Appends chunks of table to file as they are created, so the whole table is never in memory.
+    Format is selected by extension: .parquet or csv otherwise. Csv index runs through all chunks.
+    @param chunks: iterable of DataFrames with the same columns
+    @param filename: file name
+    @param index: write index to csv
+    @return: number of rows
+    """
+    exec_time = time.time()
+    n_rows = 0
+    writer = None
+    try:
+        for i, chunk in enumerate(chunks):
+            chunk.index = range(n_rows, n_rows + len(chunk))
+            if os.path.splitext(filename)[1].lower() == '.parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                table = pa.Table.from_pandas(chunk, schema=writer.schema if writer else None, preserve_index=False)
+                writer = writer or pq.ParquetWriter(filename, table.schema)
+                writer.write_table(table)
+            else:
+                chunk.to_csv(filename, index=index, mode='w' if i == 0 else 'a', header=i == 0)
+            n_rows += len(chunk)
+            elapsed = time.time() - exec_time
+            print(f'Chunk {i + 1}: {len(chunk)} rows, {n_rows} total, {n_rows / elapsed:.0f} rows/s')
+    finally:
+        if writer is not None:
+            writer.close()
+    print(f'{n_rows} rows were saved to {os.path.abspath(filename)}.')
+    return n_rows
+
+
+def _unit_chunks(filename, chunksize=100000):
+    """
+    Reads points file, csv or .parquet, unit by unit
+    @return: generator of (unit, DataFrame)
+    """
+    rest = None
+    for chunk in read_chunks(filename, chunksize, index_col=None):
+        if rest is not None:
+            chunk = pd.concat([rest, chunk])
+        complete = chunk['unit'] != chunk['unit'].iloc[-1]
+        for unit, points in chunk[complete].groupby('unit', sort=False):
+            yield unit, points
+        rest = chunk[~complete]
+    if rest is not None and len(rest) != 0:
+        yield rest['unit'].iloc[0], rest
+
+
+def load_points(filenames):
+    """
+    Merges danger points of shards in unit order, reading them unit by unit
+    @param filenames: files, saved by save_chunks from Generator.iter_points
+    @return: generator of DataFrames with POINT_COLUMNS
+    """
+    for _, points in heapq.merge(*[_unit_chunks(filename) for filename in filenames], key=lambda item: item[0]):
+        yield points
+
+
 if __name__ == "__main__":
-    gen = Generator(12, 3.5, 1000, safe_div_dist=1, n_tests=200000, n_targets=1)
-    tests_df = gen.create_tests()
-    save_table(tests_df, 'tests.csv')
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Test scenario generator")
+    parser.add_argument("--max_dist", type=float, default=12, help="Maximal distance to target")
+    parser.add_argument("--min_dist", type=float, default=3.5, help="Minimal distance to target")
+    parser.add_argument("--n_rand", type=int, default=1000, help="Number of random velocities per point")
+    parser.add_argument("--n_tests", type=int, default=200000, help="Number of danger points per distance")
+    parser.add_argument("--safe_div_dist", type=float, default=1, help="Safe divergence distance")
+    parser.add_argument("--n_targets", type=int, default=1, choices=[1, 2], help="Number of targets")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed of random streams, printed by every run, to regenerate the same tests")
+    parser.add_argument("--shard", type=int, default=None,
+                        help="Index of shard: only danger points of this shard are created and saved")
+    parser.add_argument("--n_shards", type=int, default=1, help="Number of shards")
+    parser.add_argument("--merge", type=str, nargs='+', default=None,
+                        help="Point files of all shards, tests are created from them")
+    parser.add_argument("--bins", type=str, action="append",
+                        help="Stratified generation: bins of danger point field FIELD=EDGES, edges are comma separated "
+                             "or START:STOP:STEP, e.g. course=-180:180:30; may be repeated")
+    parser.add_argument("--quota", type=int, default=None,
+                        help="Stratified generation: number of danger points per bin and distance")
+    parser.add_argument("--dedup", type=float, default=None,
+                        help="Drop near duplicate tests: tolerance, share of ranges of test parameters, e.g. 0.01")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Output file, .csv or .parquet, tests.csv or points_<shard>.csv for shard by default")
+    parser.add_argument("--scenario_dir", type=str, default=None,
+                        help="Write scenario directories of tests to this folder, or to case bundle *.bundle")
+    parser.add_argument("--tests_file", type=str, default=None,
+                        help="Write scenario directories of existing tests table instead of generating tests")
+    parser.add_argument("--processes", type=int, default=None, help="Number of processes to write scenarios")
+    args = parser.parse_args()
+
+    gen = Generator(args.max_dist, args.min_dist, args.n_rand, safe_div_dist=args.safe_div_dist,
+                    n_tests=args.n_tests, n_targets=args.n_targets, seed=args.seed)
+    if args.bins:
+        if args.quota is None:
+            parser.error('--quota is required for --bins')
+        gen.bins, gen.quota = dict(parse_bins(spec) for spec in args.bins), args.quota
+    if args.shard is not None:
+        if args.seed is None:
+            parser.error('--seed is required for shards, all of them must use the same seed')
+        save_chunks(gen.iter_points(args.shard, args.n_shards), args.output or f'points_{args.shard}.csv',
+                    index=False)
+    else:
+        tests_file = args.tests_file
+        if tests_file is None:
+            tests_file = args.output or 'tests.csv'
+            points = load_points(args.merge) if args.merge else gen.iter_points()
+            tests = gen.iter_tests(points)
+            if args.dedup is not None:
+                tests = drop_near_duplicates(tests, args.dedup)
+            save_chunks(tests, tests_file)
+        if args.scenario_dir is not None:
+            tests = read_chunks(tests_file)
+            if args.dedup is not None and args.tests_file is not None:
+                tests = drop_near_duplicates(tests, args.dedup)
+            ScenarioWriter(args.scenario_dir).write(tests, args.processes)
@@ -10,6 +10,7 @@ from PyQt5.QtGui import *
 from PyQt5.QtWidgets import QApplication, QVBoxLayout, QPushButton, QDoubleSpinBox, \
     QLabel, QFileDialog, QAbstractItemView, QTreeView, QListView, QDialog, QCheckBox
 
+from cpa import cpa_params, min_dist_points
 from konverter import coords_global
 
 DEBUG = False
@@ -97,16 +98,6 @@ class Vector2(object):
         return self
 
 
-def det(a, b):
-    """
-    Pseudoscalar multiply of vectors
-    :param a: 2D vector
-    :param b: 2D vector
-    :return: pseudoscalar multiply
-    """
-    return a.x * b.y - b.x * a.y
-
-
 class CreateShipDialog(QDialog):
     """
     Creating new ship dialog
@@ -777,34 +768,31 @@ class DrawingApp(QDialog):
                     vel * math.sin(math.radians(heading)))
         R = Vector2(-(end.y() - our_pose.y()) / self.scale,
                     (end.x() - our_pose.x()) / self.scale)
-        try:
-            pen = QPen(Qt.black, 2, Qt.SolidLine)
+        pen = QPen(Qt.black, 2, Qt.SolidLine)
+        painter.setPen(pen)
+        # Zero relative speed gives zero tCPA
+        cpa, tcpa = self.calc_cpa_params(v, self.v0, R)
+        (our_x, our_y), (target_x, target_y) = min_dist_points(R.x, R.y, v.x, v.y, self.v0.x, self.v0.y)
+        mpd_point = QPoint()
+        mpd_point_o = QPoint()
+        # Target min dist point
+        mpd_point.setX(our_pose.x() + float(target_y) * self.scale)
+        mpd_point.setY(our_pose.y() - float(target_x) * self.scale)
+        # Our min dist point
+        mpd_point_o.setX(our_pose.x() + float(our_y) * self.scale)
+        mpd_point_o.setY(our_pose.y() - float(our_x) * self.scale)
+        painter.drawText(mid_x, mid_y, str(round(dist / self.scale, 2)))
+        if tcpa > 0:
+            painter.drawText(mid_x, mid_y + 20, 'CPA: ' + str(round(cpa, 2)))
+            painter.drawText(mid_x, mid_y + 40, 'tCPA: ' + str(round(tcpa, 2)))
+            pen = QPen(Qt.blue, 2, Qt.SolidLine)
             painter.setPen(pen)
-            cpa, tcpa = self.calc_cpa_params(v, self.v0, R)
-            min_pose = v * tcpa
-            min_pose_o = self.v0 * tcpa
-            mpd_point = QPoint()
-            mpd_point_o = QPoint()
-            # Our min dist point
-            mpd_point.setX(end.x() + min_pose.y * self.scale)
-            mpd_point.setY(end.y() - min_pose.x * self.scale)
-            # Target min dist point
-            mpd_point_o.setX(our_pose.x() + min_pose_o.y * self.scale)
-            mpd_point_o.setY(our_pose.y() - min_pose_o.x * self.scale)
-            painter.drawText(mid_x, mid_y, str(round(dist / self.scale, 2)))
-            if tcpa > 0:
-                painter.drawText(mid_x, mid_y + 20, 'CPA: ' + str(round(cpa, 2)))
-                painter.drawText(mid_x, mid_y + 40, 'tCPA: ' + str(round(tcpa, 2)))
-                pen = QPen(Qt.blue, 2, Qt.SolidLine)
-                painter.setPen(pen)
-                painter.drawEllipse(mpd_point, 4, 4)
-                pen = QPen(Qt.red, 2, Qt.SolidLine)
-                painter.setPen(pen)
-                painter.drawEllipse(mpd_point_o, 4, 4)
-            else:
-                painter.drawText(mid_x, mid_y + 40, 'tCPA: ' + '0')
-        except ZeroDivisionError:
-            painter.drawText(mid_x, mid_y, str(round(dist / self.scale, 2)))
+            painter.drawEllipse(mpd_point, 4, 4)
+            pen = QPen(Qt.red, 2, Qt.SolidLine)
+            painter.setPen(pen)
+            painter.drawEllipse(mpd_point_o, 4, 4)
+        else:
+            painter.drawText(mid_x, mid_y + 40, 'tCPA: ' + '0')
 
     @staticmethod
     def calc_cpa_params(v, v0, R):
@@ -815,10 +803,7 @@ class DrawingApp(QDialog):
         :param R: relative position, vector
         :return:
         """
-        w = v - v0
-        cpa = abs(det(R, w) / abs(w))
-        tcpa = - (R * w) / (w * w)
-        return cpa, tcpa
+        return cpa_params(v, v0, R)
 
 
 if __name__ == "__main__":
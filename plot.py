@@ -10,33 +10,45 @@ import numpy as np
 from matplotlib import pyplot as plt, gridspec, colors as mcolors
 from matplotlib.patches import Ellipse, Polygon
 
+from case_bundle import exists, read_file
 from konverter import Frame
 
 Position = namedtuple('Position', ['x', 'y', 'course', 'vel'])
 
 
 def load_json(filename):
-    if not os.path.isfile(filename):
+    # Case directory or case in bundle
+    data = read_file(filename)
+    if data is None:
         return None
+    return json.loads(data)
 
-    with open(filename) as f:
-        file_data = json.loads(f.read())
-    return file_data
 
+# Files written by solver, the rest of case files are its inputs
+OUTPUT_FILES = ('maneuvers', 'targets_maneuvers', 'analyse')
 
-def load_case_from_directory(dir_path):
-    if os.path.exists(os.path.join(dir_path, Case.CASE_FILENAMES['nav_data'])):
+
+def load_case_from_directory(dir_path, with_maneuvers=True, results_dir=None):
+    """
+    Loads case from case directory or case in bundle
+    :param dir_path: case directory
+    :param with_maneuvers: load maneuvers of solver
+    :param results_dir: directory with solver output files, if they are kept apart from the case
+    :return: Case
+    """
+    if exists(os.path.join(dir_path, Case.CASE_FILENAMES['nav_data'])):
         case_filenames = Case.CASE_FILENAMES
     else:
         case_filenames = Case.CASE_FILENAMES_KT
 
     def load_file(dataname):
-        return load_json(os.path.join(dir_path, case_filenames[dataname]))
+        directory = results_dir if results_dir is not None and dataname in OUTPUT_FILES else dir_path
+        return load_json(os.path.join(directory, case_filenames[dataname]))
 
     return Case(nav_data=load_file('nav_data'),
-                maneuvers=load_file('maneuvers'),
+                maneuvers=load_file('maneuvers') if with_maneuvers else None,
                 targets_data=load_file('targets_data'),
-                targets_maneuvers=load_file('targets_maneuvers'),
+                targets_maneuvers=load_file('targets_maneuvers') if with_maneuvers else None,
                 targets_real=load_file('targets_real'),
                 analyse=load_file('analyse'),
                 constraints=load_file('constraints'),
@@ -173,7 +185,7 @@ def plot_case_positions(ax, case, t, maneuver_index=0, all_maneuvers=True, real_
                 else:
                     colors.append(danger_levels[0])
         else:
-            colors += ['blue'] * len(case.targets_maneuvers)
+            colors += ['blue'] * len(case.targets_data)
 
     else:
         names += [str(i) for i, path in enumerate(case.targets_maneuvers)]
@@ -564,8 +576,8 @@ def plot_time_speed(ax, path):
         ax.grid()
 
 
-def plot_from_files(maneuvers_file):
-    if os.path.isfile(maneuvers_file):
+def plot_from_files(maneuvers_file, results_dir=None):
+    if exists(maneuvers_file):
         fig = plt.figure(figsize=(10, 7.5))
         gs1 = gridspec.GridSpec(5, 1)
         ax = fig.add_subplot(gs1[0:4, :])
@@ -574,7 +586,7 @@ def plot_from_files(maneuvers_file):
         ax_vel.clear()
         ax.set_facecolor((159 / 255, 212 / 255, 251 / 255))
 
-        case = load_case_from_directory(os.path.dirname(maneuvers_file))
+        case = load_case_from_directory(os.path.dirname(maneuvers_file), results_dir=results_dir)
 
         if case.route is not None:
             plot_path(case.route, ax, color='#fffffffa')
@@ -625,6 +637,65 @@ def plot_from_files(maneuvers_file):
         raise FileNotFoundError("{} not found".format(maneuvers_file))
 
 
+def plot_variants(dir_path, maneuvers):
+    """
+    Plots maneuvers of several solver variants for one case on one picture
+    :param dir_path: case directory, inputs are loaded from it once
+    :param maneuvers: dict, variant name -> loaded maneuvers file of variant, None if solver failed
+    :return: figure
+    """
+    fig = plt.figure(figsize=(10, 7.5))
+    gs1 = gridspec.GridSpec(5, 1)
+    ax = fig.add_subplot(gs1[0:4, :])
+    ax_vel = fig.add_subplot(gs1[4, :])
+    ax.set_facecolor((159 / 255, 212 / 255, 251 / 255))
+
+    case = load_case_from_directory(dir_path, with_maneuvers=False)
+    if case.nav_data is None:
+        raise FileNotFoundError("{} is not a case".format(dir_path))
+
+    if case.route is not None:
+        plot_path(case.route, ax, color='#fffffffa')
+        plot_speed(ax_vel, case.route, color='black')
+    if case.constraints is not None:
+        plot_case_limits(ax, case)
+    radius = 1.5
+    if case.settings is not None:
+        radius = case.settings['maneuver_calculation']['safe_diverg_dist'] * .5
+    plot_case_paths(ax, case)
+    ax.axis('equal')
+
+    palette = ['brown', 'magenta', 'darkGreen', 'orange', 'purple', 'black']
+    xlim, ylim = None, None
+    for i, (name, data) in enumerate(maneuvers.items()):
+        if not data:
+            continue
+        color = palette[i % len(palette)]
+        path = prepare_path(data[0]['path'], frame=case.frame)
+        ax.plot([], [], color=color, label=name)
+        plot_path(path, ax, color)
+        plot_speed(ax_vel, path, color=color)
+        v_xlim, v_ylim = recalc_lims(path)
+        if xlim is None:
+            xlim, ylim = v_xlim, v_ylim
+        else:
+            xlim = (min(xlim[0], v_xlim[0]), max(xlim[1], v_xlim[1]))
+            ylim = (min(ylim[0], v_ylim[0]), max(ylim[1], v_ylim[1]))
+
+    ax.set_title(os.path.basename(os.path.normpath(dir_path)))
+    ax.grid()
+    try:
+        plot_case_positions(ax, case, case.start_time, radius=radius)
+    except KeyError:
+        raise Exception("KeyError", case.path)
+    ax.legend()
+    if xlim is not None:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            ax.set_xlim(xlim), ax.set_ylim(ylim)
+    return fig
+
+
 def find_max_time(data):
     """
     Finds minimal time
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
+import fnmatch
 import glob
 import json
 import os
 
 from geographiclib.geodesic import Geodesic
 
+from case_bundle import CaseBundle, is_bundle
+from case_index import find_cases
 from konverter import Frame
 
 
@@ -53,14 +56,19 @@ def fix_feature(feature, frame):
         return fix_linestring(feature, frame)
 
 
-def check_constraints_file(file, frame):
-    with open(file) as f:
-        data = json.loads(f.read())
-
+def fix_constraints(data, frame):
     any_changed = False
     for i in range(len(data['features'])):
         data['features'][i], changed = fix_feature(data['features'][i], frame)
         any_changed = any_changed or changed
+    return any_changed
+
+
+def check_constraints_file(file, frame):
+    with open(file) as f:
+        data = json.loads(f.read())
+
+    any_changed = fix_constraints(data, frame)
 
     with open(file, 'w') as f:
         json.dump(data, f)
@@ -91,17 +99,43 @@ def run_directory(datadir):
     return any_changed
 
 
+def run_bundle_case(bundle, case):
+    """
+    Fixes constraints of case in bundle, only changed documents are written back
+    @param bundle: CaseBundle, opened for writing
+    @param case: case name
+    """
+    nav_data = bundle.read(case, 'nav-data.json') or bundle.read(case, 'navigation.json')
+    if nav_data is None:
+        return False
+    nav_data = json.loads(nav_data)
+    frame = Frame(nav_data['lat'], nav_data['lon'])
+
+    any_changed = False
+    for name in fnmatch.filter(bundle.names(case), 'constraints*.json'):
+        data = json.loads(bundle.read(case, name))
+        if fix_constraints(data, frame):
+            bundle.add_case(case, {name: json.dumps(data)})
+            print('{} fixed'.format(os.path.join(bundle.filename, case, name)))
+            any_changed = True
+    return any_changed
+
+
 def fix_from_root(data_directory):
-    for root, dirs, files in os.walk(data_directory):
-        if "nav-data.json" in files or 'navigation.json' in files:
-            run_directory(os.path.join(data_directory, root))
+    if is_bundle(data_directory):
+        with CaseBundle(data_directory, 'a') as bundle:
+            for case in bundle.cases():
+                run_bundle_case(bundle, case)
+        return
+    for datadir in find_cases(data_directory):
+        run_directory(datadir)
 
 
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="BKS report generator")
-    parser.add_argument("root_dir", type=str, nargs='?', help="Path cases root", default=os.getcwd())
+    parser.add_argument("root_dir", type=str, nargs='?', help="Path cases root or case bundle", default=os.getcwd())
     args = parser.parse_args()
 
     cur_dir = os.path.abspath(args.root_dir)
@@ -0,0 +1,111 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+import numpy as np
+
+
+class ProgressMetrics:
+    """
+    Progress and throughput of report run, periodically written to file.
+    Format is selected by extension: Prometheus text format for .prom, JSON otherwise.
+    File is also rewritten while no case finishes, so stalls are visible by growing
+    seconds_since_last_case.
+    """
+
+    def __init__(self, filename, total, workers=None, phase='run', interval=5.):
+        """
+        @param filename: metrics file
+        @param total: number of cases in this phase
+        @param workers: number of solver processes, used for utilization
+        @param phase: name of run phase, e.g. 'run' or 'retry'
+        @param interval: seconds between writes
+        """
+        self.filename = filename
+        self.total = total
+        self.workers = workers
+        self.phase = phase
+        self.interval = interval
+        self.codes = Counter()
+        self.exec_times = []
+        self.busy_time = 0.
+        self.render_queue = 0
+        self.t_start = self.t_last = time.time()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def update(self, case):
+        """
+        Accounts finished case
+        @param case: case dict or None, if case was skipped
+        """
+        with self.lock:
+            self.t_last = time.time()
+            if case is None:
+                self.codes['skipped'] += 1
+                return
+            self.codes[str(case["code"])] += 1
+            self.exec_times.append(case["exec_time"])
+            runs = list((case.get("variants") or {}).values()) or [case]
+            self.busy_time += sum(sum(run.get("exec_times") or [run["exec_time"]]) for run in runs)
+
+    def set_render_queue(self, depth):
+        with self.lock:
+            self.render_queue = depth
+
+    def metrics(self):
+        with self.lock:
+            now = time.time()
+            elapsed = now - self.t_start
+            done = sum(self.codes.values())
+            rate = done / elapsed if elapsed > 0 else 0.
+            p50, p95 = np.percentile(self.exec_times, [50, 95]) if self.exec_times else (None, None)
+            return {'phase': self.phase,
+                    'cases_total': self.total,
+                    'cases_done': done,
+                    'cases_remaining': self.total - done,
+                    'cases_per_second': rate,
+                    'eta_seconds': (self.total - done) / rate if rate > 0 else None,
+                    'elapsed_seconds': elapsed,
+                    'seconds_since_last_case': now - self.t_last,
+                    'return_codes': dict(self.codes),
+                    'exec_time_p50': p50,
+                    'exec_time_p95': p95,
+                    'worker_utilization': (self.busy_time / (elapsed * self.workers)
+                                           if self.workers and elapsed > 0 else None),
+                    'render_queue': self.render_queue}
+
+    def write(self):
+        metrics = self.metrics()
+        if os.path.splitext(self.filename)[1] == '.prom':
+            text = _prometheus(metrics)
+        else:
+            text = json.dumps(metrics, indent=2)
+        tmp = self.filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, self.filename)
+
+    def close(self):
+        self.stopped.set()
+        self.thread.join()
+        self.write()
+
+
+def _prometheus(metrics):
+    lines = []
+    for key, value in metrics.items():
+        if key == 'return_codes':
+            lines += ['bks_report_cases{{phase="{}",code="{}"}} {}'.format(metrics['phase'], code, count)
+                      for code, count in value.items()]
+        elif isinstance(value, (int, float)):
+            lines.append('bks_report_{}{{phase="{}"}} {}'.format(key, metrics['phase'], value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,100 @@
+import os
+
+import pandas as pd
+
+# Case fields, which are not written to report tables
+HEAVY_FIELDS = ['proc', 'image_data', 'nav_report', 'command', 'variants']
+
+# Prefixes of metrics columns, parsed from solver output
+TIME_PREFIX, COUNT_PREFIX, WARNING_PREFIX = 'time_', 'n_', 'warn_'
+
+FLOAT_COLUMNS = ['exec_time', 'exec_time_min', 'exec_time_iqr', 'timeout',
+                 'dist1', 'dist2', 'course1', 'course2', 'peleng1', 'peleng2',
+                 'cpu_user', 'cpu_sys', 'max_rss_kb', 'io_read_blocks', 'io_write_blocks']
+
+
+def report_frame(cases):
+    """
+    Builds typed report table from cases
+    @param cases: list of case dicts from ReportGenerator
+    @return: DataFrame, one row per case
+    """
+    rows = [_flatten(case) for case in cases if case is not None]
+    df = pd.DataFrame(rows)
+    if len(df) == 0:
+        return df
+    df['datadir'] = df['datadir'].astype(str)
+    df['code'] = df['code'].astype('int32')
+    for column in df.columns:
+        field = column.rsplit('.', 1)[-1]
+        if field in FLOAT_COLUMNS:
+            df[column] = df[column].astype('float64')
+        elif field == 'code' and column != 'code':
+            df[column] = df[column].astype('int32')
+        elif field == 'right':
+            df[column] = df[column].astype('boolean')
+        elif field.startswith(TIME_PREFIX):
+            df[column] = df[column].astype('float64')
+        elif field.startswith(COUNT_PREFIX):
+            df[column] = df[column].astype('Int64')
+        elif field.startswith(WARNING_PREFIX):
+            df[column] = df[column].fillna(0).astype('int32')
+    if 'retried' in df.columns:
+        df['retried'] = df['retried'].fillna(False).astype(bool)
+    for column in df.columns:
+        if column.rsplit('.', 1)[-1] in ('type1', 'type2'):
+            values = pd.to_numeric(df[column], errors='coerce')
+            if values.notna().sum() == df[column].notna().sum():
+                df[column] = values
+            else:
+                df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
+
+
+def _flatten(case):
+    """
+    Makes report row from case, results of solver variants become columns named <variant>.<field>
+    """
+    row = {key: value for key, value in case.items() if key not in HEAVY_FIELDS}
+    for name, variant in (case.get('variants') or {}).items():
+        for key, value in variant.items():
+            if key not in HEAVY_FIELDS and key != 'path':
+                row['{}.{}'.format(name, key)] = value
+    return row
+
+
+def save_report(df, filename):
+    """
+    Saves report table, format is selected by extension:
+    .parquet, .feather, .xlsx or anything else for csv
+    @param df: report DataFrame
+    @param filename: file name
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.parquet':
+        df.to_parquet(filename, index=False)
+    elif ext == '.feather':
+        df.reset_index(drop=True).to_feather(filename)
+    elif ext == '.xlsx':
+        df.to_excel(filename)
+    else:
+        df.to_csv(filename)
+
+
+def read_report(filename, columns=None):
+    """
+    Reads report table saved by save_report
+    @param filename: file name
+    @param columns: columns to read, columnar formats read only them
+    @return: DataFrame
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.parquet':
+        return pd.read_parquet(filename, columns=columns)
+    if ext == '.feather':
+        return pd.read_feather(filename, columns=columns)
+    if ext == '.xlsx':
+        df = pd.read_excel(filename, engine='openpyxl')
+    else:
+        df = pd.read_csv(filename, index_col=False)
+    return df if columns is None else df[columns]
@@ -0,0 +1,98 @@
+import re
+
+# Scale of time units to milliseconds, time without unit is in milliseconds
+TIME_UNITS = {'us': 1e-3, 'usec': 1e-3, 'usecs': 1e-3, 'microsecond': 1e-3, 'microseconds': 1e-3,
+              'ms': 1., 'msec': 1., 'msecs': 1., 'millisecond': 1., 'milliseconds': 1.,
+              's': 1e3, 'sec': 1e3, 'secs': 1e3, 'second': 1e3, 'seconds': 1e3}
+
+TIMING_RE = re.compile(r'^\s*([A-Za-z][\w -]*?)\s+time\s*[:=]\s*([-+\d.eE]+)\s*([A-Za-z]+)?')
+COUNT_RE = re.compile(r'^\s*((?:[A-Za-z][\w -]*?\s)?(?:iterations|count|steps))\s*[:=]\s*(\d+)\s*$')
+WARNING_RE = re.compile(r'^\s*WARNING\s*:?\s*([A-Za-z][\w-]*)')
+
+
+def column_name(prefix, name):
+    return prefix + re.sub(r'\W+', '_', name.strip().lower())
+
+
+def parse_timing(line):
+    """
+    'planning time: 3.5 ms' -> {'time_planning_ms': 3.5}, lines with unknown time unit are skipped
+    """
+    match = TIMING_RE.match(line)
+    if match is None:
+        return None
+    name, value, unit = match.groups()
+    scale = TIME_UNITS.get((unit or 'ms').lower())
+    if scale is None:
+        return None
+    try:
+        return {column_name('time_', name) + '_ms': float(value) * scale}
+    except ValueError:
+        return None
+
+
+def parse_count(line):
+    """
+    'iterations: 12' -> {'n_iterations': 12}
+    """
+    match = COUNT_RE.match(line)
+    if match is None:
+        return None
+    return {column_name('n_', match.group(1)): int(match.group(2))}
+
+
+def parse_warning(line):
+    """
+    'WARNING route: too short' -> {'warn_route': 1}
+    """
+    match = WARNING_RE.match(line)
+    if match is None:
+        return None
+    return {column_name('warn_', match.group(1)): 1}
+
+
+DEFAULT_PARSERS = [parse_timing, parse_count, parse_warning]
+
+
+def parse_lines(lines, parsers=DEFAULT_PARSERS):
+    """
+    Extracts metrics from solver output. Every parser is called for every line
+    and returns dict with metrics or None. Values of repeated metrics are summed.
+    @param lines: iterable of output lines
+    @param parsers: list of line parsers
+    @return: dict, column name -> value
+    """
+    metrics = {}
+    for line in lines:
+        for parser in parsers:
+            found = parser(line)
+            if found:
+                for key, value in found.items():
+                    metrics[key] = metrics.get(key, 0) + value
+    return metrics
+
+
+def parse_output(output, parsers=DEFAULT_PARSERS):
+    """
+    Extracts metrics from captured solver output
+    @param output: bytes or str
+    @return: dict, column name -> value
+    """
+    if output is None:
+        return {}
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', errors='replace')
+    return parse_lines(output.splitlines(), parsers)
+
+
+def parse_log(filename, parsers=DEFAULT_PARSERS):
+    """
+    Extracts metrics from solver log file, reading it line by line
+    @param filename: log file name
+    @return: dict, column name -> value
+    """
+    try:
+        with open(filename, encoding='utf-8', errors='replace') as f:
+            return parse_lines(f, parsers)
+    except FileNotFoundError:
+        return {}
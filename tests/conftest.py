@@ -0,0 +1,77 @@
+import importlib.util
+import json
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Input files of minimal valid case, CASE_FILENAMES flavour
+CASE_FILES = {
+    'nav-data.json': {"cat": 0, "lat": 56.6857, "lon": 19.632, "SOG": 10, "STW": 10, "COG": 0, "heading": 0,
+                      "timestamp": 1594730134},
+    'target-data.json': [{"id": "target0", "lat": 56.7357, "lon": 19.632, "SOG": 10, "COG": 180, "heading": 180,
+                          "timestamp": 1594730134}],
+    'route-data.json': {"items": [{"begin_angle": 0, "curve": 0, "duration": 3600, "lat": 56.6857, "lon": 19.632,
+                                   "length": 10, "port_dev": 1.5, "starboard_dev": 1.5}],
+                        "start_time": 1594730134},
+    'constraints.json': {"type": "FeatureCollection", "features": []},
+    'settings.json': {"maneuver_calculation": {"safe_diverg_dist": 1}},
+    'target-settings.json': {},
+    'hmi-data.json': {},
+}
+
+# Fake solver: writes maneuver and report, prints output like the real one
+SOLVER = """#!{python}
+import json, sys
+args = dict(zip(sys.argv[1::2], sys.argv[2::2]))
+nav = json.load(open(args['--nav-data']))
+print('Solver started\\nflags: ' + ' '.join(sys.argv[1:]))
+json.dump([{{"path": {{"items": [{{"begin_angle": 0, "curve": 0, "duration": 600, "lat": nav['lat'],
+                                 "lon": nav['lon'], "length": 1}}], "start_time": nav['timestamp']}}}}],
+          open(args['--maneuver'], 'w'))
+json.dump({{"target_statuses": [{{"id": "target0", "scenario_type": 3, "danger_level": 2}}]}},
+          open(args['--analyse'], 'w'))
+"""
+
+
+def write_case(root, name, files=None):
+    """
+    Writes case directory
+    @param root: cases root
+    @param name: case name
+    @param files: dict, file name -> JSON data, default is CASE_FILES
+    @return: case directory
+    """
+    datadir = os.path.join(str(root), name)
+    os.makedirs(datadir, exist_ok=True)
+    for filename, data in (CASE_FILES if files is None else files).items():
+        with open(os.path.join(datadir, filename), 'w') as f:
+            json.dump(data, f)
+    return datadir
+
+
+def write_solver(directory):
+    """
+    Writes fake solver executable
+    @return: path of solver
+    """
+    path = os.path.join(str(directory), 'solver.py')
+    with open(path, 'w') as f:
+        f.write(SOLVER.format(python=sys.executable))
+    os.chmod(path, 0o755)
+    return path
+
+
+def load_script(name):
+    """
+    Imports script, which name is not a valid module name, like bks-report.py
+    """
+    module_name = name.replace('-', '_')
+    if module_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(module_name, os.path.join(ROOT, name + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        # Registered before execution, so pool workers can unpickle its classes
+        sys.modules[module_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[module_name]
@@ -0,0 +1,170 @@
+import argparse
+import os
+import subprocess
+
+import pandas as pd
+import pytest
+
+import plot
+from case_bundle import pack
+from conftest import load_script, write_case, write_solver
+
+bks_report = load_script('bks-report')
+
+
+def test_variants_of_bundle_case(tmp_path):
+    write_case(tmp_path / 'cases', 'sc_1')
+    bundle = str(tmp_path / 'cases.bundle')
+    pack(str(tmp_path / 'cases'), bundle)
+    report = bks_report.ReportGenerator(write_solver(tmp_path))
+    report.nopic = True
+    report.variants = [('base', report.exe, []), ('rvo', report.exe, ['--rvo-enable'])]
+
+    case = report.run_case(os.path.join(bundle, 'sc_1'))
+
+    assert case['datadir'] == 'sc_1'
+    assert 2.9 < case['dist1'] < 3.1
+    assert [variant['code'] for variant in case['variants'].values()] == [0, 0]
+    assert '--rvo-enable' in bks_report.solver_stdout(case['variants']['rvo'])
+    assert case['type1'] == 3
+    # Bundle is not written, results are kept next to it
+    assert os.path.isfile(str(tmp_path / 'cases_results' / report.run_id / 'sc_1' / 'rvo' / 'maneuver.json'))
+
+
+def test_results_and_logs_of_cases_with_the_same_name(tmp_path):
+    cases = [write_case(tmp_path / 'cases' / parent, 'sc_1') for parent in ('a', 'b')]
+    runs = []
+    for _ in range(2):
+        report = bks_report.ReportGenerator(write_solver(tmp_path))
+        report.nopic = True
+        report.scratch = str(tmp_path)
+        report.results_dir = str(tmp_path / 'results')
+        report.log_dir = str(tmp_path / 'logs')
+        report.root = str(tmp_path / 'cases')
+        report.run_id = 'run{}'.format(len(runs))
+        runs.append([report.run_case(datadir) for datadir in cases])
+
+    paths = [case['path'] for run in runs for case in run]
+    logs = [case['log_file'] for run in runs for case in run]
+    assert len(set(paths)) == len(set(logs)) == 4
+    assert paths[0] == str(tmp_path / 'results' / 'run0' / 'a' / 'sc_1')
+    assert logs[3] == str(tmp_path / 'logs' / 'run1' / 'b' / 'sc_1.log')
+    assert all(os.path.isfile(os.path.join(path, 'maneuver.json')) for path in paths)
+    assert all(os.path.isfile(log) for log in logs)
+
+
+def test_diff_reports():
+    baseline = pd.DataFrame({'datadir': ['/old/sc_1', '/old/sc_2', '/old/sc_3'], 'code': [0, 0, 1],
+                             'type1': [3, 3, 2], 'exec_time': [1., 1., 1.]})
+    current = pd.DataFrame({'datadir': ['sc_1', 'sc_2', 'sc_4'], 'code': [0, 2, 0],
+                            'type1': [3, 3, 2], 'exec_time': [2., 1., 1.]})
+
+    diff = bks_report.diff_reports(baseline, current)
+
+    assert dict(zip(diff['datadir'], diff['changes'])) == {'sc_1': 'exec_time', 'sc_2': 'code',
+                                                           'sc_3': 'removed', 'sc_4': 'new'}
+
+
+def test_diff_reports_without_exec_time():
+    # Old metainfo.csv may have no exec times
+    baseline = pd.DataFrame({'datadir': ['sc_1', 'sc_2'], 'code': [0, 0]})
+    current = pd.DataFrame({'datadir': ['sc_1', 'sc_2'], 'code': [0, 2], 'exec_time': [5., 1.]})
+
+    for a, b in ((baseline, current), (current, baseline)):
+        diff = bks_report.diff_reports(a, b)
+        assert dict(zip(diff['datadir'], diff['changes'])) == {'sc_2': 'code'}
+
+
+def test_pin_without_affinity_support(monkeypatch, capsys):
+    # Windows has no sched_setaffinity
+    monkeypatch.delattr(os, 'sched_setaffinity', raising=False)
+    report = bks_report.ReportGenerator('solver', pin=True)
+    with report.pool(2) as p:
+        assert p.map(abs, [-1, -2]) == [1, 2]
+    assert 'not pinned' in capsys.readouterr().out
+
+
+def test_geometric_mean_ratio_skips_invalid_times():
+    ab = pd.DataFrame({'median_a': [1., 2., 0., float('nan'), 1.], 'median_b': [2., 4., 1., 1., 0.]})
+    ratio, n = bks_report.geometric_mean_ratio(ab)
+    assert n == 2
+    assert ratio == pytest.approx(2.)
+    assert bks_report.geometric_mean_ratio(ab.iloc[2:])[1] == 0
+
+
+def fake_case(name):
+    return {"datadir": name, "path": name, "code": 0, "exec_time": 1.,
+            "proc": subprocess.CompletedProcess(['solver'], 0, b'output'), "command": ['solver'],
+            "nav_report": "", "image_data": ""}
+
+
+def test_paged_html_renders_and_drops_images_page_by_page(tmp_path):
+    cases = [fake_case('sc_{}'.format(i)) for i in range(5)]
+    report = bks_report.Report(cases, 'solver', str(tmp_path), None)
+    rendered = []
+
+    def render(page_cases):
+        # Images of previous pages are already dropped
+        assert all(case["image_data"] == "" for case in cases)
+        rendered.append([case["datadir"] for case in page_cases])
+        for case in page_cases:
+            case["image_data"] = '<img alt="{}">'.format(case["datadir"])
+
+    report.save_html(str(tmp_path / 'report.html'), page_size=2, render=render)
+
+    assert rendered == [['sc_0', 'sc_1'], ['sc_2', 'sc_3'], ['sc_4']]
+    assert all(case["image_data"] == "" for case in cases)
+    with open(str(tmp_path / 'report_2.html'), encoding='utf-8') as f:
+        page = f.read()
+    assert '<img alt="sc_2">' in page and '<img alt="sc_3">' in page and 'sc_4' not in page
+    with open(str(tmp_path / 'report.html'), encoding='utf-8') as f:
+        assert 'report_3.html' in f.read()
+    with pytest.raises(ValueError):
+        report.save_html(str(tmp_path / 'report.html'), page_size=0)
+
+
+@pytest.mark.parametrize('options, mode', [
+    ({}, (False, False)),
+    ({'nopic': True}, (True, False)),
+    ({'baseline': 'base.parquet'}, (True, True)),
+    ({'page_size': 10}, (True, True)),
+    ({'baseline': 'base.parquet', 'nopic': True}, (True, False)),
+    # Variant maneuvers are not in the source case, they are plotted during the run
+    ({'variant': ['rvo=--rvo-enable'], 'baseline': 'base.parquet'}, (False, False)),
+    ({'variant': ['rvo=--rvo-enable'], 'page_size': 10}, (False, False)),
+    # Parquet report drops pictures, they are not rendered at all
+    ({'html_file': None}, (True, False)),
+    ({'html_file': None, 'baseline': 'base.parquet'}, (True, False)),
+    ({'html_file': None, 'excel_file': 'report.xlsx'}, (False, False)),
+    # Excel report keeps pictures of every case
+    ({'excel_file': 'report.xlsx', 'baseline': 'base.parquet'}, (False, False)),
+])
+def test_picture_mode(options, mode):
+    args = argparse.Namespace(**{'nopic': False, 'variant': None, 'baseline': None, 'page_size': None,
+                                 'html_file': 'report.html', 'excel_file': None, **options})
+    assert bks_report.picture_mode(args) == mode
+
+
+def test_results_store_keeps_only_outputs(tmp_path):
+    datadir = write_case(tmp_path / 'cases', 'sc_1')
+    report = bks_report.ReportGenerator(write_solver(tmp_path))
+    report.nopic = True
+    report.scratch = str(tmp_path)
+    report.results_dir = str(tmp_path / 'results')
+    report.root = str(tmp_path / 'cases')
+
+    case = report.run_case(datadir)
+
+    assert case['source_path'] == datadir
+    assert sorted(os.listdir(case['path'])) == ['maneuver.json', 'nav-report.json']
+    assert 'maneuver.json' not in os.listdir(datadir)
+    # Picture is drawn from inputs of source case and outputs of results store
+    loaded = plot.load_case_from_directory(datadir, results_dir=case['path'])
+    assert loaded.maneuvers is not None and loaded.route is not None
+    report.render_cases([case])
+    assert case['image_data'].startswith('<img')
+
+    report.variants = [('base', report.exe, []), ('rvo', report.exe, ['--rvo-enable'])]
+    case = report.run_case(datadir)
+    for variant in case['variants'].values():
+        assert sorted(os.listdir(variant['path'])) == ['maneuver.json', 'nav-report.json']
@@ -0,0 +1,63 @@
+import os
+
+from case_bundle import CaseBundle, bundle_cases, exists, list_case, pack, read_file, unpack
+from case_index import INDEX_FILENAME
+from conftest import write_case
+
+
+def read_tree(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(str(root)):
+        for name in filenames:
+            if name == INDEX_FILENAME:
+                continue
+            with open(os.path.join(dirpath, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(dirpath, name), str(root))] = f.read()
+    return files
+
+
+def test_pack_unpack_round_trip(tmp_path):
+    for name in ['sc_1', 'sc_2', 'sc_10']:
+        write_case(tmp_path / 'cases', name)
+    with open(str(tmp_path / 'cases' / 'sc_2' / 'binary.dat'), 'wb') as f:
+        f.write(bytes(range(256)))
+    bundle = str(tmp_path / 'cases.bundle')
+
+    assert pack(str(tmp_path / 'cases'), bundle) == 3
+    assert unpack(bundle, str(tmp_path / 'out')) == 3
+
+    assert read_tree(tmp_path / 'out') == read_tree(tmp_path / 'cases')
+
+
+def test_read_file_of_directory_and_bundle(tmp_path):
+    datadir = write_case(tmp_path / 'cases', 'sc_1')
+    bundle = str(tmp_path / 'cases.bundle')
+    pack(str(tmp_path / 'cases'), bundle)
+    in_bundle = os.path.join(bundle, 'sc_1')
+    with open(os.path.join(datadir, 'nav-data.json'), 'rb') as f:
+        nav_data = f.read()
+
+    for case in (datadir, in_bundle):
+        assert read_file(os.path.join(case, 'nav-data.json')) == nav_data
+        assert read_file(os.path.join(case, 'missing.json')) is None
+        assert exists(os.path.join(case, 'nav-data.json'))
+        assert not exists(os.path.join(case, 'missing.json'))
+        assert sorted(list_case(case)) == sorted(os.listdir(datadir))
+    assert read_file(os.path.join(bundle, 'sc_2', 'nav-data.json')) is None
+
+
+def test_cases_order_and_pattern(tmp_path):
+    bundle = str(tmp_path / 'cases.bundle')
+    names = ['sc_10', 'sc_2', 'other_1', 'sc_1']
+    with CaseBundle(bundle, 'w') as writer:
+        for name in names:
+            writer.add_case(name, {'nav-data.json': '{}'})
+        # Order isn't stored yet
+        assert writer.cases() == ['other_1', 'sc_1', 'sc_2', 'sc_10']
+    with CaseBundle(bundle) as reader:
+        assert reader.cases() == ['other_1', 'sc_1', 'sc_2', 'sc_10']
+        assert reader.cases('sc_*') == ['sc_1', 'sc_2', 'sc_10']
+    # Cases added later are ordered on close too
+    with CaseBundle(bundle, 'a') as writer:
+        writer.add_case('sc_3', {'nav-data.json': '{}'})
+    assert bundle_cases(bundle, 'sc_*') == [os.path.join(bundle, name) for name in ['sc_1', 'sc_2', 'sc_3', 'sc_10']]
@@ -0,0 +1,76 @@
+import os
+import pathlib
+from pathlib import Path
+
+from natsort import natsorted
+
+from case_index import CaseIndex, find_cases
+from conftest import write_case
+
+
+def old_find_cases(root, pattern):
+    # Discovery of ReportGenerator.generate before the index, without duplicates of nested matches
+    cases = set()
+    for path in Path(root).glob(pattern):
+        for dirpath, dirs, files in os.walk(path):
+            if "nav-data.json" in files or 'navigation.json' in files:
+                cases.add(os.path.join(root, dirpath))
+    return natsorted(cases)
+
+
+def make_tree(root):
+    write_case(root, 'sc_1')
+    write_case(root, 'sc_10')
+    write_case(root / 'group', 'sc_2')
+    write_case(root / 'group' / 'sub', 'sc_3')
+    write_case(root / 'other', 'x_1')
+    os.makedirs(str(root / 'empty'))
+
+
+def test_patterns_match_path_glob(tmp_path):
+    root = tmp_path / 'cases'
+    make_tree(root)
+    for pattern in ['*', 'sc_*', 'group', 'group/*', 'group/sub/*', '**', '*/sc_*', 'missing', 'sc_1?',
+                    '**/sc_*', 'group/**', '*/*', '**/sub', './sc_1*']:
+        assert find_cases(str(root), pattern) == old_find_cases(str(root), pattern), pattern
+
+
+def test_rescan_notices_changes_inside_known_cases(tmp_path):
+    root = tmp_path / 'cases'
+    make_tree(root)
+    assert len(find_cases(str(root))) == 5
+    index = CaseIndex(str(root))
+    # Only root may be listed again, it holds the index file
+    assert index.update() <= 1
+
+    # Removed marker file and new case nested in a known case
+    os.remove(str(root / 'group' / 'sc_2' / 'nav-data.json'))
+    write_case(root / 'group' / 'sub' / 'sc_3', 'nested')
+    assert index.update() >= 3
+    cases = index.cases()
+    index.close()
+    assert str(root / 'group' / 'sc_2') not in cases
+    assert str(root / 'group' / 'sub' / 'sc_3' / 'nested') in cases
+    assert find_cases(str(root)) == cases
+
+
+def test_cases_are_matched_without_file_system(tmp_path, monkeypatch):
+    root = tmp_path / 'cases'
+    make_tree(root)
+    for i in (2, 10, 1):
+        write_case(root / 'group', 'sc_{}'.format(i))
+    index = CaseIndex(str(root))
+    index.update()
+
+    def forbidden(*args, **kwargs):
+        raise AssertionError('file system is read')
+
+    monkeypatch.setattr(os, 'stat', forbidden)
+    monkeypatch.setattr(os, 'scandir', forbidden)
+    monkeypatch.setattr(pathlib.Path, 'glob', forbidden)
+    cases = index.cases('*')
+    group = index.cases('group/sc_*')
+    monkeypatch.undo()
+    index.close()
+    assert cases == old_find_cases(str(root), '*') == natsorted(cases)
+    assert group == [str(root / 'group' / name) for name in ('sc_1', 'sc_2', 'sc_10')]
@@ -0,0 +1,82 @@
+import math
+
+import numpy as np
+import pytest
+
+from cpa import cpa_params, cpa_tcpa, cpa_tcpa_xy, min_dist_points
+
+
+class Vector2:
+    """
+    Minimal copy of paintall.Vector2, paintall needs PyQt5
+    """
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __sub__(self, other):
+        return Vector2(self.x - other.x, self.y - other.y)
+
+    def __mul__(self, other):
+        return self.x * other.x + self.y * other.y
+
+    def __abs__(self):
+        return (self.x ** 2 + self.y ** 2) ** 0.5
+
+
+def old_calc_cpa_params(v, v0, R):
+    # DrawingApp.calc_cpa_params before the cpa module
+    w = v - v0
+    cpa = abs((R.x * w.y - w.x * R.y) / abs(w))
+    tcpa = - (R * w) / (w * w)
+    return cpa, tcpa
+
+
+def random_cases(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [tuple(rng.uniform(-10, 10, 6)) for _ in range(n)]
+
+
+def test_agrees_with_old_paintall():
+    for rx, ry, vx, vy, v0x, v0y in random_cases(1000):
+        expected = old_calc_cpa_params(Vector2(vx, vy), Vector2(v0x, v0y), Vector2(rx, ry))
+        assert cpa_params(Vector2(vx, vy), Vector2(v0x, v0y), Vector2(rx, ry)) == pytest.approx(expected, rel=1e-12)
+
+
+def test_scalar_and_array_inputs_agree():
+    cases = np.array(random_cases(100, seed=1))
+    cpa, tcpa = cpa_tcpa_xy(*cases.T)
+    assert cpa.shape == tcpa.shape == (100,)
+    for k, case in enumerate(cases.tolist()):
+        scalar_cpa, scalar_tcpa = cpa_tcpa_xy(*case)
+        assert np.ndim(scalar_cpa) == 0
+        assert float(scalar_cpa) == pytest.approx(cpa[k], rel=1e-12)
+        assert float(scalar_tcpa) == pytest.approx(tcpa[k], rel=1e-12)
+    result = cpa_params(Vector2(1., 2.), Vector2(3, 0), Vector2(5, -1))
+    assert all(type(value) is float for value in result)
+
+
+def test_zero_relative_speed():
+    # Target keeps distance: CPA is current distance, TCPA is zero
+    assert cpa_params(Vector2(3, 4), Vector2(3, 4), Vector2(6, 8)) == (10., 0.)
+    cpa, tcpa = cpa_tcpa_xy(np.array([3., 1.]), np.array([4., 0.]), np.array([1., 1.]), np.array([0., 0.]),
+                            np.array([1., 0.]), np.array([0., 0.]))
+    assert cpa.tolist() == pytest.approx([5., 0.])
+    assert tcpa.tolist() == pytest.approx([0., -1.])
+
+
+def test_polar_form():
+    # Head-on target 3 nm ahead, closing speed 20 knots
+    cpa, tcpa = cpa_tcpa(10., 10., 0., math.pi, 3.)
+    assert float(cpa) == pytest.approx(0., abs=1e-12)
+    assert float(tcpa) == pytest.approx(0.15)
+
+
+def test_min_dist_points():
+    rx, ry, vx, vy, v0x, v0y = 4., 3., -1., 0., 1., 0.
+    (our_x, our_y), (target_x, target_y) = min_dist_points(rx, ry, vx, vy, v0x, v0y)
+    cpa, tcpa = cpa_tcpa_xy(rx, ry, vx, vy, v0x, v0y)
+    assert (our_x, our_y) == pytest.approx((2., 0.))
+    assert (target_x, target_y) == pytest.approx((2., 3.))
+    assert math.hypot(target_x - our_x, target_y - our_y) == pytest.approx(float(cpa))
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from generator import POINT_COLUMNS, Generator, drop_near_duplicates, load_points, save_chunks
+
+
+def make_generator(n_targets=1):
+    gen = Generator(4, 3.5, 1000, n_tests=300, safe_div_dist=1, n_targets=n_targets, seed=1)
+    gen.unit_size = 100
+    return gen
+
+
+@pytest.mark.parametrize('ext', ['.csv', '.parquet'])
+def test_merged_shards_give_the_same_tests(tmp_path, ext):
+    gen = make_generator(n_targets=2)
+    single = gen.create_tests()
+    shards = [str(tmp_path / ('points_{}' + ext).format(shard)) for shard in range(3)]
+    for shard, filename in enumerate(shards):
+        save_chunks(gen.iter_points(shard, len(shards)), filename, index=False)
+
+    merged = pd.concat(gen.iter_tests(load_points(shards)), ignore_index=True)
+
+    assert len(single) > 0
+    pd.testing.assert_frame_equal(merged, single)
+
+
+def test_pair_targets_of_no_points():
+    gen = make_generator(n_targets=2)
+    partners, paired = gen.pair_targets(pd.DataFrame(columns=POINT_COLUMNS))
+    assert list(partners.columns) == POINT_COLUMNS[1:] and len(partners) == 0
+    assert len(paired) == 0
+    tests = list(gen.iter_tests([pd.DataFrame(columns=POINT_COLUMNS)]))
+    assert sum(len(chunk) for chunk in tests) == 0
+
+
+def make_stratified(bins, quota=20):
+    gen = make_generator()
+    gen.bins = {field: np.array(edges, dtype=float) for field, edges in bins.items()}
+    gen.quota = quota
+    return gen
+
+
+def test_stratified_points_fill_quotas():
+    gen = make_stratified({'course': [-180, -60, 60, 180], 'v_target': [2, 11, 20]})
+    points = pd.DataFrame(gen.create_stratified_points(3.5, gen.rng(0, 0, 0)))
+    coverage = gen.coverage(points)
+    assert len(coverage) == 6 and (coverage == 20).all()
+    assert (points['dist'] == 3.5).all()
+    assert (gen.is_dangerous(points['CPA'], points['TCPA'])).all()
+
+
+def test_stratified_points_skip_unreachable_bins():
+    gen = make_stratified({'dist': [3, 3.75, 5], 'v_target': [2, 11, 20, 30]})
+    points = pd.DataFrame(gen.create_stratified_points(3.5, gen.rng(0, 0, 0)))
+    coverage = gen.coverage(points)
+    assert list(coverage) == [20, 20, 0, 0, 0, 0]
+    table = gen.coverage_table(coverage + gen.coverage(points.assign(dist=4.)), [3.5, 4.])
+    assert list(table['quota']) == [20, 20, 0, 20, 20, 0]
+    assert list(table['points']) == [20, 20, 0, 20, 20, 0]
+
+
+def test_coverage_table_of_units():
+    gen = make_stratified({'course': [-180, 0, 180], 'v_target': [2, 11, 20]}, quota=5)
+    gen.unit_size = gen.n_tests
+    chunks = list(gen.iter_points())
+    points = pd.concat(chunks, ignore_index=True)
+    table = gen.coverage_table(gen.coverage(points), [unit[1] for unit in gen.units()])
+    assert len(chunks) == len(gen.units()) == 2
+    assert list(table['quota']) == [10] * 4
+    assert (table['points'] == table['quota']).all() and (table['filled'] == 1).all()
+    assert table['points'].sum() == len(points)
+
+
+@pytest.mark.parametrize('closed_form', [True, False])
+def test_samplers_keep_velocity_ranges(closed_form):
+    gen = make_generator()
+    rng = np.random.default_rng(0)
+    n = 2000
+    peleng, course_diff = rng.uniform(-np.pi, np.pi, n), rng.uniform(0, 2 * np.pi, n)
+    v_our_range = (np.full(n, 5.), np.full(n, 8.))
+    v_target_range = (np.full(n, 12.), np.full(n, 15.))
+    sampler = gen.danger_region_batch if closed_form else gen.danger_batch
+    is_dang, v0, vt, CPA, TCPA = sampler(3.5, peleng, course_diff, rng=rng, v_our_range=v_our_range,
+                                         v_target_range=v_target_range)
+    assert is_dang.sum() > 100
+    assert ((v0[is_dang] >= 5) & (v0[is_dang] <= 8)).all()
+    assert ((vt[is_dang] >= 12) & (vt[is_dang] <= 15)).all()
+    assert gen.is_dangerous(CPA[is_dang], TCPA[is_dang]).all()
+
+
+def make_test(datadir, dist1=1., course1=10., peleng1=20., speed1=5., dist2=2., course2=30., peleng2=40., speed2=6.):
+    return {'datadir': datadir, 'dist1': dist1, 'course1': course1, 'peleng1': peleng1, 'speed1': speed1,
+            'dist2': dist2, 'course2': course2, 'peleng2': peleng2, 'speed2': speed2, 'safe_diverg': 1, 'speed': 7.}
+
+
+def dedup(*chunks, tolerance=0.01):
+    kept = drop_near_duplicates([pd.DataFrame(chunk) for chunk in chunks], tolerance)
+    return [datadir for chunk in kept for datadir in chunk['datadir']]
+
+
+def test_near_duplicates_in_one_cell_are_dropped():
+    # Cells are 0.12 miles and 3.6 degrees wide
+    chunk = [make_test('a'), make_test('near', dist1=1.05, course1=10.5),
+             make_test('swapped', dist1=2., course1=30., peleng1=40., speed1=6.,
+                       dist2=1., course2=10., peleng2=20., speed2=5.)]
+    assert dedup(chunk, [make_test('next chunk', peleng2=41.)]) == ['a']
+
+
+def test_near_tests_across_cell_edges_are_dropped():
+    assert dedup([make_test('a', dist1=1.19), make_test('b', dist1=1.21)]) == ['a']
+    assert dedup([make_test('a', course1=359.9), make_test('b', course1=0.1)]) == ['a']
+    assert dedup([make_test('a', peleng2=-1.), make_test('b', peleng2=1.)]) == ['a']
+    assert dedup([make_test('a', dist1=1.19),
+                  make_test('swapped', dist1=2., course1=30., peleng1=40., speed1=6.,
+                            dist2=1.21, course2=10., peleng2=20., speed2=5.)]) == ['a']
+    # Tests differ by tolerance in one parameter
+    assert dedup([make_test('a', dist1=1.), make_test('b', dist1=1.13)]) == ['a', 'b']
+    assert dedup([make_test('a', course1=358.), make_test('b', course1=2.)]) == ['a', 'b']
+
+
+def test_kept_tests_are_tolerance_apart():
+    rng = np.random.default_rng(0)
+    n = 300
+    columns = {'dist1': rng.uniform(1, 1.5, n), 'course1': rng.uniform(-20, 20, n), 'peleng1': rng.uniform(350, 370, n),
+               'speed1': rng.uniform(5, 6, n), 'dist2': rng.uniform(1, 1.5, n), 'course2': rng.uniform(-20, 20, n),
+               'peleng2': rng.uniform(350, 370, n), 'speed2': rng.uniform(5, 6, n), 'speed': rng.uniform(7, 8, n),
+               'safe_diverg': rng.integers(1, 3, n)}
+    tests = pd.DataFrame({'datadir': [str(i) for i in range(n)], **columns})
+    tolerance = 0.02
+    kept = set(dedup(tests.iloc[:150], tests.iloc[150:], tolerance=tolerance))
+
+    def near(a, b):
+        if a['safe_diverg'] != b['safe_diverg'] or abs(a['speed'] - b['speed']) / 18 >= tolerance:
+            return False
+
+        def close(i, j):
+            for kind, scale in (('dist', 12), ('course', 360), ('peleng', 360), ('speed', 18)):
+                delta = abs(a[kind + i] - b[kind + j]) % 360 if scale == 360 else abs(a[kind + i] - b[kind + j])
+                if min(delta, scale - delta if scale == 360 else delta) / scale >= tolerance:
+                    return False
+            return True
+        return (close('1', '1') and close('2', '2')) or (close('1', '2') and close('2', '1'))
+
+    rows = tests.to_dict('records')
+    assert 10 < len(kept) < n
+    for k, row in enumerate(rows):
+        earlier = [other for other in rows[:k] if other['datadir'] in kept]
+        # Kept test is not near kept ones, dropped one is near some of them
+        assert any(near(row, other) for other in earlier) == (row['datadir'] not in kept)
+
+
+def test_dedup_of_empty_chunks_and_bad_tolerance():
+    empty = pd.DataFrame([make_test('a')]).iloc[:0]
+    assert dedup(empty, [make_test('a')], empty, [make_test('b')]) == ['a']
+    with pytest.raises(ValueError):
+        dedup([make_test('a')], tolerance=0)
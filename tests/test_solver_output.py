@@ -0,0 +1,36 @@
+import pytest
+
+from solver_output import parse_count, parse_output, parse_timing, parse_warning
+
+
+@pytest.mark.parametrize('line, value', [
+    ('planning time: 3.5 ms', 3.5),
+    ('planning time: 3.5ms', 3.5),
+    ('planning time: 3.5', 3.5),
+    ('planning time = 250 us', .25),
+    ('planning time: 2 usec', .002),
+    ('planning time: 3.5 s', 3500.),
+    ('planning time: 3.5 sec', 3500.),
+    ('planning time: 3.5 secs', 3500.),
+    ('planning time: 1 second', 1000.),
+    ('planning time: 3.5 seconds', 3500.),
+    ('planning time: 3.5 Seconds elapsed', 3500.),
+    ('planning time: 12 milliseconds', 12.),
+    ('planning time: 1e-3 s', 1.),
+])
+def test_timing_units(line, value):
+    assert parse_timing(line) == {'time_planning_ms': pytest.approx(value)}
+
+
+@pytest.mark.parametrize('line', ['planning time: 3 minutes', 'planning: 3 ms', 'time: 3 ms'])
+def test_not_timing(line):
+    assert parse_timing(line) is None
+
+
+def test_parse_output():
+    output = (b'Solver started\nWARNING route: too short\niterations: 12\nplanning time: 3.5 seconds\n'
+              b'WARNING route: too long\nsearch time: 2 ms\nplanning time: 500 ms\n')
+    assert parse_output(output) == {'warn_route': 2, 'n_iterations': 12,
+                                    'time_planning_ms': 4000., 'time_search_ms': 2.}
+    assert parse_count('solver steps = 7') == {'n_solver_steps': 7}
+    assert parse_warning('WARNING: constraints') == {'warn_constraints': 1}
@@ -0,0 +1,110 @@
+import os
+import time
+
+from work_queue import DONE, LEASED, PENDING, DirectoryQueue
+
+
+class Runner:
+    def run_task(self, task):
+        return task * 2
+
+
+def names(queue, state):
+    return sorted(os.listdir(os.path.join(queue.root, state)))
+
+
+def expire(queue, task_id):
+    old = time.time() - 3600
+    os.utime(os.path.join(queue.root, LEASED, task_id), (old, old))
+
+
+def test_claim_complete_results(tmp_path):
+    queue = DirectoryQueue(str(tmp_path))
+    ids = queue.publish([1, 2], Runner(), lease_timeout=60)
+
+    task_id, task, batch = queue.claim()
+    assert (task_id, task) == (ids[0], 1)
+    assert names(queue, PENDING) == [ids[1]] and names(queue, LEASED) == [ids[0]]
+    # Other worker gets the next task
+    other = DirectoryQueue(str(tmp_path))
+    assert other.claim()[0] == ids[1]
+    assert queue.claim() is None
+
+    for claimed in ids:
+        queue.complete(claimed, batch['runner'].run_task(1 if claimed == ids[0] else 2))
+    assert names(queue, LEASED) == []
+    assert dict(queue.results(ids, 60, poll=.01)) == {ids[0]: 2, ids[1]: 4}
+    assert names(queue, DONE) == []
+
+
+def test_expired_lease_is_requeued(tmp_path):
+    queue = DirectoryQueue(str(tmp_path))
+    ids = queue.publish([1], Runner(), lease_timeout=60)
+    queue.claim()
+    assert queue.requeue_expired(60) == 0
+    expire(queue, ids[0])
+    assert queue.requeue_expired(60) == 1
+    assert names(queue, PENDING) == ids
+    # Heartbeat keeps lease alive
+    assert queue.claim()[0] == ids[0]
+    expire(queue, ids[0])
+    queue.heartbeat(ids)
+    assert queue.requeue_expired(60) == 0
+
+
+def test_cancel_pending_and_leased(tmp_path):
+    queue = DirectoryQueue(str(tmp_path))
+    ids = queue.publish([1, 2, 3], Runner(), lease_timeout=60)
+    worker = DirectoryQueue(str(tmp_path))
+    leased, _, _ = worker.claim()
+
+    queue.cancel(ids)
+
+    assert names(queue, PENDING) == [] and names(queue, LEASED) == []
+    # Results of the aborted run are not waited for
+    assert list(queue.results(ids, 60, poll=.01)) == []
+    # Worker of cancelled task finishes it, its result is dropped
+    worker.complete(leased, 2)
+    assert names(queue, DONE) == []
+    assert worker.claim() is None
+
+
+def test_cancelled_task_is_not_requeued(tmp_path):
+    queue = DirectoryQueue(str(tmp_path))
+    ids = queue.publish([1], Runner(), lease_timeout=60)
+    queue.claim()
+    # Lease is back in leased, e.g. worker renamed it while coordinator cancelled
+    queue.cancel(ids)
+    with open(os.path.join(queue.root, LEASED, ids[0]), 'wb') as f:
+        f.write(b'')
+    expire(queue, ids[0])
+    assert queue.requeue_expired(60) == 0
+    assert names(queue, PENDING) == [] and names(queue, LEASED) == []
+
+    # Requeued before cancel: worker skips it
+    ids = queue.publish([2], Runner(), lease_timeout=60)
+    open(os.path.join(queue.root, 'cancelled', ids[0]), 'w').close()
+    assert queue.claim() is None
+    assert names(queue, PENDING) == []
+    queue.reset()
+    assert names(queue, 'cancelled') == []
+
+
+def test_new_run_ignores_tasks_of_reset_run(tmp_path):
+    # Coordinator crashed while worker was running its task, new coordinator resets the queue
+    old = DirectoryQueue(str(tmp_path))
+    old_ids = old.publish([1], Runner(), lease_timeout=60)
+    worker = DirectoryQueue(str(tmp_path))
+    leased, _, _ = worker.claim()
+    new = DirectoryQueue(str(tmp_path))
+    new.reset()
+    ids = new.publish([5], Runner(), lease_timeout=60)
+
+    assert set(ids).isdisjoint(old_ids)
+    assert ids[0].rsplit('-', 1)[0] != leased.rsplit('-', 1)[0]
+    # Result of the old run is dropped, the new task is run
+    worker.complete(leased, 2)
+    assert names(new, DONE) == []
+    task_id, task, batch = worker.claim()
+    worker.complete(task_id, batch['runner'].run_task(task))
+    assert list(new.results(ids, 60, poll=.01)) == [(ids[0], 10)]
@@ -0,0 +1,248 @@
+import os
+import pickle
+import socket
+import time
+import uuid
+from multiprocessing import Pool
+
+PENDING, LEASED, DONE, CANCELLED = 'pending', 'leased', 'done', 'cancelled'
+STOP_FILENAME = 'stop'
+
+
+class DirectoryQueue:
+    """
+    Work queue in a directory shared by coordinator and workers, e.g. over NFS.
+    Coordinator publishes a batch of tasks together with a pickled runner - an object
+    with run_task(task) method. Tasks are files in 'pending'. Worker leases a task by
+    renaming it to 'leased', which succeeds for one worker only, and touches the lease
+    while task runs. Result is written to 'done'. Coordinator returns leases, which
+    were not touched for lease_timeout, back to 'pending', so tasks of dead workers
+    are run again. Cancelled tasks are marked by files in 'cancelled', so neither
+    coordinator nor workers run them again or keep their results.
+    Batch names contain a random token, so tasks and results of a run, which was reset
+    by a new coordinator, never match ids of the new run.
+    lease_timeout must exceed clock skew between nodes.
+    Case paths in tasks must be valid on every node.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        for name in (PENDING, LEASED, DONE, CANCELLED):
+            os.makedirs(os.path.join(self.root, name), exist_ok=True)
+        self.batch = len([name for name in os.listdir(self.root) if name.startswith('batch-')])
+        self.cancelled = set()
+
+    def _path(self, state, name):
+        return os.path.join(self.root, state, name)
+
+    def _is_cancelled(self, name):
+        return os.path.exists(self._path(CANCELLED, name))
+
+    def _batch_path(self, task_id):
+        return os.path.join(self.root, task_id.rsplit('-', 1)[0])
+
+    def _remove(self, state, name):
+        try:
+            os.remove(self._path(state, name))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, filename, data):
+        # Readers never see partially written file
+        tmp = '{}.{}.{}.tmp'.format(filename, socket.gethostname(), os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(tmp, filename)
+
+    @staticmethod
+    def _read(filename):
+        with open(filename, 'rb') as f:
+            return pickle.load(f)
+
+    def reset(self):
+        """
+        Removes tasks and results left by previous runs
+        """
+        for state in (PENDING, LEASED, DONE, CANCELLED):
+            for name in os.listdir(os.path.join(self.root, state)):
+                os.remove(self._path(state, name))
+        for name in os.listdir(self.root):
+            if name.startswith('batch-') or name == STOP_FILENAME:
+                os.remove(os.path.join(self.root, name))
+
+    def publish(self, tasks, runner, lease_timeout):
+        """
+        Publishes batch of tasks, tasks are leased in order of the list
+        @param tasks: list of picklable tasks
+        @param runner: picklable object, which runs tasks with run_task(task)
+        @param lease_timeout: time in seconds, after which lease of silent worker expires
+        @return: list of task ids
+        """
+        self.batch += 1
+        batch = 'batch-{:04d}-{}'.format(self.batch, uuid.uuid4().hex[:12])
+        self._write(os.path.join(self.root, batch), {'runner': runner, 'lease_timeout': lease_timeout})
+        ids = ['{}-{:07d}'.format(batch, i) for i in range(len(tasks))]
+        for task_id, task in zip(ids, tasks):
+            self._write(self._path(PENDING, task_id), task)
+        return ids
+
+    def results(self, ids, lease_timeout, poll=.5):
+        """
+        Waits for results of tasks and returns expired leases to queue
+        @param ids: ids of published tasks
+        @param lease_timeout: time in seconds, after which lease of silent worker expires
+        @param poll: polling interval in seconds
+        @return: generator of (task id, result) in order of completion
+        """
+        waiting = set(ids)
+        while waiting - self.cancelled:
+            found = False
+            for name in os.listdir(os.path.join(self.root, DONE)):
+                if name not in waiting:
+                    continue
+                found = True
+                waiting.discard(name)
+                result = self._read(self._path(DONE, name))
+                os.remove(self._path(DONE, name))
+                # Task may be requeued after worker finished it
+                for state in (PENDING, LEASED):
+                    self._remove(state, name)
+                yield name, result
+            if not found:
+                self.requeue_expired(lease_timeout)
+                time.sleep(poll)
+
+    def cancel(self, ids):
+        """
+        Cancels tasks: pending and leased ones are removed and never returned to queue,
+        results of running ones are dropped by complete. results stops waiting for them.
+        @param ids: ids of tasks
+        """
+        for task_id in ids:
+            # Marker first: task, which is leased just now, is found in leased then
+            open(self._path(CANCELLED, task_id), 'w').close()
+            self.cancelled.add(task_id)
+            self._remove(PENDING, task_id)
+            self._remove(LEASED, task_id)
+
+    def requeue_expired(self, lease_timeout):
+        """
+        Returns leases, which were not touched for lease_timeout, to queue
+        @return: number of returned tasks
+        """
+        now = time.time()
+        requeued = 0
+        for name in os.listdir(os.path.join(self.root, LEASED)):
+            if self._is_cancelled(name):
+                self._remove(LEASED, name)
+                continue
+            try:
+                if now - os.stat(self._path(LEASED, name)).st_mtime > lease_timeout:
+                    os.rename(self._path(LEASED, name), self._path(PENDING, name))
+                    print('Lease of {} expired, task is returned to queue'.format(name))
+                    requeued += 1
+            except FileNotFoundError:
+                pass
+        return requeued
+
+    def claim(self):
+        """
+        Leases next pending task
+        @return: (task id, task, batch info) or None if queue is empty
+        """
+        for name in sorted(os.listdir(os.path.join(self.root, PENDING))):
+            if name.endswith('.tmp'):
+                continue
+            if self._is_cancelled(name):
+                self._remove(PENDING, name)
+                continue
+            try:
+                os.rename(self._path(PENDING, name), self._path(LEASED, name))
+            except FileNotFoundError:
+                # Leased by another worker
+                continue
+            os.utime(self._path(LEASED, name))
+            try:
+                task = self._read(self._path(LEASED, name))
+                batch = self._read(self._batch_path(name))
+            except FileNotFoundError:
+                # Queue was reset
+                continue
+            return name, task, batch
+        return None
+
+    def heartbeat(self, ids):
+        """
+        Prolongs leases of running tasks
+        """
+        for task_id in ids:
+            try:
+                os.utime(self._path(LEASED, task_id))
+            except FileNotFoundError:
+                pass
+
+    def complete(self, task_id, result):
+        """
+        Publishes result of task, result of cancelled task or of task of reset queue is dropped
+        """
+        if not self._is_cancelled(task_id) and os.path.exists(self._batch_path(task_id)):
+            self._write(self._path(DONE, task_id), result)
+        self._remove(LEASED, task_id)
+
+    def stop(self):
+        """
+        Tells workers to exit
+        """
+        open(os.path.join(self.root, STOP_FILENAME), 'w').close()
+
+    def stopped(self):
+        return os.path.exists(os.path.join(self.root, STOP_FILENAME))
+
+
+def run_worker(queue, processes=None, idle_timeout=600., prepare=None, poll=.5):
+    """
+    Runs tasks from queue in local pool, until coordinator stops the queue
+    or there are no tasks for idle_timeout seconds.
+    @param queue: DirectoryQueue
+    @param processes: number of worker processes, default is number of cores
+    @param idle_timeout: time in seconds to wait for tasks
+    @param prepare: function, which adapts runner of batch to this node, returns runner
+    @param poll: polling interval in seconds
+    """
+    processes = processes or os.cpu_count()
+    runners = {}
+    running = {}
+    last_heartbeat = 0
+    lease_timeout = idle_since = None
+    with Pool(processes) as pool:
+        while not queue.stopped():
+            while len(running) < processes:
+                claimed = queue.claim()
+                if claimed is None:
+                    break
+                task_id, task, batch = claimed
+                batch_name = task_id.rsplit('-', 1)[0]
+                if batch_name not in runners:
+                    runners[batch_name] = prepare(batch['runner']) if prepare is not None else batch['runner']
+                lease_timeout = batch['lease_timeout']
+                running[task_id] = pool.apply_async(runners[batch_name].run_task, (task,))
+
+            for task_id in [task_id for task_id, result in running.items() if result.ready()]:
+                try:
+                    result = running.pop(task_id).get()
+                except Exception as ex:
+                    print('Task {} failed: {!r}'.format(task_id, ex))
+                    result = None
+                queue.complete(task_id, result)
+
+            if running:
+                idle_since = None
+                if time.time() - last_heartbeat > lease_timeout / 3:
+                    queue.heartbeat(running)
+                    last_heartbeat = time.time()
+            else:
+                idle_since = idle_since or time.time()
+                if time.time() - idle_since > idle_timeout:
+                    print('No tasks for {} seconds, exiting'.format(idle_timeout))
+                    break
+            time.sleep(poll)